@@ -0,0 +1,426 @@
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import cv2
+import numpy as np
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+RESOLUTIONS = ((1280, 720), (1920, 1080), (2560, 1440))
+TEMPLATE_SIZES = (64, 160, 320)
+THRESHOLDS = (0.8, 0.9, 0.95)
+REPORT_PAGES = (10, 100, 500)
+VIDEO_FRAMES = 200
+# Seconds a new interpreter may take, at p50, to reach each moment
+STARTUP_BUDGET = {"startup/imported": 1.5, "startup/first_step": 2.0}
+
+
+def synthetic_page(width, height, seed=0):
+    """Draw a page that looks like a website: flat
+    background, colored blocks and lines of text, so
+    it compresses like a real screenshot.
+
+    Args:
+        width (int): width of the page
+        height (int): height of the page
+        seed (int, optional): changes the content of the page
+
+    Returns:
+        numpy.ndarray: BGR page
+    """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 245, np.uint8)
+    for _ in range(12):
+        x, y = rng.integers(0, width - 200), rng.integers(0, height - 80)
+        color = tuple(int(value) for value in rng.integers(0, 255, 3))
+        cv2.rectangle(page, (x, y), (x + 200, y + 80), color, -1)
+    for line in range(height // 40):
+        cv2.putText(
+            page,
+            f"Agence {seed} ligne {line} {rng.integers(0, 10**6)}",
+            (20 + int(rng.integers(0, 40)), 30 + line * 40),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            (30, 30, 30),
+            2,
+        )
+    return page
+
+
+def peak_rss_megabytes():
+    """Returns the peak resident memory of the process
+
+    Returns:
+        float: peak RSS in megabytes
+    """
+    try:
+        import resource
+    except ImportError:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            """PROCESS_MEMORY_COUNTERS of the Windows API"""
+
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters),
+            counters.cb,
+        )
+        return counters.PeakWorkingSetSize / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives kilobytes and macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def bench_compare(resolution, size, threshold, iterations=30):
+    """Time Reviseur.lackey_compare on a screenshot
+    where the template shows once.
+
+    Args:
+        resolution (tuple): (width, height) of the screenshot
+        size (int): width of the template, its height is half
+        threshold (float): threshold of the comparison
+        iterations (int, optional): timed comparisons
+
+    Returns:
+        tuple: latencies in seconds and items by latency
+    """
+    from reviseur.reviewer import Reviseur
+
+    width, height = resolution
+    page = cv2.cvtColor(synthetic_page(width, height), cv2.COLOR_BGR2GRAY)
+    top, left = height // 3, width // 2
+    bottom, right = top + size // 2, left + size
+    cv2.imwrite("expected.png", page[top:bottom, left:right])
+
+    reviseur = Reviseur(types.SimpleNamespace(image_options={}))
+    reviseur.step = "bench"
+    for _ in range(2):
+        reviseur.lackey_compare("expected.png", page, threshold)
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        reviseur.lackey_compare("expected.png", page, threshold)
+        latencies.append(time.perf_counter() - start)
+    return latencies, 1
+
+
+def bench_report(pages, iterations=3):
+    """Time the report of a failed run as the reviewer
+    builds it: Report.start, a Report.add for each step
+    and Report.finish drawing and writing the PDF.
+
+    Args:
+        pages (int): number of captures pushed
+        iterations (int, optional): timed reports
+
+    Returns:
+        tuple: latencies in seconds and items by latency
+    """
+    from reviseur.capture import Capture
+    from reviseur.report import Report
+
+    captures = []
+    for index in range(pages):
+        _, png = cv2.imencode(".png", synthetic_page(1280, 720, index))
+        captures.append(Capture(f"{index}_step.png", png.tobytes()))
+
+    latencies = []
+    for _ in range(iterations):
+        report = Report()
+        start = time.perf_counter()
+        report.start("captures/video.avi")
+        for index, capture in enumerate(captures):
+            report.add(capture, f"{index}_step", 1.0, {"expected.png": 0.95})
+        report.finish()
+        latencies.append(time.perf_counter() - start)
+        os.remove(report.output_pdf)
+    return latencies, pages
+
+
+class FakeDriver:
+    """Driver giving prepared screenshots as fast as the
+    recorder asks for them, the page changes every other
+    frame. It measures the time the recorder spends on
+    each frame and stops it after the last one.
+    """
+
+    def __init__(self, frames, stop_event):
+        """Initiates the driver
+
+        Args:
+            frames (list): PNG screenshots to cycle through
+            stop_event (threading.Event): set after the last frame
+        """
+        self.frames = frames
+        self.stop_event = stop_event
+        self.calls = 0
+        self.returned = None
+        self.latencies = []
+
+    def get_screenshot_as_png(self):
+        """Returns the next screenshot
+
+        Returns:
+            bytes: PNG screenshot
+        """
+        now = time.perf_counter()
+        if self.returned is not None:
+            self.latencies.append(now - self.returned)
+        frame = self.frames[(self.calls // 2) % len(self.frames)]
+        self.calls += 1
+        if self.calls >= VIDEO_FRAMES:
+            self.stop_event.set()
+        self.returned = time.perf_counter()
+        return frame
+
+
+class NoWaitEvent(threading.Event):
+    """Event that never sleeps, the recorder loops at
+    once to the next frame instead of waiting its fps.
+    """
+
+    def wait(self, timeout=None):
+        """Returns at once
+
+        Args:
+            timeout (float, optional): ignored
+
+        Returns:
+            bool: True when the event is set
+        """
+        return self.is_set()
+
+
+def bench_video(resolution, buffer_seconds):
+    """Time the processing of each frame by
+    Video.record_screen with a fake driver.
+
+    Args:
+        resolution (tuple): (width, height) of the frames
+        buffer_seconds (float): ring buffer window, None to encode
+
+    Returns:
+        tuple: latencies in seconds and items by latency
+    """
+    from reviseur.video import Video
+
+    frames = [
+        cv2.imencode(".png", synthetic_page(*resolution, seed))[1].tobytes()
+        for seed in range(8)
+    ]
+    os.makedirs("screenshots", exist_ok=True)
+    stop_event = NoWaitEvent()
+    driver = FakeDriver(frames, stop_event)
+    video = Video(driver, buffer_seconds=buffer_seconds)
+    video.record_screen(stop_event)
+    if buffer_seconds is not None:
+        start = time.perf_counter()
+        video.encode_buffer()
+        driver.latencies.append(time.perf_counter() - start)
+    return driver.latencies, 1
+
+
+def bench_startup(moment, launches=5):
+    """Time new interpreters from their launch until the
+    package is imported or the first step of a workflow
+    starts, as paid by each launch of the executable.
+
+    Args:
+        moment (str): "imported" or "first_step"
+        launches (int, optional): timed interpreters
+
+    Returns:
+        tuple: latencies in seconds and items by latency
+    """
+    script = os.path.join(os.path.dirname(BASELINE), "startup.py")
+    latencies = []
+    for _ in range(launches):
+        launched = time.time()
+        output = subprocess.run(
+            [sys.executable, script],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        moments = json.loads(output.splitlines()[-1])
+        latencies.append(moments[moment] - launched)
+    return latencies, 1
+
+
+def cases():
+    """Every benchmark case by name
+
+    Returns:
+        dict: case name and the function running it
+    """
+    found = {}
+    for width, height in RESOLUTIONS:
+        for size in TEMPLATE_SIZES:
+            for threshold in THRESHOLDS:
+                found[f"compare/{width}x{height}/t{size}/{threshold}"] = (
+                    functools.partial(
+                        bench_compare, (width, height), size, threshold
+                    )
+                )
+    for pages in REPORT_PAGES:
+        found[f"report/{pages}"] = functools.partial(bench_report, pages)
+    for width, height in RESOLUTIONS[:2]:
+        found[f"video/encode/{width}x{height}"] = functools.partial(
+            bench_video, (width, height), None
+        )
+        found[f"video/buffer/{width}x{height}"] = functools.partial(
+            bench_video, (width, height), 0
+        )
+    for moment in ("imported", "first_step"):
+        found[f"startup/{moment}"] = functools.partial(bench_startup, moment)
+    return found
+
+
+def run_case(name):
+    """Run a case in a temporary folder and summarize it
+
+    Args:
+        name (str): name of the case
+
+    Returns:
+        dict: latency percentiles, throughput and peak RSS
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            latencies, items = cases()[name]()
+        finally:
+            os.chdir(cwd)
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+    return {
+        "runs": len(latencies),
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "throughput": items * len(latencies) / sum(latencies),
+        "peak_rss": peak_rss_megabytes(),
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """Compare the results with the baseline and the
+    startup cases with their budget
+
+    Args:
+        results (dict): summary of each case
+        baseline (dict): summary of each case in the baseline
+        tolerance (float): part of the baseline allowed above it
+
+    Returns:
+        list: description of each regression
+    """
+    found = []
+    for name, budget in STARTUP_BUDGET.items():
+        p50 = results.get(name, {}).get("p50", 0)
+        if p50 > budget:
+            found.append(f"{name} p50 {p50:.4g} > {budget} budget")
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for key in ("p50", "peak_rss"):
+            if result[key] > reference[key] * (1 + tolerance):
+                found.append(
+                    f"{name} {key} {result[key]:.4g} > "
+                    + f"{reference[key]:.4g} baseline"
+                )
+    return found
+
+
+def main():
+    """Run the cases, each in its own process so the
+    peak RSS is its own, print them and compare them
+    with the baseline.
+
+    Returns:
+        int: 1 when a case regressed, 0 otherwise
+    """
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks of the comparison, report, video "
+        + "and startup"
+    )
+    parser.add_argument("filters", nargs="*", help="case name prefixes")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case)))
+        return 0
+
+    results = {}
+    print(
+        f"{'case':<34}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        + f"{'items/s':>10}{'RSS MB':>9}"
+    )
+    for name in cases():
+        if args.filters and not name.startswith(tuple(args.filters)):
+            continue
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--case", name],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = results[name] = json.loads(output.splitlines()[-1])
+        print(
+            f"{name:<34}{result['p50'] * 1000:>9.2f}"
+            + f"{result['p95'] * 1000:>9.2f}{result['p99'] * 1000:>9.2f}"
+            + f"{result['throughput']:>10.1f}{result['peak_rss']:>9.1f}"
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print(f"Baseline saved: {args.baseline}")
+        return 0
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    else:
+        print(f"No baseline at {args.baseline}, only budgets checked")
+    found = regressions(results, baseline, args.tolerance)
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    """Main function"""
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.driver import DriverManager
+from reviseur.reviewer import Reviseur
+from reviseur.settings import Settings
+
+IMPORTED = time.time()
+PARAM = """<parameters>
+    <workflows>
+        <workflow name="startup">
+            <step name="1_home" action="get" input="https://example.org"/>
+        </workflow>
+    </workflows>
+</parameters>"""
+
+
+class FakeDriver:
+    """Browser opening pages at once and showing a blank one"""
+
+    def __init__(self):
+        """Initiates the driver before the first step"""
+        import cv2
+        import numpy as np
+
+        page = np.full((720, 1280, 3), 245, np.uint8)
+        self.png = cv2.imencode(".png", page)[1].tobytes()
+        self.first_step = None
+
+    def get(self, url):
+        """Note when the first page is opened
+
+        Args:
+            url (str): ignored
+        """
+        if self.first_step is None:
+            self.first_step = time.time()
+
+    def get_screenshot_as_png(self):
+        """Returns the blank page
+
+        Returns:
+            bytes: PNG screenshot
+        """
+        return self.png
+
+
+class FakeDrivers(DriverManager):
+    """Manager giving the fake browser"""
+
+    def acquire(self, settings):
+        """Returns the fake browser
+
+        Args:
+            settings (Settings): ignored
+
+        Returns:
+            FakeDriver: the browser
+        """
+        self.driver = self.driver or FakeDriver()
+        return self.driver
+
+    def release(self, artifacts=None):
+        """Keeps the fake browser
+
+        Args:
+            artifacts (ArtifactPool, optional): ignored
+        """
+
+
+def main():
+    """Launched by bench.py in a new interpreter, it
+    imports the package as main.py does and runs a workflow
+    of a single step on a fake browser, then prints when the
+    imports ended and when the first step started.
+    """
+    with open("param.xml", "w") as file:
+        file.write(PARAM)
+    drivers = FakeDrivers()
+    Reviseur(Settings("param.xml"), drivers, name="startup").run_workflow(
+        "startup"
+    )
+    print(
+        json.dumps(
+            {"imported": IMPORTED, "first_step": drivers.driver.first_step}
+        )
+    )
+
+
+if __name__ == "__main__":
+    """Main function"""
+    main()
@@ -0,0 +1,98 @@
+import contextvars
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ArtifactPool:
+    """Finishes the artifacts of the runs in background
+    workers: the video encoding, the PDF report and the
+    browser quit. The next run of a workflow does not
+    wait for them. The queue is bounded, when too many
+    artifacts are pending the run handing a new one
+    waits for a free slot.
+    """
+
+    def __init__(self, workers=2, queue=8):
+        """Initiates the pool and its workers
+
+        Args:
+            workers (int, optional): artifacts finished at the same time
+            queue (int, optional): artifacts pending, running included,
+            before the runs have to wait
+        """
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="artifacts"
+        )
+        self.slots = threading.BoundedSemaphore(max(queue, workers))
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.waited = 0
+        self.failed = 0
+
+    def _run(self, name, function, *args):
+        """Finish an artifact and free its slot
+
+        Args:
+            name (str): artifact name in the logs
+            function (callable): finishes the artifact
+            *args: arguments of the function
+
+        Returns:
+            object: what the function returned
+        """
+        try:
+            return function(*args)
+        except Exception as err:
+            with self.lock:
+                self.failed += 1
+            logging.exception(f"Could not finish {name}: {err}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+            self.slots.release()
+
+    def submit(self, name, function, *args):
+        """Queue an artifact to be finished, waiting for
+        a free slot when the queue is full. Once the pool
+        is shut down the artifact is finished right away.
+        It runs in a copy of the context of the caller so
+        its logs keep the run_id.
+
+        Args:
+            name (str): artifact name in the logs
+            function (callable): finishes the artifact
+            *args: arguments of the function
+
+        Returns:
+            Future: result of the function
+        """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.waited += 1
+                pending = self.pending
+            logging.warning(
+                f"{pending} artifacts pending, {name} waits for a slot"
+            )
+            self.slots.acquire()
+        with self.lock:
+            self.pending += 1
+        try:
+            return self.executor.submit(
+                contextvars.copy_context().run,
+                self._run,
+                name,
+                function,
+                *args,
+            )
+        except RuntimeError:
+            # Shut down, nothing would run it anymore
+            future = Future()
+            future.set_result(self._run(name, function, *args))
+            return future
+
+    def shutdown(self):
+        """Wait for the pending artifacts and stop the workers"""
+        if self.pending:
+            logging.info(f"Waiting {self.pending} artifacts to finish...")
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,66 @@
+import struct
+
+import cv2
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class Capture:
+    """A screenshot taken from the selenium driver which
+    stays in memory as PNG bytes. It is only decoded when
+    a comparison needs it and only drawn when the report
+    of a failed run asks for it.
+    """
+
+    def __init__(self, name, png):
+        """Initiates the capture with the bytes
+        returned by the driver.
+
+        Args:
+            name (str): file name used when persisted
+            png (bytes): PNG encoded screenshot
+        """
+        self.name = name
+        self.png = png
+        self._gray = None
+
+    @property
+    def gray(self):
+        """Decodes the PNG in grayscale only once
+
+        Returns:
+            numpy.ndarray: grayscale screenshot
+        """
+        if self._gray is None:
+            self._gray = cv2.imdecode(
+                np.frombuffer(self.png, np.uint8), cv2.IMREAD_GRAYSCALE
+            )
+        return self._gray
+
+    @property
+    def size(self):
+        """Returns the size of the screenshot without
+        decoding it, from the decoded image when a
+        comparison already did it or from the PNG header.
+
+        Returns:
+            tuple: (width, height) in pixels
+        """
+        if self._gray is None and self.png[:8] == PNG_SIGNATURE:
+            return struct.unpack(">II", self.png[16:24])
+        return self.gray.shape[1::-1]
+
+    @classmethod
+    def from_driver(cls, driver, name):
+        """Takes the screenshot straight from
+        the driver without touching the disk.
+
+        Args:
+            driver: Selenium Driver
+            name (str): file name used when persisted
+
+        Returns:
+            Capture: the screenshot taken
+        """
+        return cls(name, driver.get_screenshot_as_png())
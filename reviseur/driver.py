@@ -0,0 +1,183 @@
+import logging
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.edge.service import Service
+
+# Origins of the page and of the frames and resources it loaded
+ORIGINS_SCRIPT = """
+const urls = performance.getEntriesByType('resource').map(e => e.name);
+urls.push(location.href);
+return [...new Set(urls.map(url => new URL(url).origin))];
+"""
+
+
+class DriverManager:
+    """Keeps a headless browser alive between the
+    monitoring cycles so each run does not pay the
+    browser start. The session is cleaned after each
+    run and recycled after a number of runs or when
+    it stops answering.
+    """
+
+    def __init__(self, max_runs=1):
+        """Initiates the manager without any browser,
+        it is only started by the first acquire.
+
+        Args:
+            max_runs (int, optional): runs before the browser
+            is recycled. Defaults to 1, a browser for each run.
+        """
+        self.max_runs = max_runs
+        self.driver = None
+        self.browser = None
+        self.runs = 0
+
+    def create(self, settings):
+        """Start the browser defined in the settings
+
+        Args:
+            settings (Settings): Settings from the XML
+
+        Returns:
+            driver: Selenium Driver
+        """
+        options = Options()
+        options.add_argument("--headless")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--window-size=1920x1080")
+        options.add_argument(
+            "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+            + "AppleWebKit/537.36 (KHTML, like Gecko) "
+            + "Chrome/91.0.4472.124 Safari/537.36"
+        )
+        if settings.default_browser == "edge":
+            edge_service = Service(settings.edge_path)
+            driver = webdriver.Edge(options=options, service=edge_service)
+        else:
+            driver = webdriver.Chrome(options=options)
+
+        driver.maximize_window()
+        logging.info(f"Started {settings.default_browser} browser")
+        return driver
+
+    def is_healthy(self):
+        """Check the session still answers commands
+
+        Returns:
+            bool: True when the browser can be reused
+        """
+        try:
+            return self.driver.execute_script("return 1") == 1
+        except Exception:
+            # A dead driver process refuses the connection itself
+            return False
+
+    def acquire(self, settings):
+        """Returns a clean browser for a run, starting
+        a new one if there is none, it is worn out, the
+        browser changed in the settings or it crashed.
+
+        Args:
+            settings (Settings): Settings from the XML
+
+        Returns:
+            driver: Selenium Driver
+        """
+        if self.driver is not None and (
+            self.runs >= self.max_runs
+            or self.browser != settings.default_browser
+            or not self.is_healthy()
+        ):
+            self.quit()
+
+        if self.driver is None:
+            self.driver = self.create(settings)
+            self.browser = settings.default_browser
+            self.runs = 0
+
+        self.runs += 1
+        return self.driver
+
+    def release(self, artifacts=None):
+        """Clean the cookies, cache and storage left by the
+        run and park the browser on a new blank tab. The
+        browser is closed if it will not be reused or the
+        cleaning fails.
+
+        Args:
+            artifacts (ArtifactPool, optional): closes the browser
+            in the background
+        """
+        if self.driver is None:
+            return
+        if self.runs >= self.max_runs:
+            self.quit(artifacts)
+            return
+        try:
+            self.clear_browser_data()
+            self.fresh_tab()
+        except Exception as err:
+            logging.warning(f"Could not reset the browser: {err}")
+            self.quit(artifacts)
+
+    def clear_browser_data(self):
+        """Clear through the DevTools protocol the cookies
+        of every domain, the HTTP cache and the storage of
+        the origins of the last page: local storage,
+        IndexedDB, cache storage and service workers.
+        Cleaning only from the page would keep the data of
+        the other domains, and a consent given in a run
+        would hide the banner from the next one. The session
+        storage belongs to the tab, see fresh_tab.
+        """
+        origins = self.driver.execute_script(ORIGINS_SCRIPT) or []
+        self.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        self.driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        for origin in origins:
+            # about:blank and data: pages have no storage
+            if origin.startswith("http"):
+                self.driver.execute_cdp_cmd(
+                    "Storage.clearDataForOrigin",
+                    {"origin": origin, "storageTypes": "all"},
+                )
+
+    def fresh_tab(self):
+        """Replace the tab of the run by a new blank one,
+        the session storage of the run is closed with it.
+        """
+        used = self.driver.current_window_handle
+        self.driver.switch_to.new_window("tab")
+        fresh = self.driver.current_window_handle
+        self.driver.switch_to.window(used)
+        self.driver.close()
+        self.driver.switch_to.window(fresh)
+
+    def quit(self, artifacts=None):
+        """Close the browser if there is one, it may
+        be called by the scheduler while a run uses it.
+
+        Args:
+            artifacts (ArtifactPool, optional): closes the browser
+            in the background, the manager starts a new one at once
+        """
+        driver, self.driver = self.driver, None
+        if driver is None:
+            return
+        if artifacts is not None:
+            artifacts.submit("browser quit", self.close, driver)
+        else:
+            self.close(driver)
+
+    @staticmethod
+    def close(driver):
+        """Quit a browser no longer held by the manager
+
+        Args:
+            driver: Selenium Driver
+        """
+        try:
+            driver.quit()
+        except Exception as err:
+            # Also a driver process that no longer accepts connections
+            logging.warning(f"Could not quit the browser: {err}")
@@ -0,0 +1,297 @@
+import argparse
+import contextlib
+import logging
+import math
+import os
+import pathlib
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timedelta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    workflow TEXT NOT NULL,
+    started TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    failed_step TEXT,
+    seconds REAL NOT NULL,
+    report TEXT,
+    video TEXT
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    workflow TEXT NOT NULL,
+    started TEXT NOT NULL,
+    step TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    step TEXT,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    step TEXT NOT NULL,
+    image TEXT NOT NULL,
+    score REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS runs_workflow ON runs (workflow, started);
+CREATE INDEX IF NOT EXISTS steps_step ON steps (step, started);
+CREATE INDEX IF NOT EXISTS steps_started ON steps (started);
+CREATE INDEX IF NOT EXISTS phases_run ON phases (run_id);
+CREATE INDEX IF NOT EXISTS scores_run ON scores (run_id);
+"""
+
+
+class RunHistory:
+    """SQLite store of the runs: their outcome, the time
+    of each step and phase, the scores of the expected
+    images and the report and video of the failed ones.
+    A run is written at once in a single transaction, the
+    steps are indexed by name and by time for the queries.
+    """
+
+    def __init__(self, path="history/runs.sqlite"):
+        """Initiates the store, the database is created
+        with its tables by the first connection. A process
+        keeps a single store shared by its runs.
+
+        Args:
+            path (str, optional): SQLite file
+        """
+        self.path = path
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def connect(self):
+        """Open a connection, creating the tables once
+
+        Returns:
+            sqlite3.Connection: connection to the store
+        """
+        pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # Workflows running together wait for each other to write
+        connection = sqlite3.connect(self.path, timeout=10)
+        with self._ready_lock:
+            if not self._ready:
+                # Readers do not block the runs writing
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(SCHEMA)
+                self._ready = True
+        return connection
+
+    def record(self, metrics):
+        """Write a finished run with its steps, phases and
+        scores, a run failing to be stored is only logged.
+
+        Args:
+            metrics (RunMetrics): metrics of the run
+        """
+        totals = metrics.totals()
+        steps = {}
+        for (step, _), seconds in totals.items():
+            if step is not None:
+                steps[step] = steps.get(step, 0) + seconds
+        run = (
+            metrics.run_id,
+            metrics.workflow,
+            metrics.started,
+            bool(metrics.passed),
+            metrics.failed_step,
+            sum(totals.values()),
+            metrics.artifacts.get("report"),
+            metrics.artifacts.get("video"),
+        )
+        try:
+            with contextlib.closing(self.connect()) as connection, connection:
+                connection.execute(
+                    "INSERT INTO runs VALUES (?,?,?,?,?,?,?,?)",
+                    run,
+                )
+                connection.executemany(
+                    "INSERT INTO steps VALUES (?,?,?,?,?,?)",
+                    [
+                        (
+                            metrics.run_id,
+                            metrics.workflow,
+                            metrics.started,
+                            step,
+                            step != metrics.failed_step,
+                            seconds,
+                        )
+                        for step, seconds in steps.items()
+                    ],
+                )
+                connection.executemany(
+                    "INSERT INTO phases VALUES (?,?,?,?)",
+                    [
+                        (metrics.run_id, step, phase, seconds)
+                        for (step, phase), seconds in totals.items()
+                    ],
+                )
+                connection.executemany(
+                    "INSERT INTO scores VALUES (?,?,?,?)",
+                    [(metrics.run_id, *score) for score in metrics.scores],
+                )
+        except sqlite3.Error as err:
+            logging.warning(f"Run not stored in {self.path}: {err}")
+
+    def trend(self, step, days=7):
+        """Failures and latency of a step by day
+
+        Args:
+            step (str): name of the step
+            days (int, optional): days looked back
+
+        Returns:
+            list: (day, runs, failures, p50, p95) by day
+        """
+        with contextlib.closing(self.connect()) as connection:
+            rows = connection.execute(
+                "SELECT substr(started, 1, 10), passed, seconds FROM steps "
+                + "WHERE step = ? AND started >= ? ORDER BY started",
+                (step, since(days)),
+            ).fetchall()
+        by_day = {}
+        for day, passed, seconds in rows:
+            by_day.setdefault(day, []).append((passed, seconds))
+        return [
+            (
+                day,
+                len(results),
+                sum(not passed for passed, _ in results),
+                percentile([seconds for _, seconds in results], 50),
+                percentile([seconds for _, seconds in results], 95),
+            )
+            for day, results in by_day.items()
+        ]
+
+    def flaky(self, days=7, workflow=None):
+        """Rank the steps by how often their result flips
+        from one run to the next, a step failing at every
+        run is broken rather than flaky.
+
+        Args:
+            days (int, optional): days looked back
+            workflow (str, optional): only the steps of this workflow
+
+        Returns:
+            list: (step, runs, failures, flips) most flaky first
+        """
+        query = "SELECT workflow, step, passed FROM steps WHERE started >= ?"
+        parameters = [since(days)]
+        if workflow:
+            query += " AND workflow = ?"
+            parameters.append(workflow)
+        with contextlib.closing(self.connect()) as connection:
+            rows = connection.execute(
+                query + " ORDER BY started", parameters
+            ).fetchall()
+        results = {}
+        for name, step, passed in rows:
+            results.setdefault((name, step), []).append(passed)
+        ranked = [
+            (
+                step,
+                len(passes),
+                passes.count(0),
+                sum(1 for a, b in zip(passes, passes[1:]) if a != b),
+            )
+            for (_, step), passes in results.items()
+        ]
+        return sorted(ranked, key=lambda row: (-row[3], -row[2], row[0]))
+
+    def failures(self, days=7, limit=20):
+        """Last failed runs with their artifacts
+
+        Args:
+            days (int, optional): days looked back
+            limit (int, optional): runs returned
+
+        Returns:
+            list: (started, workflow, failed_step, report, video)
+        """
+        with contextlib.closing(self.connect()) as connection:
+            return connection.execute(
+                "SELECT started, workflow, failed_step, report, video "
+                + "FROM runs WHERE passed = 0 AND started >= ? "
+                + "ORDER BY started DESC LIMIT ?",
+                (since(days), limit),
+            ).fetchall()
+
+
+def since(days):
+    """Returns the start of the period looked back
+
+    Args:
+        days (int): days looked back
+
+    Returns:
+        str: ISO time comparable to the started column
+    """
+    moment = datetime.now() - timedelta(days=days)
+    return moment.isoformat(timespec="seconds")
+
+
+def percentile(values, percent):
+    """Nearest rank percentile
+
+    Args:
+        values (list): measured values
+        percent (float): percentile wanted
+
+    Returns:
+        float: the percentile, None without values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def main(argv=None):
+    """Query the run history from the command line
+
+    Args:
+        argv (list, optional): arguments, by default the command line
+    """
+    parser = argparse.ArgumentParser(description="Query the run history")
+    parser.add_argument("--db", default="history/runs.sqlite")
+    parser.add_argument("--days", type=int, default=7)
+    commands = parser.add_subparsers(dest="command", required=True)
+    trend = commands.add_parser("trend", help="failures and latency by day")
+    trend.add_argument("step")
+    flaky = commands.add_parser("flaky", help="steps ranked by result flips")
+    flaky.add_argument("--workflow")
+    failures = commands.add_parser("failures", help="last failed runs")
+    failures.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"No run history at {args.db}")
+    history = RunHistory(args.db)
+    if args.command == "trend":
+        print(f"{'day':<12}{'runs':>6}{'failed':>8}{'p50 s':>9}{'p95 s':>9}")
+        for day, runs, failed, p50, p95 in history.trend(args.step, args.days):
+            print(f"{day:<12}{runs:>6}{failed:>8}{p50:>9.2f}{p95:>9.2f}")
+    elif args.command == "flaky":
+        print(f"{'step':<30}{'runs':>6}{'failed':>8}{'flips':>7}")
+        for step, runs, failed, flips in history.flaky(
+            args.days, args.workflow
+        ):
+            print(f"{step:<30}{runs:>6}{failed:>8}{flips:>7}")
+    else:
+        for row in history.failures(args.days, args.limit):
+            print(" | ".join(str(value) for value in row))
+
+
+if __name__ == "__main__":
+    """Main function"""
+    sys.exit(main())
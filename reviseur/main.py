@@ -1,25 +1,87 @@
+import functools
+import logging
 import os
 import sys
-import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from reviseur.artifacts import ArtifactPool
+from reviseur.history import RunHistory
+from reviseur.retention import Janitor, RetentionPolicy
 from reviseur.reviewer import Reviseur
-from reviseur.settings import Settings
+from reviseur.scheduler import Job, Scheduler
+from reviseur.settings import SettingsWatcher
+from reviseur.templates import template_cache
 from reviseur.utils import initialize_logs
 
-initialize_logs()
 
+def run_workflow(job, config, artifacts=None, history=None):
+    """Run a single monitored workflow with the
+    current settings, reusing the job browser.
 
-def main():
-    """Simple loop to run the monitoring
-    each 5 minutes.
+    Args:
+        job (Job): scheduled workflow
+        config (SettingsWatcher): reloads the param.xml when changed
+        artifacts (ArtifactPool, optional): finishes the artifacts
+        of the run in the background
+        history (RunHistory, optional): stores the finished runs
     """
-    while True:
-        settings = Settings("param.xml")
-        reviseur = Reviseur(settings)
-        reviseur.workflow_banque_populaire()
+    template_cache.watch_config(config.xml_file)
+    settings = config.current()
+    job.drivers.max_runs = settings.driver_max_runs or 1
+    reviseur = Reviseur(
+        settings,
+        job.drivers,
+        name=job.name,
+        artifacts=artifacts,
+        history=history,
+    )
+    reviseur.run_workflow(job.name)
+
 
-        time.sleep(300)
+def main():
+    """Run the monitored workflows of the param.xml
+    in parallel, each one at its own interval. On
+    Ctrl+C the running workflows end and the pending
+    artifacts are finished before leaving. An invalid
+    param.xml stops it before any run, while running a
+    change is applied to the next runs if it is valid.
+    """
+    config = SettingsWatcher("param.xml")
+    settings = config.current()
+    initialize_logs(**settings.logging)
+    if not settings.workflows:
+        logging.error("No workflow defined in the param.xml")
+        return
+    artifacts = ArtifactPool(**settings.artifacts)
+    # A single store, its schema is only checked by its first run
+    history = RunHistory(**settings.history) if settings.history else None
+    janitor = None
+    if settings.retention:
+        janitor = Janitor(
+            [
+                RetentionPolicy(**folder)
+                for folder in settings.retention["folders"]
+            ],
+            settings.retention["interval"],
+        )
+        janitor.start()
+    scheduler = Scheduler(
+        functools.partial(
+            run_workflow, config=config, artifacts=artifacts, history=history
+        ),
+        workers=settings.workers,
+    )
+    for workflow in settings.workflows:
+        scheduler.add(Job(**workflow))
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        logging.info("Ctrl+C detected! Waiting running workflows...")
+    finally:
+        scheduler.stop()
+        artifacts.shutdown()
+        if janitor is not None:
+            janitor.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,436 @@
+import logging
+
+import cv2
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+
+# Prefixes accepted in the anchor attribute of the param.xml
+LOCATORS = {
+    "id": By.ID,
+    "xpath": By.XPATH,
+    "css": By.CSS_SELECTOR,
+    "name": By.NAME,
+}
+
+
+class Region:
+    """Part of the screenshot where an expected image
+    can appear, so the matching only runs on that crop.
+    It is either absolute in pixels, relative to the
+    screenshot size or the bounding rect of an element.
+    """
+
+    def __init__(self, x, y, width, height, relative=False):
+        """Initiates the region
+
+        Args:
+            x (float): left of the region
+            y (float): top of the region
+            width (float): width of the region
+            height (float): height of the region
+            relative (bool, optional): values are fractions
+            of the screenshot size instead of pixels
+        """
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.relative = relative
+
+    @classmethod
+    def parse(cls, text):
+        """Read a region from the param.xml, written as
+        "x,y,width,height". When every value is at most 1
+        the region is relative to the screenshot size.
+
+        Args:
+            text (str): region text
+
+        Returns:
+            Region: the parsed region
+        """
+        values = [float(value) for value in text.split(",")]
+        if len(values) != 4:
+            raise ValueError(f"Region must be x,y,width,height: {text}")
+        return cls(*values, relative=all(value <= 1 for value in values))
+
+    @classmethod
+    def from_element(cls, driver, anchor, margin=0):
+        """Builds the region from the bounding rect of an
+        element in the page, in screenshot pixels.
+
+        Args:
+            driver: Selenium Driver
+            anchor (str): locator as "id=...", "xpath=..." or "css=..."
+            margin (float, optional): pixels added around the element
+
+        Returns:
+            Region: the region or None if the element is not found
+        """
+        kind, _, value = anchor.partition("=")
+        try:
+            element = driver.find_element(LOCATORS[kind], value)
+            rect = driver.execute_script(
+                "const r = arguments[0].getBoundingClientRect();"
+                + "const s = window.devicePixelRatio || 1;"
+                + "return [r.x * s, r.y * s, r.width * s, r.height * s];",
+                element,
+            )
+        except (KeyError, WebDriverException) as err:
+            logging.info(f"Anchor {anchor} not available: {err}")
+            return None
+        x, y, width, height = rect
+        return cls(
+            x - margin, y - margin, width + 2 * margin, height + 2 * margin
+        )
+
+    def box(self, shape, template_shape):
+        """Returns the region in pixels clamped to the
+        screenshot and at least as big as the template.
+
+        Args:
+            shape (tuple): shape of the screenshot
+            template_shape (tuple): shape of the template
+
+        Returns:
+            tuple: (top, bottom, left, right) of the crop
+        """
+        height, width = shape[:2]
+        x, y, w, h = self.x, self.y, self.width, self.height
+        if self.relative:
+            x, y, w, h = x * width, y * height, w * width, h * height
+
+        w = max(w, template_shape[1])
+        h = max(h, template_shape[0])
+        left = int(min(max(x, 0), width - w))
+        top = int(min(max(y, 0), height - h))
+        return (
+            max(top, 0),
+            min(top + int(round(h)), height),
+            max(left, 0),
+            min(left + int(round(w)), width),
+        )
+
+    def crop(self, image, template_shape):
+        """Crop the screenshot to the region
+
+        Args:
+            image (numpy.ndarray): grayscale screenshot
+            template_shape (tuple): shape of the template
+
+        Returns:
+            numpy.ndarray: view of the screenshot in the region
+        """
+        top, bottom, left, right = self.box(image.shape, template_shape)
+        return image[top:bottom, left:right]
+
+
+class MatchResult:
+    """Where a template was found in an image: the peaks
+    of the score map, kept apart by non-maximum suppression,
+    with the scale and size of the template that matched.
+    """
+
+    def __init__(self, peaks, scale, size):
+        """Initiates the result
+
+        Args:
+            peaks (list): (x, y, score) of each peak
+            scale (float): scale of the template that matched
+            size (tuple): (width, height) of the scaled template
+        """
+        self.peaks = sorted(peaks, key=lambda peak: -peak[2])
+        self.scale = scale
+        self.size = size
+
+    @property
+    def score(self):
+        """Best TM_CCOEFF_NORMED score, -1 when nothing fits"""
+        return self.peaks[0][2] if self.peaks else -1.0
+
+    @property
+    def location(self):
+        """(x, y) of the top left corner of the best peak"""
+        return self.peaks[0][:2] if self.peaks else None
+
+    @property
+    def area(self):
+        """(x, y, width, height) matched by the best peak"""
+        if not self.peaks:
+            return None
+        return (*self.location, *self.size)
+
+    def count(self, min_score):
+        """Returns how many peaks reach a score
+
+        Args:
+            min_score (float): minimum score of a peak
+
+        Returns:
+            int: number of peaks
+        """
+        return sum(1 for _, _, score in self.peaks if score >= min_score)
+
+    def offset(self, left, top):
+        """Move the peaks of a match made in a crop
+        back to the coordinates of the full image.
+
+        Args:
+            left (int): left of the crop
+            top (int): top of the crop
+
+        Returns:
+            MatchResult: the same result
+        """
+        self.peaks = [(x + left, y + top, score) for x, y, score in self.peaks]
+        return self
+
+    def as_dict(self):
+        """Returns the result as plain data for the logs
+
+        Returns:
+            dict: score, peaks, scale and area
+        """
+        return {
+            "score": round(float(self.score), 4),
+            "peaks": [
+                [int(x), int(y), round(float(score), 4)]
+                for x, y, score in self.peaks
+            ],
+            "scale": self.scale,
+            "area": self.area and [int(value) for value in self.area],
+        }
+
+
+class MatchPolicy:
+    """Decides if a match is good enough for an expected
+    image: its best score must reach a minimum and the
+    number of places where it shows can be bounded, both
+    defined for each image in the param.xml.
+    """
+
+    def __init__(self, min_score=0.9, expected_count=None, max_count=None):
+        """Initiates the policy
+
+        Args:
+            min_score (float, optional): score of a peak to count
+            expected_count (int, optional): exact number of peaks
+            max_count (int, optional): maximum number of peaks
+        """
+        self.min_score = min_score
+        self.expected_count = expected_count
+        self.max_count = max_count
+
+    @classmethod
+    def from_options(cls, options, min_score=0.9):
+        """Builds the policy from the attributes of the
+        image tag: minScore, expectedCount and maxCount.
+
+        Args:
+            options (dict): attributes of the image in the param.xml
+            min_score (float, optional): score when not defined
+
+        Returns:
+            MatchPolicy: the policy of the image
+        """
+        expected_count = options.get("expectedCount")
+        max_count = options.get("maxCount")
+        return cls(
+            float(options.get("minScore", min_score)),
+            int(expected_count) if expected_count else None,
+            int(max_count) if max_count else None,
+        )
+
+    def candidates(self):
+        """Returns how many peaks must be searched to
+        tell if there are more than allowed.
+
+        Returns:
+            int: number of peaks to search
+        """
+        return max(self.expected_count or 1, self.max_count or 1) + 1
+
+    def failure(self, result):
+        """Check the result against the policy
+
+        Args:
+            result (MatchResult): result of the matching
+
+        Returns:
+            str: why it failed or None when it passed
+        """
+        count = result.count(self.min_score)
+        if result.score < self.min_score:
+            return f"best score {result.score:.3f} < {self.min_score}"
+        if self.expected_count is not None and count != self.expected_count:
+            return f"found {count} times, expected {self.expected_count}"
+        if self.max_count is not None and count > self.max_count:
+            return f"found {count} times, at most {self.max_count}"
+        return None
+
+
+class TemplateMatcher:
+    """Coarse to fine template matching. The image and
+    the template are first matched at a downsampled level
+    of their pyramid, and only the best candidates are
+    refined at full resolution. A few scales of the
+    template can be tried to absorb DPI or zoom changes
+    between the reference and the monitored machine.
+    Peaks are taken with cv2.minMaxLoc so no index arrays
+    are allocated on the score maps.
+    """
+
+    def __init__(self, scales=(1.0,), levels=2, candidates=3, min_size=12):
+        """Initiates the matcher
+
+        Args:
+            scales (tuple, optional): scales of the template to try
+            levels (int, optional): pyramid levels of the coarse search
+            candidates (int, optional): peaks searched and refined
+            min_size (int, optional): smallest side of the template at
+            the coarse level, fewer levels are used below it
+        """
+        self.scales = tuple(scales)
+        self.levels = levels
+        self.candidates = candidates
+        self.min_size = min_size
+
+    def coarse_levels(self, template):
+        """Returns how many times the template can be
+        halved keeping it above the minimum size.
+
+        Args:
+            template (numpy.ndarray): template at full resolution
+
+        Returns:
+            int: number of pyramid levels
+        """
+        levels = 0
+        side = min(template.shape[:2])
+        while levels < self.levels and side / 2 ** (levels + 1) >= (
+            self.min_size
+        ):
+            levels += 1
+        return levels
+
+    @staticmethod
+    def pyramid(image, levels):
+        """Downsample the image a number of times
+
+        Args:
+            image (numpy.ndarray): image at full resolution
+            levels (int): number of halvings
+
+        Returns:
+            numpy.ndarray: the downsampled image
+        """
+        for _ in range(levels):
+            image = cv2.pyrDown(image)
+        return image
+
+    @staticmethod
+    def peaks(difference, radius, count):
+        """Find the best positions of a score map with
+        non-maximum suppression around each of them. The
+        map is modified, pass a copy to keep it.
+
+        Args:
+            difference (numpy.ndarray): result of matchTemplate
+            radius (tuple): (x, y) distance between two peaks
+            count (int): maximum number of peaks
+
+        Returns:
+            list: (x, y, score) of the peaks from the best one
+        """
+        found = []
+        for _ in range(count):
+            _, score, _, (x, y) = cv2.minMaxLoc(difference)
+            if score <= -1:
+                break
+            found.append((x, y, score))
+            top, left = max(y - radius[1], 0), max(x - radius[0], 0)
+            bottom, right = y + radius[1] + 1, x + radius[0] + 1
+            difference[top:bottom, left:right] = -2
+        return found
+
+    def match_scale(self, image, template, scale, candidates):
+        """Search one scale of the template in the image
+
+        Args:
+            image (numpy.ndarray): grayscale image
+            template (numpy.ndarray): grayscale template
+            scale (float): scale applied to the template
+            candidates (int): peaks searched
+
+        Returns:
+            MatchResult: the peaks or None if it does not fit
+        """
+        if scale != 1:
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            template = cv2.resize(
+                template,
+                (0, 0),
+                fx=scale,
+                fy=scale,
+                interpolation=interpolation,
+            )
+        height, width = template.shape[:2]
+        if height > image.shape[0] or width > image.shape[1]:
+            return None
+
+        levels = self.coarse_levels(template)
+        if levels == 0:
+            difference = cv2.matchTemplate(
+                image, template, cv2.TM_CCOEFF_NORMED
+            )
+            peaks = self.peaks(difference, (width, height), candidates)
+            return MatchResult(peaks, scale, (width, height))
+
+        factor = 2**levels
+        coarse = cv2.matchTemplate(
+            self.pyramid(image, levels),
+            self.pyramid(template, levels),
+            cv2.TM_CCOEFF_NORMED,
+        )
+        radius = (max(width // factor, 1), max(height // factor, 1))
+        peaks = []
+        for x, y, _ in self.peaks(coarse, radius, candidates):
+            # Refine around the candidate at full resolution
+            left = max(min(x * factor - factor, image.shape[1] - width), 0)
+            top = max(min(y * factor - factor, image.shape[0] - height), 0)
+            right = min(x * factor + factor + width, image.shape[1])
+            bottom = min(y * factor + factor + height, image.shape[0])
+            window = cv2.matchTemplate(
+                image[top:bottom, left:right],
+                template,
+                cv2.TM_CCOEFF_NORMED,
+            )
+            _, score, _, (wx, wy) = cv2.minMaxLoc(window)
+            x, y = left + wx, top + wy
+            # Two candidates may refine to the same place
+            if all(
+                abs(x - px) >= width or abs(y - py) >= height
+                for px, py, _ in peaks
+            ):
+                peaks.append((x, y, score))
+        return MatchResult(peaks, scale, (width, height))
+
+    def match(self, image, template, candidates=None):
+        """Search the template in the image at every scale
+
+        Args:
+            image (numpy.ndarray): grayscale image
+            template (numpy.ndarray): grayscale template
+            candidates (int, optional): peaks searched, at least
+            the candidates of the matcher
+
+        Returns:
+            MatchResult: the result of the scale with the best score
+        """
+        candidates = max(candidates or 0, self.candidates)
+        best = MatchResult([], 1.0, template.shape[1::-1])
+        for scale in self.scales:
+            result = self.match_scale(image, template, scale, candidates)
+            if result is not None and result.score > best.score:
+                best = result
+        return best
@@ -0,0 +1,199 @@
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+class RunMetrics:
+    """Time spent in each phase of a workflow run: the
+    locate, action, wait, capture, decode and match of
+    every step, and the driver, video and report phases
+    of the run itself. It also keeps the outcome of the
+    run: the scores of the expected images, the step
+    that failed and the artifacts left.
+    """
+
+    def __init__(self, workflow):
+        """Initiates the metrics of a new run
+
+        Args:
+            workflow (str): name of the workflow
+        """
+        self.workflow = workflow
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.records = []
+        self.scores = []
+        self.passed = None
+        self.failed_step = None
+        self.artifacts = {}
+        self._lock = threading.Lock()
+
+    def add(self, step, phase, seconds):
+        """Record the duration of a phase, the steps
+        may record from several threads.
+
+        Args:
+            step (str): name of the step, None for the run
+            phase (str): name of the phase
+            seconds (float): duration of the phase
+        """
+        with self._lock:
+            self.records.append((step, phase, seconds))
+
+    def add_scores(self, step, scores):
+        """Record the best score of each expected image
+
+        Args:
+            step (str): name of the step
+            scores (dict): best score by image path
+        """
+        with self._lock:
+            self.scores += [(step, *score) for score in scores.items()]
+
+    @contextlib.contextmanager
+    def timer(self, step, phase):
+        """Time the block, even when it raises
+
+        Args:
+            step (str): name of the step, None for the run
+            phase (str): name of the phase
+
+        Yields:
+            None: the block is timed
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(step, phase, time.perf_counter() - start)
+
+    def totals(self):
+        """Sum the durations by step and phase, a step
+        may have several tags or check several images.
+
+        Returns:
+            dict: seconds by (step, phase)
+        """
+        totals = {}
+        with self._lock:
+            for step, phase, seconds in self.records:
+                totals[(step, phase)] = totals.get((step, phase), 0) + seconds
+        return totals
+
+    def lines(self):
+        """Returns the records as JSON lines
+
+        Returns:
+            str: a JSON object by line
+        """
+        with self._lock:
+            records = list(self.records)
+        return "".join(
+            json.dumps(
+                {
+                    "run_id": self.run_id,
+                    "started": self.started,
+                    "workflow": self.workflow,
+                    "passed": self.passed,
+                    "step": step,
+                    "phase": phase,
+                    "seconds": round(seconds, 6),
+                }
+            )
+            + "\n"
+            for step, phase, seconds in records
+        )
+
+
+class MetricsExporter:
+    """Writes the metrics of the runs to a JSON lines
+    file, appended at each run, and to a Prometheus text
+    file holding the last run of each workflow, for the
+    textfile collector of the node exporter. It is shared
+    by the workflows running at the same time.
+    """
+
+    def __init__(self):
+        """Initiates the exporter without any run"""
+        self._last = {}
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _label(value):
+        """Escape a Prometheus label value
+
+        Args:
+            value (str): label value
+
+        Returns:
+            str: escaped value
+        """
+        text = "" if value is None else str(value)
+        return text.replace("\\", "\\\\").replace('"', '\\"')
+
+    def prometheus(self):
+        """Returns the Prometheus text of the runs
+
+        Returns:
+            str: the metrics in the text exposition format
+        """
+        lines = [
+            "# HELP reviseur_phase_seconds Duration of a phase of the "
+            + "last run",
+            "# TYPE reviseur_phase_seconds gauge",
+        ]
+        for workflow, metrics in sorted(self._last.items()):
+            for (step, phase), seconds in metrics.totals().items():
+                lines.append(
+                    "reviseur_phase_seconds{"
+                    + f'workflow="{self._label(workflow)}",'
+                    + f'step="{self._label(step)}",'
+                    + f'phase="{self._label(phase)}"'
+                    + f"}} {seconds:.6f}"
+                )
+        lines += [
+            "# HELP reviseur_runs_total Runs of a workflow",
+            "# TYPE reviseur_runs_total counter",
+        ]
+        for (workflow, status), count in sorted(self._runs.items()):
+            lines.append(
+                f'reviseur_runs_total{{workflow="{self._label(workflow)}",'
+                + f'status="{status}"}} {count}'
+            )
+        return "\n".join(lines) + "\n"
+
+    def export(self, metrics, directory="metrics/"):
+        """Append the run to the JSON lines file and
+        rewrite the Prometheus file, replacing it at once
+        so the collector never reads half of it.
+
+        Args:
+            metrics (RunMetrics): metrics of the run
+            directory (str, optional): folder of the files
+        """
+        path = pathlib.Path(directory)
+        status = "passed" if metrics.passed else "failed"
+        with self._lock:
+            self._last[metrics.workflow] = metrics
+            key = (metrics.workflow, status)
+            self._runs[key] = self._runs.get(key, 0) + 1
+            try:
+                path.mkdir(parents=True, exist_ok=True)
+                with open(path / "metrics.jsonl", "a") as file:
+                    file.write(metrics.lines())
+                temporary = path / "reviseur.prom.tmp"
+                temporary.write_text(self.prometheus())
+                os.replace(temporary, path / "reviseur.prom")
+            except OSError as err:
+                logging.warning(f"Metrics not exported to {path}: {err}")
+
+
+# Shared by every workflow of the process
+exporter = MetricsExporter()
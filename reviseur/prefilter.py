@@ -0,0 +1,204 @@
+import base64
+import json
+import logging
+import os
+import pathlib
+import threading
+
+import cv2
+import numpy as np
+
+from reviseur.matching import MatchResult
+
+# Size of the image compared by the difference hash, 8x8 bits
+HASH_SIZE = (9, 8)
+# Size of the thumbnail kept to confirm a hash match
+THUMBNAIL_SIZE = (32, 18)
+
+
+def dhash(gray):
+    """Difference hash of an image: each bit tells if a
+    pixel of the downsampled image is brighter than the
+    one at its left. Nearly identical pages give hashes
+    a few bits apart.
+
+    Args:
+        gray (numpy.ndarray): grayscale image
+
+    Returns:
+        int: the 64 bits hash
+    """
+    small = cv2.resize(gray, HASH_SIZE, interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(first, second):
+    """Number of bits that differ between two hashes
+
+    Args:
+        first (int): hash
+        second (int): other hash
+
+    Returns:
+        int: distance between the hashes
+    """
+    return (first ^ second).bit_count()
+
+
+class Fingerprint:
+    """Hash and thumbnail of a screenshot, what the
+    prefilter compares instead of the full image.
+    """
+
+    def __init__(self, gray):
+        """Computes the fingerprint
+
+        Args:
+            gray (numpy.ndarray): grayscale screenshot
+        """
+        self.hash = dhash(gray)
+        self.thumbnail = cv2.resize(
+            gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA
+        )
+
+
+class Prefilter:
+    """Remembers the fingerprint of the last screenshot
+    that passed each check, so a page that did not change
+    since is accepted without template matching. A check
+    is skipped when the new screenshot hash is within the
+    Hamming distance and its thumbnail within the pixel
+    tolerance. The entries are kept in a JSON file so they
+    survive a restart, and are dropped when the expected
+    image changes.
+    """
+
+    def __init__(self, path, max_distance=4, tolerance=8):
+        """Initiates the prefilter, the file is read
+        on the first lookup.
+
+        Args:
+            path (str): JSON file of the passed screenshots
+            max_distance (int, optional): hash bits that may differ
+            tolerance (int, optional): pixel difference allowed
+            between the thumbnails
+        """
+        self.path = pathlib.Path(path)
+        self.max_distance = max_distance
+        self.tolerance = tolerance
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Read the entries from disk once, a missing or
+        broken file starts an empty cache.
+        """
+        if self._entries is not None:
+            return
+        try:
+            self._entries = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            self._entries = {}
+        except (OSError, ValueError) as err:
+            logging.warning(f"Prefilter cache {self.path} ignored: {err}")
+            self._entries = {}
+
+    def _save(self):
+        """Write the entries to disk, replacing the file
+        at once so a crash does not leave it truncated.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(self._entries))
+        os.replace(temporary, self.path)
+
+    @staticmethod
+    def _mtime(expected):
+        """Returns the modification time of the expected image
+
+        Args:
+            expected (str): path to image from the .xml
+
+        Returns:
+            int: modification time in nanoseconds
+        """
+        try:
+            return os.stat(expected).st_mtime_ns
+        except OSError:
+            return None
+
+    def lookup(self, key, expected, fingerprint, policy=None):
+        """Returns the result of the last pass when the
+        screenshot looks the same as the one that passed
+        under the same policy.
+
+        Args:
+            key (str): workflow, step and expected image
+            expected (str): path to image from the .xml
+            fingerprint (Fingerprint): of the new screenshot
+            policy (str, optional): options and threshold of the
+            check, a pass recorded under others is not reused
+
+        Returns:
+            MatchResult: the previous result or None to match
+        """
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+        if (
+            entry is None
+            or entry["mtime"] != self._mtime(expected)
+            or entry.get("policy") != policy
+        ):
+            return None
+        if hamming(fingerprint.hash, int(entry["hash"], 16)) > (
+            self.max_distance
+        ):
+            return None
+        thumbnail = np.frombuffer(
+            base64.b64decode(entry["thumbnail"]), np.uint8
+        ).reshape(fingerprint.thumbnail.shape)
+        if cv2.absdiff(fingerprint.thumbnail, thumbnail).max() > (
+            self.tolerance
+        ):
+            return None
+        return MatchResult(
+            [tuple(peak) for peak in entry["peaks"]],
+            entry["scale"],
+            tuple(entry["size"]),
+        )
+
+    def record(self, key, expected, fingerprint, result, policy=None):
+        """Remember a screenshot that passed its check,
+        replacing the pass recorded under another policy.
+
+        Args:
+            key (str): workflow, step and expected image
+            expected (str): path to image from the .xml
+            fingerprint (Fingerprint): of the screenshot
+            result (MatchResult): result of the matching
+            policy (str, optional): options and threshold of the check
+        """
+        entry = {
+            "hash": f"{fingerprint.hash:016x}",
+            "thumbnail": base64.b64encode(
+                fingerprint.thumbnail.tobytes()
+            ).decode(),
+            "mtime": self._mtime(expected),
+            "peaks": [
+                [int(x), int(y), float(score)] for x, y, score in result.peaks
+            ],
+            "scale": result.scale,
+            "size": [int(value) for value in result.size],
+            "policy": policy,
+        }
+        with self._lock:
+            self._load()
+            if self._entries.get(key) == entry:
+                return
+            self._entries[key] = entry
+            try:
+                self._save()
+            except OSError as err:
+                logging.warning(f"Prefilter {self.path} not saved: {err}")
@@ -1,13 +1,21 @@
+import io
 import logging
 import os
 import pathlib
 from datetime import datetime
 
-from PIL import Image
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase.pdfmetrics import stringWidth
-from reportlab.pdfgen import canvas
+import cv2
+import numpy as np
+
+# Width in points of the screenshots in the pages
+IMAGE_WIDTH = 400
+# Decode flags of the PNGs already halved a number of times
+REDUCED_COLOR = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
 
 
 class Report:
@@ -16,30 +24,116 @@ class Report:
     driver. It must create a PDF in it describe
     all the steps until the error who blocked
     the continuation.
+
+    It can be attached to a run from its start: the
+    steps push their captures as they happen and only
+    keep them in memory with the details of the step.
+    The pages are drawn when a failed run finishes the
+    report, a run that passed simply discards it.
+
+    Reportlab is only imported by the first page drawn.
     """
 
-    def __init__(self):
-        """Initiates the report by creating the screenshot
+    def __init__(self, name=None, dpi=150, quality=80):
+        """Initiates the report by creating the reports
         folder and setting the canvas to be worked upon.
+
+        Args:
+            name (str, optional): workflow name added to the file
+            dpi (int, optional): resolution of the screenshots in the page
+            quality (int, optional): JPEG quality of the screenshots
         """
         datetime_now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self.image_dir = "screenshots/"
         pathlib.Path("reports/").mkdir(parents=True, exist_ok=True)
-        self.output_pdf = f"reports/report_{datetime_now}.pdf"
-        self.canvas = canvas.Canvas(self.output_pdf, pagesize=A4)
-        self.title = f"{datetime_now}\nReport for banquepopulaire.fr"
+        prefix = f"report_{name}" if name else "report"
+        self.output_pdf = f"reports/{prefix}_{datetime_now}.pdf"
+        self._canvas = None
+        subject = f"workflow {name}" if name else "the monitored site"
+        self.title = f"{datetime_now}\nReport for {subject}"
+        self.dpi = dpi
+        self.quality = quality
+        self.video_path = None
+        self.pages = []
 
-    def generate_report(self, video_path):
-        """Create the tiple page and add
-        the images in order to PDF.
+    @property
+    def canvas(self):
+        """Creates the canvas of the PDF on first use
+
+        Returns:
+            Canvas: canvas to be worked upon
+        """
+        if self._canvas is None:
+            from reportlab import rl_config
+            from reportlab.lib.pagesizes import A4
+            from reportlab.pdfgen import canvas
+
+            # Embed the images as binary, ASCII85 makes them a quarter
+            # bigger and its pure Python encoder is slower than the rest
+            rl_config.useA85 = 0
+            self._canvas = canvas.Canvas(self.output_pdf, pagesize=A4)
+        return self._canvas
+
+    @canvas.setter
+    def canvas(self, value):
+        """Replaces the canvas of the PDF
+
+        Args:
+            value (Canvas): canvas to be worked upon
+        """
+        self._canvas = value
+
+    def start(self, video_path):
+        """Start the report of a run, its title page
+        gives the path of the video.
 
         Args:
             video_path (str): recorded video location
         """
-        self.create_title_page(video_path)
-        self.add_image_pages()
+        self.video_path = video_path
+        self.pages = []
+
+    def add(self, capture, step=None, seconds=None, scores=None):
+        """Push a capture of the run, its page is
+        only drawn if the report is finished.
+
+        Args:
+            capture (Capture): screenshot of the step
+            step (str, optional): name of the step
+            seconds (float, optional): time the step took
+            scores (dict, optional): best score of each expected image
+        """
+        details = []
+        if step:
+            details.append(step)
+        if seconds is not None:
+            details.append(f"{seconds:.2f}s")
+        for image, score in (scores or {}).items():
+            details.append(f"{os.path.basename(image)}: {score:.3f}")
+        self.pages.append((capture, " - ".join(details)))
+
+    def finish(self):
+        """Draw the title page and the captures pushed
+        so far, then save the PDF
+
+        Returns:
+            str: path to the PDF
+        """
+        self.create_title_page(self.video_path)
+        for capture, details in self.pages:
+            try:
+                self.add_image_page(capture, details)
+            except Exception as err:
+                logging.error(f"Could not draw page: {err}")
+        self.pages = []
         self.canvas.save()
         logging.info(f"PDF saved: {self.output_pdf}")
+        return self.output_pdf
+
+    def discard(self):
+        """Drop the report of a run that passed,
+        nothing is drawn nor written.
+        """
+        self.pages = []
 
     def create_title_page(self, video_path):
         """Creates the title page in the PDF
@@ -49,6 +143,9 @@ class Report:
         Args:
             video_path (str): Path to the execution video
         """
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+
         self.canvas.setFont("Helvetica-Bold", 24)
 
         page_width, page_height = A4
@@ -69,24 +166,6 @@ class Report:
         )
         self.canvas.showPage()
 
-    def add_image_pages(self):
-        """Loop over the screenshots taken
-        on the reviewer process and join them
-        in the PDF.
-        """
-        # Loop over images and add them to the report
-        image_files = sorted(
-            (
-                entry
-                for entry in os.scandir(self.image_dir)
-                if entry.name.lower().endswith(".png")
-            ),
-            key=lambda entry: entry.stat().st_mtime,
-        )
-
-        for entry in image_files:
-            self.add_image_page(entry.path)
-
     def sanitize_filename(self, filename):
         """Given that the filename for the
         snapshots generated in the reviewer
@@ -111,24 +190,62 @@ class Report:
         step_number = base_name.split(" ")[0]
         return f"Step {step_number} {base_name[len(step_number):].strip()}"
 
-    def add_image_page(self, image_path):
+    def page_image(self, capture):
+        """Downscale the screenshot once to its size in the
+        page and compress it as JPEG in memory, so the PDF
+        does not embed the full resolution PNG. The PNG is
+        decoded already halved when it is twice as big.
+
+        Args:
+            capture (Capture): screenshot to be added
+
+        Returns:
+            tuple: ImageReader of the JPEG and the aspect ratio
+        """
+        from reportlab.lib.utils import ImageReader
+
+        width, height = capture.size
+        target = int(IMAGE_WIDTH / 72 * self.dpi)
+        factor = max(
+            (factor for factor in REDUCED_COLOR if width >= target * factor),
+            default=1,
+        )
+        image = cv2.imdecode(
+            np.frombuffer(capture.png, np.uint8), REDUCED_COLOR[factor]
+        )
+        if image.shape[1] > target:
+            # Less than halved, linear does not alias and is much faster
+            image = cv2.resize(
+                image,
+                (target, max(round(height * target / width), 1)),
+                interpolation=cv2.INTER_LINEAR,
+            )
+        _, jpeg = cv2.imencode(
+            ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        )
+        return ImageReader(io.BytesIO(jpeg.tobytes())), width / height
+
+    def add_image_page(self, capture, details=None):
         """Join any image from the steps taken
         and add to it a text that changes in case
         of error.
 
         Args:
-            image_path (str): Screenshot to be added
+            capture (Capture): Screenshot to be added
+            details (str, optional): step, timing and scores
+            written under the screenshot
         """
-        screenshot = Image.open(image_path)
-        aspect_ratio = screenshot.width / screenshot.height
-        new_width = 400
+        from reportlab.lib import colors
+
+        image, aspect_ratio = self.page_image(capture)
+        new_width = IMAGE_WIDTH
         new_height = new_width / aspect_ratio
 
         self.canvas.drawImage(
-            image_path, 25, 250, width=new_width, height=new_height
+            image, 25, 250, width=new_width, height=new_height
         )
 
-        image_path = image_path.replace("screenshots/", "")
+        image_path = os.path.basename(capture.name)
         if "FAILED" in image_path:
             self.canvas.setFont("Helvetica-Bold", 12)
             self.canvas.setFillColor(colors.red)
@@ -140,4 +257,8 @@ class Report:
             self.canvas.drawString(
                 30, 275 + new_height, self.sanitize_filename(image_path)
             )
+        if details:
+            self.canvas.setFont("Helvetica", 9)
+            self.canvas.setFillColor(colors.black)
+            self.canvas.drawString(30, 235, details)
         self.canvas.showPage()
@@ -0,0 +1,210 @@
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+
+# Seconds a file must be left alone before being compressed
+COMPRESS_IDLE = 3600
+
+
+def gzip_namer(name):
+    """Name of a rotated log once compressed
+
+    Args:
+        name (str): default name of the rotated log
+
+    Returns:
+        str: name with the gzip extension
+    """
+    return name + ".gz"
+
+
+def gzip_rotator(source, dest):
+    """Compress the rotated log and remove it
+
+    Args:
+        source (str): log being rotated
+        dest (str): compressed log to create
+    """
+    with open(source, "rb") as log, gzip.open(dest, "wb") as compressed:
+        shutil.copyfileobj(log, compressed)
+    os.remove(source)
+
+
+class RetentionPolicy:
+    """Caps of a folder of artifacts: the age of its
+    files, how many may be kept and their total size.
+    The oldest files are removed first. With compress,
+    the files left alone for a while are gzipped.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_age_days=None,
+        max_files=None,
+        max_megabytes=None,
+        compress=False,
+    ):
+        """Initiates the policy, a cap left to None
+        is not enforced.
+
+        Args:
+            path (str): folder of the artifacts
+            max_age_days (float, optional): days a file is kept
+            max_files (int, optional): files kept
+            max_megabytes (float, optional): total size kept
+            compress (bool, optional): gzip the idle files
+        """
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_files = max_files
+        self.max_megabytes = max_megabytes
+        self.compress = compress
+
+    def expired(self, files, now):
+        """Select the files over the caps
+
+        Args:
+            files (list): (path, mtime, size) of each file
+            now (float): current time
+
+        Returns:
+            list: paths to remove, oldest first
+        """
+        kept = sorted(files, key=lambda file: file[1], reverse=True)
+        if self.max_age_days is not None:
+            oldest = now - self.max_age_days * 86400
+            kept = [file for file in kept if file[1] >= oldest]
+        if self.max_files is not None:
+            kept = kept[: self.max_files]
+        if self.max_megabytes is not None:
+            budget = self.max_megabytes * 1024 * 1024
+            total = 0
+            for index, (_, _, size) in enumerate(kept):
+                total += size
+                if total > budget:
+                    kept = kept[:index]
+                    break
+        kept = {path for path, _, _ in kept}
+        return [
+            path
+            for path, _, _ in sorted(files, key=lambda file: file[1])
+            if path not in kept
+        ]
+
+
+class Janitor:
+    """Enforces the retention policies in a background
+    thread, so the runs never wait for the folders to be
+    cleaned. The files held by the logging handlers are
+    never touched.
+    """
+
+    def __init__(self, policies, interval=600):
+        """Initiates the janitor without starting it
+
+        Args:
+            policies (list): RetentionPolicy of each folder
+            interval (float, optional): seconds between sweeps
+        """
+        self.policies = policies
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="janitor", daemon=True
+        )
+        self.removed = 0
+        self.compressed = 0
+
+    @staticmethod
+    def protected():
+        """Files written by the logging handlers, also
+        the ones behind the listener of a queue handler.
+
+        Returns:
+            set: absolute paths of the open logs
+        """
+        handlers = list(logging.getLogger().handlers)
+        for handler in logging.getLogger().handlers:
+            listener = getattr(handler, "listener", None)
+            if listener is not None:
+                handlers += listener.handlers
+        return {
+            os.path.abspath(handler.baseFilename)
+            for handler in handlers
+            if hasattr(handler, "baseFilename")
+        }
+
+    def compress_idle(self, files, now):
+        """Gzip the files of the folder left alone for a
+        while, the compressed file keeps the time of the
+        original so the age cap still applies to it.
+
+        Args:
+            files (list): (path, mtime, size) of each file
+            now (float): current time
+
+        Returns:
+            list: (path, mtime, size) of each file afterwards
+        """
+        result = []
+        for path, mtime, size in files:
+            if path.endswith(".gz") or mtime > now - COMPRESS_IDLE:
+                result.append((path, mtime, size))
+                continue
+            try:
+                gzip_rotator(path, path + ".gz")
+                os.utime(path + ".gz", (mtime, mtime))
+                self.compressed += 1
+                path += ".gz"
+                size = os.path.getsize(path)
+            except OSError as err:
+                logging.warning(f"Could not compress {path}: {err}")
+            result.append((path, mtime, size))
+        return result
+
+    def sweep(self):
+        """Apply every policy once"""
+        now = time.time()
+        protected = self.protected()
+        for policy in self.policies:
+            try:
+                files = [
+                    (entry.path, entry.stat().st_mtime, entry.stat().st_size)
+                    for entry in os.scandir(policy.path)
+                    if entry.is_file()
+                    and os.path.abspath(entry.path) not in protected
+                ]
+            except FileNotFoundError:
+                continue
+            if policy.compress:
+                files = self.compress_idle(files, now)
+            for path in policy.expired(files, now):
+                try:
+                    os.remove(path)
+                    self.removed += 1
+                except OSError as err:
+                    logging.warning(f"Could not remove {path}: {err}")
+
+    def run(self):
+        """Sweep at once and then at each interval until stopped"""
+        while True:
+            try:
+                self.sweep()
+            except Exception as err:
+                logging.exception(f"Retention sweep failed: {err}")
+            if self.stop_event.wait(self.interval):
+                return
+
+    def start(self):
+        """Start the janitor thread"""
+        self.thread.start()
+
+    def stop(self):
+        """Stop the janitor thread after its current sweep"""
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
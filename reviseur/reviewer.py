@@ -1,29 +1,32 @@
+import contextvars
+import functools
+import json
 import logging
 import os
-import pathlib
 import sys
+import threading
 import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import cv2
-import numpy as np
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.webdriver.edge.service import Service
 
+from reviseur.capture import Capture
+from reviseur.driver import DriverManager
+from reviseur.matching import MatchPolicy, Region, TemplateMatcher
+from reviseur.metrics import RunMetrics, exporter
+from reviseur.prefilter import Fingerprint, Prefilter
 from reviseur.report import Report
 from reviseur.settings import Settings
+from reviseur.templates import template_cache
+from reviseur.utils import set_log_context
 from reviseur.video import Video
-
-# Suppress only DeprecationWarnings
-# See: https://github.com/glitchassassin/lackey/issues/127
-sys.stderr = open(os.devnull, "w")
-import lackey  # noqa: E402
-
-sys.stderr = sys.__stderr__
+from reviseur.waits import Waiter
+from reviseur.workflow import compile_plan
 
 
 class Reviseur:
@@ -34,28 +37,119 @@ class Reviseur:
     the browser driver itself.
     """
 
-    def __init__(self, settings):
+    def __init__(
+        self, settings, drivers=None, name=None, artifacts=None, history=None
+    ):
         """Initiates the reviseur class by
-        defining the settings and lackey
-        functions.
+        defining the settings.
 
         Args:
             settings (Settings): Settings from the XML
+            drivers (DriverManager, optional): keeps the browser
+            between runs, by default a new one is used for each run
+            name (str, optional): workflow name, when given the run
+            gets its own screenshot folder so workflows can run together
+            artifacts (ArtifactPool, optional): finishes the video,
+            report and browser quit in the background, by default
+            the run does it before returning
+            history (RunHistory, optional): stores the finished runs
         """
         self.settings: Settings = settings
-        pathlib.Path("screenshots/").mkdir(parents=True, exist_ok=True)
-        # Atributing here in case we need further configuration
-        self.lackey: lackey = lackey
+        self.drivers: DriverManager = drivers or DriverManager()
+        self.name = name
+        self.artifacts = artifacts
+        self.history = history
+        self.waiter = None
+        self.driver = None
+        self.matcher = TemplateMatcher()
+        self.prefilter = None
+        self.metrics = RunMetrics(name)
+        self.report = None
+        self.scores = {}
+        self.step = None
+
+    @functools.cached_property
+    def lackey(self):
+        """Lackey is only imported when one of its features
+        is used, it loads a whole GUI automation stack which
+        the matching does not need.
+
+        Returns:
+            module: the lackey module
+        """
+        # Lackey raises DeprecationWarnings on import
+        # See: https://github.com/glitchassassin/lackey/issues/127
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            import lackey
+        return lackey
 
     def click_element(self, element):
         """Click the element and wait
-        a time before returning
+        the page to be ready before returning
 
         Args:
             element (driver): driver element
         """
         element.click()
-        time.sleep(1)
+        self.wait_ready()
+
+    def wait_ready(self, expected=None, threshold=0.9):
+        """Wait the page to settle after an action or,
+        when an expected image is given, until it shows
+        in the driver with the score its comparison will
+        require. Without a waiter it returns at once.
+
+        Args:
+            expected (str, optional): path to image from the .xml
+            threshold (float, optional): score of the step, unless
+            the image has its own minScore
+        """
+        if self.waiter is None:
+            return
+        if expected is None:
+            self.waiter.settle(self.step)
+        else:
+            policy = MatchPolicy.from_options(
+                self.settings.image_options.get(expected, {}), threshold
+            )
+            self.waiter.until_matches(self.step, expected, policy.min_score)
+
+    def capture(self, driver, name):
+        """Take a screenshot of the driver and keep it
+        in memory, it is only drawn in the report of a
+        failed run.
+
+        Args:
+            driver: Selenium Driver
+            name (str): file name of the screenshot
+
+        Returns:
+            Capture: the screenshot taken
+        """
+        return Capture.from_driver(driver, name)
+
+    def search_region(self, expected):
+        """Returns the region of the screenshot where the
+        expected image is searched, defined in the param.xml
+        by a region attribute or by the anchor of an element.
+
+        Args:
+            expected (str): path to image from the .xml
+
+        Returns:
+            Region: the region or None to search the full page
+        """
+        options = self.settings.image_options.get(expected, {})
+        if "region" in options:
+            return Region.parse(options["region"])
+        if "anchor" in options and self.driver is not None:
+            return Region.from_element(
+                self.driver,
+                options["anchor"],
+                float(options.get("margin", 0)),
+            )
+        return None
 
     def lackey_compare(self, expected, actual, threshold=0.9):
         """This function is based on the following article:
@@ -64,239 +158,405 @@ class Reviseur:
         With this we can receive images from the xml and check them
         against the full screen renderization of the selenium driver
 
-        It is configurable with a threshold that indicate the differece
-        between the images.
+        The image is found when the best score of the match reaches
+        the threshold, which the param.xml can override for each image
+        with minScore. It can also require the image to show exactly
+        expectedCount times or at most maxCount times. When the
+        param.xml gives a region for the image only that crop is
+        searched, falling back to the full page when the image is not
+        found in it. The search itself is done by the coarse to fine
+        TemplateMatcher, and skipped when the prefilter knows the
+        screenshot looks like the last one that passed.
 
         So it functions like an assert() if not asserted them
         e generate a report and video.
 
         Args:
             expected (str): path to image from the .xml
-            actual (str): path to image generate by selenium
-            threshold (float, optional): algorithm threshold.
+            actual (str | numpy.ndarray): path to image generate
+            by selenium or the grayscale screenshot already decoded
+            threshold (float, optional): minimum score of the match
+
+        Returns:
+            MatchResult: where the image was found
 
         Raises:
             Exception: Image is not compatible to what the driver sees
         """
-        template = cv2.imread(expected, 0)
-        actual = cv2.imread(actual, 0)
-
-        if (
-            template.shape[0] > actual.shape[0]
-            or template.shape[1] > actual.shape[1]
-        ):
-            scale_factor = min(
-                actual.shape[0] / template.shape[0],
-                actual.shape[1] / template.shape[1],
-            )
-            template = cv2.resize(
-                template, (0, 0), fx=scale_factor, fy=scale_factor
+        if isinstance(actual, str):
+            actual = cv2.imread(actual, 0)
+        options = self.settings.image_options.get(expected, {})
+        policy = MatchPolicy.from_options(options, threshold)
+        key = f"{self.name}/{self.step}/{expected}"
+        # A pass is only reused while the options of the image are the same
+        signature = json.dumps(
+            {**options, "threshold": threshold}, sort_keys=True
+        )
+        fingerprint = None
+        if self.prefilter is not None:
+            fingerprint = Fingerprint(actual)
+            result = self.prefilter.lookup(
+                key, expected, fingerprint, policy=signature
             )
-
-        template = template[: actual.shape[0], : actual.shape[1]]
-        difference = cv2.matchTemplate(actual, template, cv2.TM_CCOEFF_NORMED)
-
-        # Here we separate all the parts of image that were out
-        # of the threshold and depending of number of parts
-        # we assume that the image is too diferent hence
-        # raising an Exception
-        loc = np.where(difference >= threshold)
-        logging.info(f"{self.step} Difference Score of: {len(loc[0])}")
-        if len(loc[0]) > 100:
+            if result is not None and policy.failure(result) is None:
+                self.scores[expected] = result.score
+                self.log_match(expected, policy, result, None, True)
+                return result
+
+        # Decoded and fitted once per process, see TemplateCache
+        template = template_cache.fitted(expected, actual.shape)
+
+        result = None
+        region = self.search_region(expected)
+        if region is not None:
+            top, _, left, _ = region.box(actual.shape, template.shape)
+            result = self.matcher.match(
+                region.crop(actual, template.shape),
+                template,
+                policy.candidates(),
+            ).offset(left, top)
+            if result.score < policy.min_score:
+                logging.info(f"{self.step} not in its region, full search")
+                result = None
+        if result is None:
+            result = self.matcher.match(actual, template, policy.candidates())
+
+        self.scores[expected] = result.score
+        failure = policy.failure(result)
+        self.log_match(expected, policy, result, failure, False)
+        if failure is not None:
             logging.info(
-                "Expected image don't match actual page! Preparing Report..."
+                f"Expected image don't match actual page, {failure}! "
+                + "Preparing Report..."
             )
             raise Exception("Inconsistency")
+        if fingerprint is not None:
+            self.prefilter.record(
+                key, expected, fingerprint, result, policy=signature
+            )
+        return result
 
-    def step_tout_acepter(self, driver):
-        """First step accept the cookie warning
+    def log_match(self, expected, policy, result, failure, prefiltered):
+        """Log the result of a comparison as a JSON line
 
         Args:
-            driver: Selenium Driver
+            expected (str): path to image from the .xml
+            policy (MatchPolicy): policy of the image
+            result (MatchResult): result of the matching
+            failure (str): why it failed or None when it passed
+            prefiltered (bool): the matching was skipped
         """
-        self.step = "1_tout_acepter"
-        driver.get("https://www.banquepopulaire.fr")
-        driver.save_screenshot("screenshots/tout_acepter_before_click.png")
-        self.lackey_compare(
-            self.settings.tout_accepter,
-            "screenshots/tout_acepter_before_click.png",
+        logging.info(
+            f"{self.step} match "
+            + json.dumps(
+                {
+                    "step": self.step,
+                    "expected": expected,
+                    "min_score": policy.min_score,
+                    "count": result.count(policy.min_score),
+                    "passed": failure is None,
+                    "prefiltered": prefiltered,
+                    **result.as_dict(),
+                }
+            )
         )
 
-    def step_consent_prompt_submit(self, driver):
-        """Second step click the consent prompt
+    def compare_all(self, expected, actual, threshold=0.9):
+        """Compare several images against the same screenshot,
+        each one in its own thread. OpenCV releases the GIL while
+        matching so the images are searched at the same time, and
+        every thread reads the same decoded screenshot.
 
         Args:
-            driver: Selenium Driver
-        """
-        self.step = "2_consent_prompt_submit"
-        consent_prompt_submit = driver.find_element(
-            By.ID, "consent_prompt_submit"
-        )
-        self.click_element(consent_prompt_submit)
+            expected (list): paths to images from the .xml
+            actual (str | numpy.ndarray): path to image generate
+            by selenium or the grayscale screenshot already decoded
+            threshold (float, optional): minimum score of the match
 
-    def step_trouver_une_agence(self, driver):
-        """Third step scroll to an element
-        then click in them
+        Returns:
+            dict: MatchResult of each expected image
+
+        Raises:
+            Exception: An image is not compatible to what the driver sees
+        """
+        if isinstance(actual, str):
+            actual = cv2.imread(actual, 0)
+        with ThreadPoolExecutor(
+            max_workers=min(len(expected), os.cpu_count() or 1),
+            thread_name_prefix=threading.current_thread().name,
+        ) as executor:
+            futures = {
+                # Each comparison logs in a copy of the step context
+                image: executor.submit(
+                    contextvars.copy_context().run,
+                    self.lackey_compare,
+                    image,
+                    actual,
+                    threshold,
+                )
+                for image in expected
+            }
+        # Every image is compared and logged before a failure is raised
+        return {image: future.result() for image, future in futures.items()}
+
+    def image(self, tag):
+        """Returns the path of an expected image
 
         Args:
-            driver: Selenium Driver
+            tag (str): tag of the image in the param.xml
+
+        Returns:
+            str: path to image from the .xml
         """
-        self.step = "3_trouver_une_agence"
-        agence = driver.find_element(
-            By.XPATH,
-            "//p[@class='font-text-body-bold']"
-            + "[normalize-space()='Trouver une agence']",
-        )
-        actions = ActionChains(driver)
-        actions.move_to_element(agence).perform()
-        driver.execute_script("window.scrollBy(0, 1000);")
-        time.sleep(1)
-        driver.save_screenshot("screenshots/trouver_une_agence_click.png")
-        self.lackey_compare(
-            self.settings.trouver_une_agence,
-            "screenshots/trouver_une_agence_click.png",
-        )
-        self.click_element(agence)
+        return getattr(self.settings, Settings.camel_to_snake(tag))
 
-    def step_rue_search(self, driver):
-        """Fourth step type the name of
-        the street
+    def action_get(self, driver, element, text):
+        """Open an url
 
         Args:
             driver: Selenium Driver
+            element: unused, the step has no locator
+            text (str): url to open
         """
-        self.step = "4_rue_search"
-        rue_search = driver.find_element(By.ID, "em-search-form__searchstreet")
-        self.click_element(rue_search)
-        rue_search.send_keys("Lyon")
-        driver.save_screenshot("screenshots/type_rue_search.png")
-        self.lackey_compare(
-            self.settings.rue_type,
-            "screenshots/type_rue_search.png",
-        )
+        driver.get(text)
 
-    def step_code_postal(self, driver):
-        """Fifth step type the postal code
+    def action_click(self, driver, element, text):
+        """Click the element
 
         Args:
             driver: Selenium Driver
+            element: element of the step
+            text (str): unused
         """
-        self.step = "5_code_postal"
-        code_postal = driver.find_element(By.ID, "em-search-form__searchcity")
-        self.click_element(code_postal)
-        code_postal.send_keys("69000")
-        driver.save_screenshot("screenshots/type_code_postal.png")
-        self.lackey_compare(
-            self.settings.code_postal,
-            "screenshots/type_code_postal.png",
-        )
+        self.click_element(element)
 
-    def step_submit_addr(self, driver):
-        """Sixth step click on the rechercher
-        button
+    def action_type(self, driver, element, text):
+        """Click the element and type the text in it
 
         Args:
             driver: Selenium Driver
+            element: element of the step
+            text (str): text to type
         """
-        self.step = "6_submit_addr"
-        submit_addr = driver.find_element(
-            By.XPATH,
-            '//*[@id="em-search-form"]/div/div[2]/fieldset[2]/div[2]/button',
-        )
-        self.click_element(submit_addr)
-        driver.save_screenshot("screenshots/rechercher_click.png")
-        self.lackey_compare(
-            self.settings.rechercher_click,
-            "screenshots/rechercher_click.png",
-        )
+        self.click_element(element)
+        element.send_keys(text)
 
-    def step_geocoder(self, driver):
-        """Seventh click on the right
-        address in the list
+    def action_scroll(self, driver, element, text):
+        """Move the mouse over the element, when there
+        is one, and scroll the page down
 
         Args:
             driver: Selenium Driver
+            element: element of the step or None
+            text (str): pixels to scroll
         """
-        self.step = "7_geocoder"
-        geocoder = driver.find_element(
-            By.XPATH, '//*[@id="cgeocoder29_street_1"]'
-        )
-        self.click_element(geocoder)
-        time.sleep(8)
-        driver.save_screenshot("screenshots/find_cinq_agences_banque.png")
-        self.lackey_compare(
-            self.settings.cinq_agences_banque,
-            "screenshots/find_cinq_agences_banque.png",
-        )
+        if element is not None:
+            ActionChains(driver).move_to_element(element).perform()
+        driver.execute_script(f"window.scrollBy(0, {int(text or 0)});")
 
-    def step_quatre_detail(self, driver):
-        """Eighth step hover the mouse
-        over the quatre image and check
-        if new content is loaded
+    def action_move_click(self, driver, element, text):
+        """Move the mouse over the element and click
+        there, for elements that only react to the mouse
 
         Args:
             driver: Selenium Driver
+            element: element of the step
+            text (str): unused
         """
-        self.step = "8_quatre_detail"
-        quatre_detail = driver.find_element(
-            By.XPATH,
-            "/html/body/div[2]/main/div[2]/div/div[3]/div/div/div/"
-            + "div[1]/div[6]/div[2]",
-        )
-        ActionChains(driver).move_to_element(quatre_detail).move_by_offset(
+        ActionChains(driver).move_to_element(element).move_by_offset(
             0, 0
         ).click().perform()
-        time.sleep(5)
-        driver.save_screenshot("screenshots/find_quatre_detail.png")
-        self.lackey_compare(
-            self.settings.quatre_detail,
-            "screenshots/find_quatre_detail.png",
-        )
 
-    def workflow_banque_populaire(self):
+    def run_step(self, driver, step):
+        """Run a step of the workflow: find its element,
+        do its action, wait for the page and check the
+        expected images on a screenshot.
+
+        Args:
+            driver: Selenium Driver
+            step (Step): the compiled step
+        """
+        self.step = step.name
+        set_log_context(step=step.name)
+        start = time.perf_counter()
+        timer = functools.partial(self.metrics.timer, step.name)
+        element = None
+        if step.locator is not None:
+            with timer("locate"):
+                element = driver.find_element(*step.locator)
+        with timer("action"):
+            action = getattr(self, f"action_{step.action}")
+            action(driver, element, step.text)
+
+        with timer("wait"):
+            if step.wait == "settle":
+                self.wait_ready()
+            elif step.wait == "visible" and self.waiter is not None:
+                self.waiter.until_visible(step.name, step.locator)
+            elif step.wait:
+                self.wait_ready(self.image(step.wait), step.threshold)
+
+        if not step.expected:
+            return
+        with timer("capture"):
+            screenshot = self.capture(driver, step.screenshot)
+        with timer("decode"):
+            gray = screenshot.gray
+        images = [self.image(tag) for tag in step.expected]
+        self.scores = {}
+        try:
+            with timer("match"):
+                if len(images) == 1:
+                    self.lackey_compare(images[0], gray, step.threshold)
+                else:
+                    self.compare_all(images, gray, step.threshold)
+        finally:
+            self.metrics.add_scores(step.name, self.scores)
+            if self.report is not None:
+                self.report.add(
+                    screenshot,
+                    step.name,
+                    time.perf_counter() - start,
+                    dict(self.scores),
+                )
+
+    def run_workflow(self, name):
         """Describes the general workflow
-        - Start the Selenium Driver
+        - Compile the steps of the workflow from the param.xml
+        - Take a Selenium Driver from the manager
         - Start the video record
-        - Check the default browser
         - Do all the steps
-        - In case of error call report and
-        persist the video file
+        - Push each screenshot to the report as it is taken
+        - In case of error finish the report and
+        persist the video file, in the background
+        when there is an artifact pool
+        - Export the time spent in each phase
+
+        Args:
+            name (str): name of the workflow in the param.xml
+
+        Raises:
+            ValueError: The workflow has no valid steps
         """
-        options = Options()
-        options.add_argument("--headless")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--window-size=1920x1080")
-        options.add_argument(
-            "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            + "AppleWebKit/537.36 (KHTML, like Gecko) "
-            + "Chrome/91.0.4472.124 Safari/537.36"
+        plan = compile_plan(self.settings.workflow_steps.get(name, ()))
+        if not plan:
+            raise ValueError(f"Workflow {name} has no steps in the param.xml")
+
+        self.metrics = RunMetrics(name)
+        self.step = None
+        set_log_context(run_id=self.metrics.run_id, step=None)
+        with self.metrics.timer(None, "driver_start"):
+            driver = self.drivers.acquire(self.settings)
+        self.driver = driver
+        self.matcher = TemplateMatcher(**self.settings.matching)
+        if self.settings.prefilter:
+            self.prefilter = Prefilter(
+                os.path.join(
+                    self.settings.prefilter.get("directory", "cache/"),
+                    f"prefilter_{self.name or 'default'}.json",
+                ),
+                self.settings.prefilter.get("distance", 4),
+                self.settings.prefilter.get("tolerance", 8),
+            )
+        self.waiter = Waiter(
+            driver,
+            timeouts=self.settings.step_timeouts,
+            default_timeout=self.settings.set_auto_wait_timeout,
         )
-        if self.settings.default_browser == "edge":
-            edge_service = Service(self.settings.edge_path)
-            driver = webdriver.Edge(options=options, service=edge_service)
-        else:
-            driver = webdriver.Chrome(options=options)
-
-        driver.maximize_window()
-        video = Video(driver)
+        video = Video(
+            driver,
+            self.name,
+            fps=self.settings.video_fps or 5,
+            buffer_seconds=self.settings.video_buffer_seconds,
+            buffer_megabytes=self.settings.video_buffer_megabytes or 256,
+            screencast=bool(self.settings.video_screencast),
+        )
+        self.report = Report(self.name)
+        self.report.start(video.output_filename)
+        finish = None
         try:
             video.start_screen_rec()
 
-            self.step_tout_acepter(driver)
-            self.step_consent_prompt_submit(driver)
-            self.step_trouver_une_agence(driver)
-            self.step_rue_search(driver)
-            self.step_code_postal(driver)
-            self.step_submit_addr(driver)
-            self.step_geocoder(driver)
-            self.step_quatre_detail(driver)
+            for step in plan:
+                self.run_step(driver, step)
 
-            video.end_screen_record()
+            with self.metrics.timer(None, "video"):
+                video.end_screen_record()
+            self.report.discard()
+            self.metrics.passed = True
         except Exception as err:
             logging.exception("Error: %s", err)
-            driver.save_screenshot(f"screenshots/FAILED_{self.step}.png")
-            video.end_screen_record(persist_video=True)
-            report = Report()
-            report.generate_report(video.output_filename)
+            self.metrics.passed = False
+            self.metrics.failed_step = self.step
+            finish = functools.partial(
+                self.finish_artifacts, video, self.report, self.metrics
+            )
+            try:
+                failed = self.capture(driver, f"FAILED_{self.step}.png")
+                self.report.add(failed, self.step)
+            except WebDriverException as capture_error:
+                # The browser was killed or crashed
+                logging.warning(f"Failure not captured: {capture_error}")
+        finally:
+            # Also stops the recording of a run killed or interrupted
+            video.stop_screen_record()
+            with self.metrics.timer(None, "driver_release"):
+                self.drivers.release(self.artifacts)
+            if finish is None:
+                self.export_metrics()
+            elif self.artifacts is None:
+                finish()
+            else:
+                self.artifacts.submit(f"{name} artifacts", finish)
+            set_log_context(run_id=None, step=None)
+
+    def finish_artifacts(self, video, report, metrics):
+        """Persist the video and save the report of a
+        failed run, then export its metrics. An artifact
+        that fails is logged and the run still exported.
 
-        driver.quit()
+        Args:
+            video (Video): stopped recording of the run
+            report (Report): report of the run
+            metrics (RunMetrics): metrics of the run
+        """
+        try:
+            try:
+                with metrics.timer(None, "video"):
+                    video.end_screen_record(persist_video=True)
+                if os.path.exists(video.output_filename):
+                    metrics.artifacts["video"] = video.output_filename
+            except Exception:
+                logging.exception(f"Video of run {metrics.run_id} lost")
+            try:
+                with metrics.timer(None, "report"):
+                    metrics.artifacts["report"] = report.finish()
+            except Exception:
+                logging.exception(f"Report of run {metrics.run_id} lost")
+        finally:
+            self.export_metrics(metrics)
+
+    def export_metrics(self, metrics=None):
+        """Log the time spent in each phase of the run
+        and export it when the param.xml has a metrics
+        section, store the run when there is a history.
+
+        Args:
+            metrics (RunMetrics, optional): metrics of the run,
+            by default the last one
+        """
+        metrics = metrics or self.metrics
+        phases = {}
+        for (_, phase), seconds in metrics.totals().items():
+            phases[phase] = round(phases.get(phase, 0) + seconds, 3)
+        logging.info(
+            f"{metrics.workflow} run {metrics.run_id} phases "
+            + json.dumps(phases)
+        )
+        if self.settings.metrics:
+            exporter.export(
+                metrics,
+                self.settings.metrics.get("directory", "metrics/"),
+            )
+        if self.history is not None:
+            self.history.record(metrics)
@@ -0,0 +1,271 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from reviseur.driver import DriverManager
+
+
+class Job:
+    """A monitored workflow with its own interval,
+    its own browser and the time of its next run.
+    Runs are kept on a fixed grid of slots so the
+    period does not drift with the run duration.
+    """
+
+    def __init__(
+        self, name, interval=300, jitter=0, timeout=None, overrun="skip"
+    ):
+        """Initiates the job, the first run happens
+        after a random part of the jitter so jobs
+        added together do not all start at once.
+
+        Args:
+            name (str): name of the workflow
+            interval (float, optional): seconds between runs
+            jitter (float, optional): random seconds added to each slot
+            timeout (float, optional): seconds before a run is killed,
+            defaults to the interval, none without an interval
+            overrun (str, optional): when a run takes longer than the
+            interval, "skip" waits for the next slot and "queue" runs
+            once right away
+        """
+        self.name = name
+        self.interval = interval
+        self.jitter = jitter
+        # A job run again at once has no interval to bound its runs
+        self.timeout = timeout if timeout else (interval or None)
+        self.overrun = overrun
+        self.drivers = DriverManager()
+        self.running = False
+        self.future = None
+        self.started = None
+        self.killed = False
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_latency = None
+        self.last_lag = None
+        self.slot = time.monotonic()
+        self.next_run = self.slot + random.uniform(0, jitter)
+
+    def start(self, now):
+        """Mark the job as started and measure how late
+        it started compared to its schedule.
+
+        Args:
+            now (float): monotonic time of the start
+        """
+        self.started = now
+        self.killed = False
+        self.last_lag = now - self.next_run
+
+    def finish(self, now):
+        """Measure the run and define the next run on the
+        grid of slots. When the run took longer than the
+        interval the missed slots are skipped, or with the
+        queue policy a single late run happens right away.
+
+        Args:
+            now (float): monotonic time of the end
+        """
+        self.runs += 1
+        self.last_latency = now - self.started
+        self.started = None
+
+        if self.interval <= 0:
+            self.slot = now
+            self.next_run = now
+            return
+
+        self.slot += self.interval
+        if self.slot > now:
+            self.next_run = self.slot + random.uniform(0, self.jitter)
+            return
+
+        self.overruns += 1
+        missed = int((now - self.slot) // self.interval) + 1
+        self.slot += missed * self.interval
+        if self.overrun == "queue":
+            self.skipped += missed - 1
+            self.next_run = now
+        else:
+            self.skipped += missed
+            self.next_run = self.slot + random.uniform(0, self.jitter)
+        logging.warning(
+            f"{self.name} overran its interval of {self.interval}s, "
+            + f"{self.skipped} runs skipped so far"
+        )
+
+    def deadline(self):
+        """Returns when the current run must be killed
+
+        Returns:
+            float: monotonic time or None if not running
+        """
+        if self.started is None or self.killed or self.timeout is None:
+            return None
+        return self.started + self.timeout
+
+
+class Scheduler:
+    """Runs the monitored workflows in parallel in a
+    pool of workers. Each job waits for its own interval
+    so a slow workflow does not delay the others, and a
+    job is never run twice at the same time. A run that
+    exceeds its timeout has its browser killed.
+    """
+
+    def __init__(self, run_job, workers=1):
+        """Initiates the scheduler and its workers
+
+        Args:
+            run_job (callable): runs a single Job
+            workers (int, optional): workflows run at the same time
+        """
+        self.run_job = run_job
+        self.jobs = []
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="workflow"
+        )
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+
+    def add(self, job):
+        """Add a job to be scheduled
+
+        Args:
+            job (Job): workflow to be monitored
+        """
+        with self.lock:
+            self.jobs.append(job)
+        self.wakeup.set()
+
+    def _run(self, job):
+        """Run a job in a worker and schedule the next
+        run when it ends, even if it failed.
+
+        Args:
+            job (Job): workflow to be run
+        """
+        threading.current_thread().name = job.name
+        with self.lock:
+            job.start(time.monotonic())
+        # The loop must now also wait for the run deadline
+        self.wakeup.set()
+        try:
+            self.run_job(job)
+        except Exception as err:
+            logging.exception(f"{job.name} run failed: {err}")
+        finally:
+            with self.lock:
+                job.finish(time.monotonic())
+                job.running = False
+            logging.info(
+                f"{job.name} run_latency={job.last_latency:.2f}s "
+                + f"schedule_lag={job.last_lag:.2f}s "
+                + f"overruns={job.overruns} skipped={job.skipped}"
+            )
+            self.wakeup.set()
+
+    def kill(self, job):
+        """Quit the browser of a run that exceeded its
+        timeout, so its steps fail and the worker is freed.
+        It is done in its own thread since a hung browser
+        may take long to answer.
+
+        Args:
+            job (Job): the job to be killed
+        """
+        logging.error(f"{job.name} exceeded {job.timeout}s, killing browser")
+        job.killed = True
+        threading.Thread(
+            target=job.drivers.quit, name=f"{job.name}-kill", daemon=True
+        ).start()
+
+    def submit_due(self):
+        """Send to the workers the jobs that are due
+        and kill the runs past their timeout.
+
+        Returns:
+            float: seconds until the next job is due or a run
+            must be killed, None when there is nothing to wait
+        """
+        now = time.monotonic()
+        with self.lock:
+            for job in self.jobs:
+                if not job.running and job.next_run <= now:
+                    job.running = True
+                    job.future = self.executor.submit(self._run, job)
+                elif job.deadline() is not None and job.deadline() <= now:
+                    self.kill(job)
+            waiting = [
+                job.deadline() if job.running else job.next_run
+                for job in self.jobs
+            ]
+        waiting = [moment for moment in waiting if moment is not None]
+        if not waiting:
+            return None
+        return max(0, min(waiting) - now)
+
+    def run(self):
+        """Loop until stopped, sleeping until the next
+        job is due or a running one finishes.
+        """
+        while not self.stop_event.is_set():
+            self.wakeup.clear()
+            timeout = self.submit_due()
+            self.wakeup.wait(timeout)
+
+    def stop(self, grace=30):
+        """Stop the loop, wait for the running workflows
+        and close their browsers. The runs past their
+        timeout are still killed while waiting, and a
+        killed run that does not end within the grace
+        period is left behind.
+
+        Args:
+            grace (float, optional): seconds a killed run may
+            take to end
+        """
+        self.stop_event.set()
+        self.wakeup.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        given_up = None
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                running = [
+                    job
+                    for job in self.jobs
+                    if job.future is not None and not job.future.done()
+                ]
+                for job in running:
+                    if job.deadline() is not None and job.deadline() <= now:
+                        self.kill(job)
+                deadlines = [
+                    job.deadline()
+                    for job in running
+                    if job.deadline() is not None
+                ]
+            if not running:
+                break
+            if deadlines:
+                given_up = None
+                timeout = max(0, min(deadlines) - now)
+            elif given_up is None:
+                given_up = now + grace
+                timeout = grace
+            elif now >= given_up:
+                logging.error(
+                    "Stopped without waiting for "
+                    + ", ".join(job.name for job in running)
+                )
+                break
+            else:
+                timeout = given_up - now
+            wait([job.future for job in running], timeout)
+        for job in self.jobs:
+            job.drivers.quit()
@@ -1,15 +1,118 @@
+import functools
+import logging
+import os
 import re
+import threading
+import types
 import xml.etree.ElementTree as ET
 from typing import Optional
 
+from reviseur.matching import MatchPolicy, Region
+from reviseur.templates import template_cache
+from reviseur.workflow import compile_plan
+
+CAMEL_BOUNDARY = re.compile(r"(?<!^)(?=[A-Z])")
+# Tags only grouping other settings, they may be left empty
+GROUPS = ("paths", "images")
+
+
+def boolean(text):
+    """Read a true or false setting
+
+    Args:
+        text (str): text of the tag
+
+    Returns:
+        bool: the setting
+
+    Raises:
+        ValueError: The text is neither true nor false
+    """
+    if text not in ("true", "false"):
+        raise ValueError(f"expected true or false, not {text!r}")
+    return text == "true"
+
+
+# Type of the settings that are not text, the others stay strings
+SCALARS = {
+    "set_auto_wait_timeout": float,
+    "driver_max_runs": int,
+    "video_fps": float,
+    "video_buffer_seconds": float,
+    "video_buffer_megabytes": float,
+    "video_screencast": boolean,
+}
+
+
+def freeze(value):
+    """Returns a read-only version of a setting, the
+    dicts become mapping proxies and the lists tuples.
+
+    Args:
+        value: value parsed from the param.xml
+
+    Returns:
+        the value, read-only
+    """
+    if isinstance(value, dict):
+        return types.MappingProxyType(
+            {key: freeze(item) for key, item in value.items()}
+        )
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
 
 class Settings:
     """
     Settings command class thre responsability
     to manage all the configuration imported from
     the param.xml
+
+    The param.xml is parsed once into fixed slots and
+    the settings can not be changed afterwards, their
+    dicts and lists included, a new version of the file
+    gives new settings.
     """
 
+    __slots__ = (
+        "xml_file",
+        "default_browser",
+        "chrome_path",
+        "edge_path",
+        "firefox_path",
+        "set_auto_wait_timeout",
+        "driver_max_runs",
+        "video_fps",
+        "video_buffer_seconds",
+        "video_buffer_megabytes",
+        "video_screencast",
+        "start_icon",
+        "tout_accepter",
+        "trouver_une_agence",
+        "rue_type",
+        "code_postal",
+        "rechercher_click",
+        "lyon_perrache",
+        "cinq_agences_banque",
+        "quatre_quatre",
+        "quatre_detail",
+        "images",
+        "step_timeouts",
+        "image_options",
+        "matching",
+        "prefilter",
+        "metrics",
+        "artifacts",
+        "history",
+        "retention",
+        "logging",
+        "workers",
+        "workflows",
+        "workflow_steps",
+        "_frozen",
+    )
+
     def __init__(self, xml_file):
         """This attributes will be loaded
         from the xml and stored in this
@@ -17,14 +120,23 @@ class Settings:
 
         Args:
             xml_file (str): path to xmlfile
+
+        Raises:
+            ValueError: The file is not valid XML or has a bad value
         """
+        self._frozen = False
         self.xml_file = xml_file
         # Initialize attributes with types for autocomplete support
         self.default_browser: Optional[str] = None
         self.chrome_path: Optional[str] = None
         self.edge_path: Optional[str] = None
         self.firefox_path: Optional[str] = None
-        self.set_auto_wait_timeout: Optional[int] = None
+        self.set_auto_wait_timeout: Optional[float] = None
+        self.driver_max_runs: Optional[int] = None
+        self.video_fps: Optional[float] = None
+        self.video_buffer_seconds: Optional[float] = None
+        self.video_buffer_megabytes: Optional[float] = None
+        self.video_screencast: Optional[bool] = None
         self.start_icon: Optional[str] = None
         self.tout_accepter: Optional[str] = None
         self.trouver_une_agence: Optional[str] = None
@@ -35,10 +147,61 @@ class Settings:
         self.cinq_agences_banque: Optional[str] = None
         self.quatre_quatre: Optional[str] = None
         self.quatre_detail: Optional[str] = None
+        self.images: dict = {}
+        self.step_timeouts: dict = {}
+        self.image_options: dict = {}
+        self.matching: dict = {}
+        self.prefilter: dict = {}
+        self.metrics: dict = {}
+        self.artifacts: dict = {}
+        self.history: dict = {}
+        self.retention: dict = {}
+        self.logging: dict = {}
+        self.workers: int = 1
+        self.workflows: list = []
+        self.workflow_steps: dict = {}
 
         self.load_settings()
+        for name in self.__slots__:
+            if name != "_frozen":
+                setattr(self, name, freeze(getattr(self, name)))
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        """Refuse any change once the settings are loaded
+
+        Args:
+            name (str): attribute name
+            value: attribute value
+
+        Raises:
+            AttributeError: The settings are already loaded
+        """
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"Settings are read-only: {name}")
+        super().__setattr__(name, value)
+
+    def __getattr__(self, name):
+        """Images declared in the param.xml without
+        their own slot are read from the images.
+
+        Args:
+            name (str): image tag in snake_case
 
-    def camel_to_snake(self, camel_str):
+        Returns:
+            str: path to the image
+
+        Raises:
+            AttributeError: There is no such setting
+        """
+        try:
+            return object.__getattribute__(self, "images")[name]
+        except (AttributeError, KeyError):
+            raise AttributeError(name) from None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def camel_to_snake(camel_str):
         """Simple convert camelCase to snake_case
 
         Args:
@@ -47,34 +210,351 @@ class Settings:
         Returns:
             str: text in snake_case
         """
-        snake_str = re.sub(r"(?<!^)(?=[A-Z])", "_", camel_str).lower()
+        snake_str = CAMEL_BOUNDARY.sub("_", camel_str).lower()
         return snake_str
 
+    def sections(self):
+        """Sections of the XML that are not a simple
+        tag and value and the functions to parse them.
+
+        Returns:
+            dict: section tag and its loader
+        """
+        return {
+            "stepTimeouts": self.load_step_timeouts,
+            "workflows": self.load_workflows,
+            "matching": self.load_matching,
+            "prefilter": self.load_prefilter,
+            "metrics": self.load_metrics,
+            "artifacts": self.load_artifacts,
+            "history": self.load_history,
+            "retention": self.load_retention,
+            "logging": self.load_logging,
+        }
+
+    def load_step_timeouts(self, section):
+        """Read the maximum time in seconds that each
+        step may wait for the page to be ready.
+
+        Args:
+            section (Element): the stepTimeouts element
+
+        Raises:
+            ValueError: A timeout is empty or not a number
+        """
+        for timeout in section.iter("timeout"):
+            step = timeout.get("step")
+            try:
+                self.step_timeouts[step] = float(timeout.text)
+            except (TypeError, ValueError):
+                raise ValueError(
+                    f"Bad <timeout step={step!r}>: {timeout.text!r}"
+                ) from None
+
+    def load_workflows(self, section):
+        """Read the workflows to be monitored, each
+        one with its interval, jitter and timeout in
+        seconds, what to do when a run overruns and
+        its steps, and how many of them can run at the
+        same time.
+
+        Args:
+            section (Element): the workflows element
+        """
+        self.workers = int(section.get("workers", 1))
+        for workflow in section.iter("workflow"):
+            self.workflows.append(
+                {
+                    "name": workflow.get("name"),
+                    "interval": float(workflow.get("interval", 300)),
+                    "jitter": float(workflow.get("jitter", 0)),
+                    "timeout": float(workflow.get("timeout", 0)) or None,
+                    "overrun": workflow.get("overrun", "skip"),
+                }
+            )
+            # Kept hashable so the compiled plan can be cached
+            self.workflow_steps[workflow.get("name")] = tuple(
+                tuple(step.attrib.items()) for step in workflow.iter("step")
+            )
+
+    def load_matching(self, section):
+        """Read how the expected images are searched:
+        the pyramid levels of the coarse search, how many
+        candidates are refined and the template scales.
+
+        Args:
+            section (Element): the matching element
+        """
+        if "levels" in section.attrib:
+            self.matching["levels"] = int(section.get("levels"))
+        if "candidates" in section.attrib:
+            self.matching["candidates"] = int(section.get("candidates"))
+        if "scales" in section.attrib:
+            self.matching["scales"] = tuple(
+                float(scale) for scale in section.get("scales").split(",")
+            )
+
+    def load_prefilter(self, section):
+        """Read when a screenshot is close enough to the
+        last one that passed to skip the matching: the
+        hash bits and thumbnail pixels that may differ
+        and the folder where they are kept.
+
+        Args:
+            section (Element): the prefilter element
+        """
+        self.prefilter = {
+            "distance": int(section.get("distance", 4)),
+            "tolerance": int(section.get("tolerance", 8)),
+            "directory": section.get("directory", "cache/"),
+        }
+
+    def load_metrics(self, section):
+        """Read the folder where the time spent in each
+        phase of the runs is exported.
+
+        Args:
+            section (Element): the metrics element
+        """
+        self.metrics = {"directory": section.get("directory", "metrics/")}
+
+    def load_artifacts(self, section):
+        """Read how many artifacts of the runs are finished
+        at the same time in the background and how many
+        may be pending before the runs wait for them.
+
+        Args:
+            section (Element): the artifacts element
+        """
+        self.artifacts = {
+            "workers": int(section.get("workers", 2)),
+            "queue": int(section.get("queue", 8)),
+        }
+
+    def load_history(self, section):
+        """Read the SQLite file where the runs are stored
+
+        Args:
+            section (Element): the history element
+        """
+        self.history = {"path": section.get("path", "history/runs.sqlite")}
+
+    def load_retention(self, section):
+        """Read how often the artifact folders are cleaned
+        and the caps of each one: days, files and megabytes
+        kept and whether its idle files are compressed.
+
+        Args:
+            section (Element): the retention element
+        """
+        folders = []
+        for folder in section.iter("folder"):
+            caps = {"path": folder.get("path")}
+            for key, cast in (
+                ("maxAgeDays", float),
+                ("maxFiles", int),
+                ("maxMegabytes", float),
+            ):
+                if folder.get(key) is not None:
+                    caps[self.camel_to_snake(key)] = cast(folder.get(key))
+            caps["compress"] = folder.get("compress") == "true"
+            folders.append(caps)
+        self.retention = {
+            "interval": float(section.get("interval", 600)),
+            "folders": folders,
+        }
+
+    def load_logging(self, section):
+        """Read the format of the log file and how many
+        records may wait to be written before new ones
+        are dropped.
+
+        Args:
+            section (Element): the logging element
+        """
+        self.logging = {
+            "structured": section.get("format") == "json",
+            "queue_size": int(section.get("queue", 10000)),
+        }
+
     def load_settings(self):
         """
         Read and parse the XML description
         here we dynamically set the attrs
         converting their tag to the declared
         ones in the initialization of the class
+        and their text to the declared type.
+        The tags inside images are the expected
+        images, any other unknown tag is an error.
+
+        Raises:
+            ValueError: The file is not valid XML or has a bad value
+        """
+        try:
+            root = ET.parse(self.xml_file).getroot()
+        except ET.ParseError as err:
+            raise ValueError(f"Error parsing {self.xml_file}: {err}") from err
+
+        # Sections with their own structure are parsed apart
+        skipped = set()
+        for tag, loader in self.sections().items():
+            for section in root.iter(tag):
+                loader(section)
+                skipped.update(section.iter())
+        images = {elem for section in root.iter("images") for elem in section}
+
+        for elem in root.iter():
+            # Groups of settings such as paths or images, even empty
+            if elem in skipped or len(elem) or elem.tag in GROUPS:
+                continue
+            tag = self.camel_to_snake(elem.tag)
+            text = (elem.text or "").strip()
+
+            if elem in images:
+                self.images[tag] = text
+                # Attributes of an image tune how it is searched
+                if elem.attrib:
+                    self.image_options[text] = dict(elem.attrib)
+            elif tag not in self.__slots__ or tag.startswith("_"):
+                raise ValueError(f"Unknown setting <{elem.tag}>")
+            if tag in self.__slots__:
+                try:
+                    setattr(self, tag, SCALARS.get(tag, str)(text))
+                except ValueError as err:
+                    raise ValueError(f"Bad <{elem.tag}>: {err}") from None
+
+    def validate(self):
+        """Check the settings can be used before any run:
+        the steps compile, the images they use are declared,
+        their files load and their attributes are valid
+        regions, scores and counts. The images are decoded in the
+        template cache, ready for the first comparison.
+
+        Raises:
+            ValueError: The settings are not valid, with every
+            problem found
+        """
+        problems = []
+        if self.default_browser not in (None, "chrome", "edge"):
+            problems.append(f"Unknown browser {self.default_browser}")
+        used = {}
+        for name, steps in self.workflow_steps.items():
+            try:
+                plan = compile_plan(steps)
+            except ValueError as err:
+                problems.append(f"Workflow {name}: {err}")
+                continue
+            for step in plan:
+                tags = list(step.expected)
+                if step.wait not in (None, "settle", "visible"):
+                    tags.append(step.wait)
+                for tag in tags:
+                    path = self.images.get(self.camel_to_snake(tag))
+                    if path is None:
+                        problems.append(f"Step {step.name} uses unknown {tag}")
+                    else:
+                        used[tag] = path
+        for tag, path in used.items():
+            if not os.path.isfile(path):
+                problems.append(f"Image {tag} not found: {path}")
+            elif template_cache.get(path) is None:
+                problems.append(f"Image {tag} can not be loaded: {path}")
+        for path, options in self.image_options.items():
+            problems.extend(
+                f"Image {path}: {problem}"
+                for problem in self.option_problems(options)
+            )
+        if problems:
+            found = "; ".join(problems)
+            raise ValueError(f"Invalid {self.xml_file}: {found}")
+
+    @staticmethod
+    def option_problems(options):
+        """Check the attributes tuning how an image is
+        searched: its region, margin, score and counts.
+
+        Args:
+            options (Mapping): attributes of the image tag
+
+        Returns:
+            list: the problems found
+        """
+        problems = []
+        try:
+            if "region" in options:
+                region = Region.parse(options["region"])
+                if region.width <= 0 or region.height <= 0:
+                    problems.append(f"empty region {options['region']}")
+        except ValueError as err:
+            problems.append(f"bad region: {err}")
+        try:
+            float(options.get("margin", 0))
+        except ValueError as err:
+            problems.append(f"bad margin: {err}")
+        try:
+            policy = MatchPolicy.from_options(options)
+        except ValueError as err:
+            problems.append(f"bad minScore or count: {err}")
+            return problems
+        if not 0 < policy.min_score <= 1:
+            problems.append(f"minScore {policy.min_score} not in ]0, 1]")
+        for name, count in (
+            ("expectedCount", policy.expected_count),
+            ("maxCount", policy.max_count),
+        ):
+            if count is not None and count < 1:
+                problems.append(f"{name} {count} must be at least 1")
+        return problems
+
+
+class SettingsWatcher:
+    """Keeps the settings of the param.xml parsed and
+    validated, reloading them only when the file changed.
+    A version of the file that fails to load is logged
+    and the last good settings are kept.
+    """
+
+    def __init__(self, xml_file):
+        """Initiates the watcher, the file is loaded
+        by the first call to current.
+
+        Args:
+            xml_file (str): path to the param.xml
+        """
+        self.xml_file = xml_file
+        self.settings = None
+        self.mtime = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Returns the settings, reloaded when the
+        modification time of the file changed.
+
+        Returns:
+            Settings: the last good settings
+
+        Raises:
+            Exception: The first version of the file can not be
+            read or is not valid
         """
         try:
-            tree = ET.parse(self.xml_file)
-            root = tree.getroot()
-
-            # Dynamically set attributes based on XML tags
-            for elem in root.iter():
-                tag = elem.tag
-                text = elem.text
-
-                tag = self.camel_to_snake(tag)
-
-                if hasattr(self, tag):
-                    value = int(text) if text.isdigit() else text
-                    setattr(self, tag, value)
-                else:
-                    setattr(self, tag, text)
-
-        except ET.ParseError as e:
-            print(f"Error parsing XML file: {e}")
-        except Exception as e:
-            print(f"Error loading settings: {e}")
+            mtime = os.stat(self.xml_file).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if self.settings is not None and mtime == self.mtime:
+                return self.settings
+            # A bad version is only tried again once changed
+            self.mtime = mtime
+            try:
+                settings = Settings(self.xml_file)
+                settings.validate()
+            except Exception as err:
+                if self.settings is None:
+                    raise
+                logging.error(f"Keeping the last good settings: {err}")
+            else:
+                if self.settings is not None:
+                    logging.info(f"{self.xml_file} changed, settings reloaded")
+                self.settings = settings
+            return self.settings
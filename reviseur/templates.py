@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+
+import cv2
+
+
+class TemplateCache:
+    """Keeps the expected images from the param.xml decoded
+    in grayscale for the whole life of the process, so the
+    monitoring loop does not decode the same PNGs at every
+    cycle. Each entry is keyed by its path and modification
+    time and also keeps the variants already fitted to the
+    screenshot resolutions seen so far.
+    """
+
+    def __init__(self):
+        """Initiates an empty cache, the entries are
+        loaded on demand by the comparisons.
+        """
+        self._entries = {}
+        self._config_file = None
+        self._config_mtime = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtime(path):
+        """Returns the modification time of a file
+        or None when it can not be read.
+
+        Args:
+            path (str): path to the file
+
+        Returns:
+            int: modification time in nanoseconds
+        """
+        try:
+            return os.stat(path).st_mtime_ns
+        except (OSError, TypeError, ValueError):
+            return None
+
+    def clear(self):
+        """Drop every decoded template"""
+        with self._lock:
+            self._entries.clear()
+
+    def watch_config(self, xml_file):
+        """Invalidates the whole cache when the
+        configuration file changed since the last
+        call, the images it points to may be others.
+
+        Args:
+            xml_file (str): path to the param.xml
+        """
+        mtime = self._mtime(xml_file)
+        with self._lock:
+            changed = (
+                xml_file != self._config_file or mtime != self._config_mtime
+            )
+            if changed and self._config_file is not None:
+                logging.info(f"{xml_file} changed, clearing template cache")
+                self._entries.clear()
+            self._config_file = xml_file
+            self._config_mtime = mtime
+
+    def _load(self, path):
+        """Returns the cache entry of an image decoding
+        it again if the file changed on disk.
+
+        Args:
+            path (str): path to the expected image
+
+        Returns:
+            dict: entry with the grayscale image and its variants
+        """
+        mtime = self._mtime(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry["mtime"] == mtime:
+                return entry
+
+        entry = {"mtime": mtime, "image": cv2.imread(path, 0), "fitted": {}}
+        if mtime is not None and entry["image"] is not None:
+            with self._lock:
+                self._entries[path] = entry
+        return entry
+
+    def get(self, path):
+        """Returns the expected image decoded in grayscale
+
+        Args:
+            path (str): path to the expected image
+
+        Returns:
+            numpy.ndarray: grayscale template
+        """
+        return self._load(path)["image"]
+
+    def fitted(self, path, shape):
+        """Returns the template fitted to a screenshot
+        resolution, scaled down when it is bigger than
+        the screenshot and then cropped to it.
+
+        Args:
+            path (str): path to the expected image
+            shape (tuple): shape of the grayscale screenshot
+
+        Returns:
+            numpy.ndarray: grayscale template that fits the shape
+        """
+        key = tuple(shape[:2])
+        entry = self._load(path)
+        fitted = entry["fitted"].get(key)
+        if fitted is not None:
+            return fitted
+
+        template = entry["image"]
+        if template.shape[0] > key[0] or template.shape[1] > key[1]:
+            scale_factor = min(
+                key[0] / template.shape[0],
+                key[1] / template.shape[1],
+            )
+            template = cv2.resize(
+                template, (0, 0), fx=scale_factor, fy=scale_factor
+            )
+        template = template[: key[0], : key[1]]
+
+        with self._lock:
+            entry["fitted"][key] = template
+        return template
+
+
+# Shared by every Reviseur created in the process
+template_cache = TemplateCache()
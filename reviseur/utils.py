@@ -1,23 +1,173 @@
+import atexit
+import contextvars
+import json
 import logging
 import pathlib
+import queue
 import sys
+import threading
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
+from reviseur.retention import gzip_namer, gzip_rotator
 
-def initialize_logs():
+# Size of a log file before it is rotated and compressed
+LOG_MAX_BYTES = 10 * 1024 * 1024
+# Compressed logs kept by a process, older ones go to the janitor
+LOG_BACKUPS = 5
+LOG_FORMAT = "%(asctime)s - %(threadName)s - %(levelname)s - %(message)s"
+
+# Run and step of the workflow logging from the current context,
+# the threads working for a run are started in a copy of it
+log_context = contextvars.ContextVar("log_context", default=None)
+
+
+def set_log_context(**fields):
+    """Set the run_id or step added to the records
+    logged from the current context, None removes it.
+
+    Args:
+        **fields: run_id and step
+    """
+    log_context.set({**(log_context.get() or {}), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """Adds the run_id and step of the context to the
+    records, it runs in the thread logging them.
+    """
+
+    def filter(self, record):
+        """Add the fields to the record
+
+        Args:
+            record (LogRecord): record being logged
+
+        Returns:
+            bool: always True, nothing is filtered out
+        """
+        fields = log_context.get() or {}
+        record.run_id = fields.get("run_id")
+        record.step = fields.get("step")
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats the records as JSON lines with the run_id
+    and step of the workflow that logged them.
+    """
+
+    def format(self, record):
+        """Format a record as a JSON object
+
+        Args:
+            record (LogRecord): record to be written
+
+        Returns:
+            str: a JSON object on a single line
+        """
+        line = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "run_id": getattr(record, "run_id", None),
+            "step": getattr(record, "step", None),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            line["message"] += "\n" + self.formatException(record.exc_info)
+        return json.dumps(line)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Puts the records in a bounded queue without ever
+    waiting: when the queue is full the record is dropped
+    and counted, the count is logged once there is room.
+    """
+
+    def __init__(self, log_queue):
+        """Initiates the handler without any drop
+
+        Args:
+            log_queue (queue.Queue): bounded queue of the listener
+        """
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.unreported = 0
+        self.drops_lock = threading.Lock()
+
+    def enqueue(self, record):
+        """Put the record in the queue or drop it
+
+        Args:
+            record (LogRecord): prepared record
+        """
+        with self.drops_lock:
+            try:
+                if self.unreported:
+                    self.queue.put_nowait(
+                        logging.makeLogRecord(
+                            {
+                                "name": "reviseur.logs",
+                                "levelno": logging.WARNING,
+                                "levelname": "WARNING",
+                                "threadName": record.threadName,
+                                "msg": f"{self.unreported} log records "
+                                + f"dropped, {self.dropped} so far",
+                            }
+                        )
+                    )
+                    self.unreported = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                self.unreported += 1
+
+
+def initialize_logs(structured=False, queue_size=10000):
     """Initialize logs and save to the folder logs/
     also make sure to write all errors and infos.
+    The log of the process is rotated by size and
+    its rotated files are compressed.
+
+    The records only go through a bounded queue in
+    the threads logging them, the files and console
+    are written by a listener thread.
+
+    Args:
+        structured (bool, optional): write the log file as JSON
+        lines with the run_id and step of each record
+        queue_size (int, optional): records waiting to be written
+        before new ones are dropped
+
+    Returns:
+        QueueListener: thread writing the records
     """
     pathlib.Path("logs/").mkdir(parents=True, exist_ok=True)
     datetime_now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler(f"logs/revisur_log_run_{datetime_now}.log"),
-            logging.StreamHandler(sys.stdout),
-        ],
+    file_handler = RotatingFileHandler(
+        f"logs/revisur_log_run_{datetime_now}.log",
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUPS,
     )
+    file_handler.namer = gzip_namer
+    file_handler.rotator = gzip_rotator
+    file_handler.setFormatter(
+        JsonFormatter() if structured else logging.Formatter(LOG_FORMAT)
+    )
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+    queue_handler.addFilter(ContextFilter())
+    # Only the message is merged before queuing, the listener formats
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(queue_handler.queue, file_handler, stream_handler)
+    # Lets the janitor know which files are still written
+    queue_handler.listener = listener
+    listener.start()
+    atexit.register(listener.stop)
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
 
     class StreamToLogger:
         """Make sure to write log
@@ -49,3 +199,4 @@ def initialize_logs():
 
     sys.stdout = StreamToLogger(logging.INFO)
     sys.stderr = StreamToLogger(logging.ERROR)
+    return listener
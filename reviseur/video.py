@@ -1,16 +1,23 @@
+import base64
+import contextvars
 import logging
 import os
 import pathlib
-import shutil
 import signal
 import sys
 import threading
+import time
+from collections import deque
 from datetime import datetime
 
 import cv2
-import mss
 import numpy as np
 
+# Size of the frame version used to detect a page that did not change
+THUMBNAIL_SIZE = (64, 36)
+# Maximum pixel difference between two thumbnails of the same page
+FRAME_TOLERANCE = 2
+
 
 class Video:
     """
@@ -19,69 +26,314 @@ class Video:
     video format and their folders.
     """
 
-    def __init__(self, driver):
+    def __init__(
+        self,
+        driver,
+        name=None,
+        fps=5,
+        buffer_seconds=None,
+        buffer_megabytes=256,
+        screencast=False,
+    ):
         """The video class initializes by
         defining the captures path and
         the thread to be open.
 
         Args:
             driver (driver): selenium driver
+            name (str, optional): workflow name added to the file
+            fps (float, optional): frames captured by second
+            buffer_seconds (float, optional): when given the frames are
+            kept in memory and only encoded if the video is persisted,
+            covering the last seconds or the whole run when 0
+            buffer_megabytes (float, optional): memory cap of the buffer
+            screencast (bool, optional): receive the frames from the
+            DevTools screencast of Chromium browsers
         """
         datetime_now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         self.path = pathlib.Path("captures/")
-        self.screenshot_path = pathlib.Path("screenshots/")
-        self.output_filename = f"captures/screen_capture_{datetime_now}.avi"
+        self.path.mkdir(parents=True, exist_ok=True)
+        prefix = f"screen_capture_{name}" if name else "screen_capture"
+        self.output_filename = f"captures/{prefix}_{datetime_now}.avi"
         self.screenshot_count = 0
+        self.fps = fps
+        self.frame_size = None
+        self.frames_written = 0
+        self.last_png = None
+        self.last_thumbnail = None
+        self.out = None
+        self.frame = None
+        self.screencast = screencast
+        self.started_at = None
+        self.stopped_at = None
+        self.buffer_seconds = buffer_seconds
+        self.buffer_bytes = buffer_megabytes * 1024 * 1024
+        self.buffer = None if buffer_seconds is None else deque()
+        self.buffer_size = 0
         self.stop_recording_event = threading.Event()
+        # Started in a copy of the context to log with the run_id
         self.record_thread = threading.Thread(
-            target=self.record_screen, args=(self.stop_recording_event,)
+            target=contextvars.copy_context().run,
+            args=(self.record_screen, self.stop_recording_event),
         )
         self.driver = driver
-        self.clean_up()
 
-    def clean_up(self):
-        """At the start of each execution we must
-        clean the the screenshot path since is from them
-        we do comparisons
+    def write_until(self, frame, slot):
+        """Repeat a frame in the video until the given
+        slot so the playback keeps the real timing even
+        when the page did not change or the capture lagged.
+
+        Args:
+            frame (numpy.ndarray): frame shown until the slot
+            slot (int): index of the first frame after this one
         """
-        self.path.mkdir(parents=True, exist_ok=True)
-        shutil.rmtree(str(self.screenshot_path))
-        self.screenshot_path.mkdir(parents=True, exist_ok=True)
+        while self.frames_written < slot:
+            self.out.write(frame)
+            self.frames_written += 1
+
+    def changed_frame(self, screenshot):
+        """Decode the screenshot only when the page changed,
+        comparing the bytes first and then a tiny version of
+        the frame with the previous one. The tiny version is
+        decoded already reduced, JPEG frames are then only
+        partly decoded, and the full frame is decoded last.
+
+        Args:
+            screenshot (bytes): PNG or JPEG frame
+
+        Returns:
+            numpy.ndarray: the new frame or None if nothing changed
+        """
+        if screenshot == self.last_png:
+            return None
+        self.last_png = screenshot
+        data = np.frombuffer(screenshot, np.uint8)
+        reduced = cv2.imdecode(data, cv2.IMREAD_REDUCED_COLOR_8)
+        if reduced is None:
+            return None
+
+        thumbnail = cv2.resize(
+            reduced, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA
+        )
+        if (
+            self.last_thumbnail is not None
+            and cv2.absdiff(thumbnail, self.last_thumbnail).max()
+            <= FRAME_TOLERANCE
+        ):
+            return None
+        self.last_thumbnail = thumbnail
+
+        frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if self.frame_size is None:
+            self.frame_size = frame.shape[1::-1]
+        elif frame.shape[1::-1] != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size)
+        return frame
+
+    def encode_frame(self, screenshot, moment):
+        """Add a screenshot to the video, the previous
+        frame is written until the moment it was replaced.
+
+        Args:
+            screenshot (bytes): PNG taken by the driver
+            moment (float): seconds since the start of the video
+        """
+        frame = self.changed_frame(screenshot)
+        if frame is None:
+            return
+        if self.out is None:
+            self.out = cv2.VideoWriter(
+                self.output_filename,
+                cv2.VideoWriter_fourcc(*"XVID"),
+                self.fps,
+                self.frame_size,
+            )
+        if self.frame is not None:
+            self.write_until(self.frame, int(moment * self.fps))
+        self.frame = frame
+
+    def finish_encoding(self, moment):
+        """Write the last frame until the end of the
+        recording and close the video file.
+
+        Args:
+            moment (float): seconds since the start of the video
+        """
+        if self.out is None:
+            return
+        end = int(moment * self.fps)
+        self.write_until(self.frame, max(end, self.frames_written) + 1)
+        self.out.release()
+        logging.info(
+            f"Video of {moment:.1f}s encoded with "
+            + f"{self.frames_written} frames at {self.fps} fps"
+        )
+
+    def buffer_frame(self, screenshot, tick):
+        """Keep the PNG in the ring buffer without decoding
+        it, dropping the frames older than the buffer window
+        or over the memory cap. The newest frame before the
+        window is kept since it is what the page showed then.
+
+        Args:
+            screenshot (bytes): PNG taken by the driver
+            tick (float): monotonic time of the screenshot
+        """
+        if self.buffer and screenshot == self.buffer[-1][1]:
+            return
+        self.buffer.append((tick, screenshot))
+        self.buffer_size += len(screenshot)
+        while len(self.buffer) > 1 and (
+            self.buffer_size > self.buffer_bytes
+            or (
+                self.buffer_seconds
+                and self.buffer[1][0] <= tick - self.buffer_seconds
+            )
+        ):
+            _, dropped = self.buffer.popleft()
+            self.buffer_size -= len(dropped)
+
+    def encode_buffer(self):
+        """Encode the frames kept in the ring buffer,
+        the video starts at the oldest one.
+        """
+        if not self.buffer:
+            return
+        origin = self.buffer[0][0]
+        while self.buffer:
+            tick, screenshot = self.buffer.popleft()
+            self.encode_frame(screenshot, tick - origin)
+        self.buffer_size = 0
+        self.finish_encoding(self.stopped_at - origin)
+
+    def push_frame(self, image, tick):
+        """Send a compressed frame to the video or to
+        the ring buffer when in buffer mode.
+
+        Args:
+            image (bytes): PNG or JPEG frame
+            tick (float): monotonic time of the frame
+        """
+        if self.buffer is None:
+            self.encode_frame(image, tick - self.started_at)
+        else:
+            self.buffer_frame(image, tick)
+
+    def poll_screenshots(self, stop_recording_event):
+        """Take a Selenium screenshot for each frame, at
+        most fps by second, until the event is set.
+
+        Args:
+            stop_recording_event (thread_event): is a passed
+            event which indicates that the recording must stop
+        """
+        interval = 1 / self.fps
+        while not stop_recording_event.is_set():
+            tick = time.monotonic()
+            self.push_frame(self.driver.get_screenshot_as_png(), tick)
+            stop_recording_event.wait(
+                max(0, tick + interval - time.monotonic())
+            )
+
+    def record_screencast(self, stop_recording_event):
+        """Receive the frames pushed by a Chromium browser
+        through the DevTools screencast. It uses its own
+        websocket, so the steps do not wait for the video
+        on the WebDriver channel.
+
+        Args:
+            stop_recording_event (thread_event): is a passed
+            event which indicates that the recording must stop
+
+        Returns:
+            bool: False when the screencast is not available
+        """
+        # Only needed by the screencast, trio comes with selenium
+        import trio
+
+        try:
+            trio.run(self._screencast, stop_recording_event)
+            return True
+        except Exception as err:
+            logging.warning(f"Screencast not available, polling: {err}")
+            return False
+
+    async def _screencast(self, stop_recording_event):
+        """Start the screencast and push its frames, at
+        most fps by second, until the event is set. The
+        newest frame skipped by the rate limit is pushed
+        later so the video always ends on the last page.
+
+        Args:
+            stop_recording_event (thread_event): is a passed
+            event which indicates that the recording must stop
+        """
+        import trio
+
+        interval = 1 / self.fps
+        # Frames carry wall clock timestamps, the video uses monotonic
+        offset = time.monotonic() - time.time()
+        pending = None
+        last_push = None
+        async with self.driver.bidi_connection() as connection:
+            session, devtools = connection.session, connection.devtools
+            frames = session.listen(devtools.page.ScreencastFrame)
+            await session.execute(
+                devtools.page.start_screencast(format_="jpeg", quality=80)
+            )
+            while not stop_recording_event.is_set():
+                event = None
+                with trio.move_on_after(interval):
+                    event = await frames.receive()
+                if event is not None:
+                    # Never cancelled, an unacked frame stops the screencast
+                    await session.execute(
+                        devtools.page.screencast_frame_ack(event.session_id)
+                    )
+                    stamp = event.metadata.timestamp or time.time()
+                    pending = (base64.b64decode(event.data), stamp + offset)
+                if pending is not None and (
+                    last_push is None or pending[1] - last_push >= interval
+                ):
+                    self.push_frame(*pending)
+                    last_push, pending = pending[1], None
+            if pending is not None:
+                self.push_frame(*pending)
+            await session.execute(devtools.page.stop_screencast())
 
     def record_screen(self, stop_recording_event):
-        """With MSS lib we take machine monitor
-        default dimensions to define the video size.
-        After since we are in thread we run until
-        the event passed is false.
+        """Since we are in thread we run until the event
+        passed is set. The video size is the one of the
+        first frame.
 
         To construct the video we take Selenium screenshots
         for each frame. The interesting part is that we can do
-        that even in the headless mode.
+        that even in the headless mode. With a Chromium browser
+        the frames can instead be pushed by the DevTools
+        screencast, falling back to the screenshots when it
+        fails. Each frame is placed by its timestamp, repeated
+        while the page does not change and dropped when several
+        land on the same frame slot, so the video plays at
+        the real speed.
+
+        In buffer mode the frames stay compressed in
+        memory and are only encoded if the video is persisted.
 
         Args:
             stop_recording_event (thread_event): is a passed
             event which indicates that the recording must stop
         """
-        self.screen = mss.mss()
-        monitor = self.screen.monitors[1]
-        out = cv2.VideoWriter(
-            self.output_filename,
-            cv2.VideoWriter_fourcc(*"XVID"),
-            20.0,
-            (monitor["width"], monitor["height"]),
-        )
+        self.started_at = time.monotonic()
         try:
-            while not stop_recording_event.is_set():
-                screenshot = self.driver.get_screenshot_as_png()
-                frame = cv2.imdecode(
-                    np.frombuffer(screenshot, np.uint8), cv2.IMREAD_COLOR
-                )
-                frame_resized = cv2.resize(
-                    frame, (monitor["width"], monitor["height"])
-                )
-                out.write(frame_resized)
+            streamed = False
+            if self.screencast:
+                streamed = self.record_screencast(stop_recording_event)
+            if not streamed:
+                self.poll_screenshots(stop_recording_event)
         finally:
-            out.release()
+            self.stopped_at = time.monotonic()
+            if self.buffer is None:
+                self.finish_encoding(self.stopped_at - self.started_at)
 
     def start_screen_rec(self):
         """Initiates the thread but before
@@ -101,10 +353,24 @@ class Video:
             self.stop_recording_event.set()
             sys.exit(1)
 
-        signal.signal(signal.SIGINT, signal_handler)
+        # Signal handlers can only be set from the main thread,
+        # workflows run by the scheduler rely on its own handling
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, signal_handler)
 
         self.record_thread.start()
 
+    def stop_screen_record(self):
+        """Stop the thread recording the video, the driver
+        is no longer used afterwards. The video is only
+        finished by end_screen_record, which may run later
+        in another thread.
+        """
+        self.stop_recording_event.set()
+        # The run may fail before the recording started
+        if self.record_thread.is_alive():
+            self.record_thread.join()
+
     def end_screen_record(self, persist_video=False):
         """Here we send the event to close the thread
         recording the video.
@@ -113,10 +379,14 @@ class Video:
             persist_video (bool, optional): If the execution did not
         give any errors we discard the video file. Defaults to False.
         """
-        self.stop_recording_event.set()
-        self.record_thread.join()
+        self.stop_screen_record()
 
-        if not persist_video:
+        if self.buffer is not None:
+            if persist_video:
+                self.encode_buffer()
+            self.buffer.clear()
+            self.buffer_size = 0
+        elif not persist_video and os.path.exists(self.output_filename):
             logging.info("Deleting file: " + self.output_filename)
             os.remove(self.output_filename)
 
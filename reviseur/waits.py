@@ -0,0 +1,230 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from reviseur.matching import TemplateMatcher
+from reviseur.templates import template_cache
+
+# Decoding flags returning the screenshot already downscaled
+REDUCED_GRAYSCALE = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+class Waiter:
+    """Replaces the fixed sleeps between the steps by
+    waits that return as soon as the page is ready.
+    Every wait is bounded by the timeout of the step
+    defined in the param.xml and its real duration
+    is logged so we can follow the site latency.
+    """
+
+    def __init__(
+        self,
+        driver,
+        timeouts=None,
+        default_timeout=10,
+        poll_frequency=0.2,
+        idle_time=0.5,
+    ):
+        """Initiates the waiter of a driver
+
+        Args:
+            driver: Selenium Driver
+            timeouts (dict, optional): timeout in seconds by step
+            default_timeout (int, optional): timeout of the other steps
+            poll_frequency (float, optional): seconds between checks
+            idle_time (float, optional): seconds without new network
+            requests to consider the page idle
+        """
+        self.driver = driver
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.poll_frequency = poll_frequency
+        self.idle_time = idle_time
+
+    def timeout(self, step):
+        """Returns the timeout configured for a step
+
+        Args:
+            step (str): name of the step
+
+        Returns:
+            float: timeout in seconds
+        """
+        return self.timeouts.get(step, self.default_timeout)
+
+    def _wait(self, step, name, condition):
+        """Wait until the condition is true or the
+        step timeout expires and log the duration.
+
+        Args:
+            step (str): name of the step
+            name (str): name of the wait for the logs
+            condition (callable): receives the driver
+
+        Returns:
+            bool: True when the condition was met
+        """
+        start = time.perf_counter()
+        try:
+            WebDriverWait(
+                self.driver,
+                self.timeout(step),
+                poll_frequency=self.poll_frequency,
+                ignored_exceptions=(WebDriverException,),
+            ).until(condition)
+            ready = True
+        except TimeoutException:
+            ready = False
+        elapsed = time.perf_counter() - start
+        if ready:
+            logging.info(f"{step} waited {elapsed:.2f}s for {name}")
+        else:
+            logging.warning(f"{step} timed out after {elapsed:.2f}s on {name}")
+        return ready
+
+    @staticmethod
+    def document_complete(driver):
+        """Condition of the document fully loaded
+
+        Args:
+            driver: Selenium Driver
+
+        Returns:
+            bool: True when the readyState is complete
+        """
+        state = driver.execute_script("return document.readyState")
+        return state == "complete"
+
+    def network_idle_condition(self):
+        """Builds a condition that is true when no new
+        resource was requested during the idle time.
+
+        Returns:
+            callable: condition receiving the driver
+        """
+        last = {"count": None, "since": time.monotonic()}
+
+        def condition(driver):
+            """Compare the number of resources loaded
+
+            Args:
+                driver: Selenium Driver
+
+            Returns:
+                bool: True when the network is idle
+            """
+            count = driver.execute_script(
+                "return window.performance"
+                + ".getEntriesByType('resource').length"
+            )
+            now = time.monotonic()
+            if count != last["count"]:
+                last["count"] = count
+                last["since"] = now
+                return False
+            return now - last["since"] >= self.idle_time
+
+        return condition
+
+    def settle(self, step):
+        """Wait for the document and the network
+        after an action in the page.
+
+        Args:
+            step (str): name of the step
+
+        Returns:
+            bool: True when the page is ready
+        """
+        return self._wait(
+            step, "document ready", self.document_complete
+        ) and self._wait(step, "network idle", self.network_idle_condition())
+
+    def until_visible(self, step, locator):
+        """Wait for an element to be displayed
+
+        Args:
+            step (str): name of the step
+            locator (tuple): selenium locator (By, value)
+
+        Returns:
+            bool: True when the element is visible
+        """
+        return self._wait(
+            step,
+            f"{locator[1]} visible",
+            EC.visibility_of_element_located(locator),
+        )
+
+    def until_matches(
+        self, step, expected, threshold=0.9, reduction=4, candidate=0.5
+    ):
+        """Poll cheap screenshots of the driver, decoded
+        already downscaled, to find where the expected
+        image may be. Only a candidate is confirmed on the
+        full resolution screenshot, as the downscaled score
+        drops with the sub-pixel offset of the image.
+
+        Args:
+            step (str): name of the step
+            expected (str): path to the image from the .xml
+            threshold (float, optional): minimum matching score
+            reduction (int, optional): downscale factor, 2, 4 or 8
+            candidate (float, optional): downscaled score worth
+            confirming at full resolution
+
+        Returns:
+            bool: True when the expected image was found
+        """
+        flag = REDUCED_GRAYSCALE[reduction]
+        full = template_cache.get(expected)
+        template = cv2.resize(
+            full,
+            (0, 0),
+            fx=1 / reduction,
+            fy=1 / reduction,
+            interpolation=cv2.INTER_AREA,
+        )
+        matcher = TemplateMatcher(levels=0, candidates=1)
+
+        def condition(driver):
+            """Match the template on a small screenshot and
+            confirm the candidate at full resolution
+
+            Args:
+                driver: Selenium Driver
+
+            Returns:
+                bool: True when the score reaches the threshold
+            """
+            png = np.frombuffer(driver.get_screenshot_as_png(), np.uint8)
+            screenshot = cv2.imdecode(png, flag)
+            if (
+                template.shape[0] > screenshot.shape[0]
+                or template.shape[1] > screenshot.shape[1]
+            ):
+                return False
+            _, score, _, (x, y) = cv2.minMaxLoc(
+                cv2.matchTemplate(screenshot, template, cv2.TM_CCOEFF_NORMED)
+            )
+            if score < candidate:
+                return False
+            # Window around the candidate, with the rounding of the reduction
+            screenshot = cv2.imdecode(png, cv2.IMREAD_GRAYSCALE)
+            left = max(x * reduction - 2 * reduction, 0)
+            top = max(y * reduction - 2 * reduction, 0)
+            bottom = top + full.shape[0] + 4 * reduction
+            right = left + full.shape[1] + 4 * reduction
+            window = screenshot[top:bottom, left:right]
+            return matcher.match(window, full).score >= threshold
+
+        return self._wait(step, f"{expected} on screen", condition)
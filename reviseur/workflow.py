@@ -0,0 +1,110 @@
+import functools
+
+from reviseur.matching import LOCATORS
+
+# Actions a step can do, each one is a Reviseur.action_<name> method
+ACTIONS = ("get", "click", "type", "scroll", "move_click")
+
+
+class Step:
+    """A step of a workflow defined in the param.xml: an
+    action on an element of the page, what to wait for
+    after it and the expected images checked on the
+    screenshot taken then.
+    """
+
+    def __init__(
+        self,
+        name,
+        action,
+        locator=None,
+        text=None,
+        wait=None,
+        expected=(),
+        threshold=0.9,
+        screenshot=None,
+    ):
+        """Initiates the step
+
+        Args:
+            name (str): name of the step in the logs and reports
+            action (str): one of the ACTIONS
+            locator (tuple, optional): selenium locator (By, value)
+            text (str, optional): input of the action, the url to get,
+            the text to type or the pixels to scroll
+            wait (str, optional): "settle", "visible" or the tag of
+            an expected image to wait for
+            expected (tuple, optional): tags of the images to check
+            threshold (float, optional): minimum score of the match
+            screenshot (str, optional): file name of the screenshot
+        """
+        self.name = name
+        self.action = action
+        self.locator = locator
+        self.text = text
+        self.wait = wait
+        self.expected = expected
+        self.threshold = threshold
+        self.screenshot = screenshot or f"{name}.png"
+
+    @classmethod
+    def from_attributes(cls, attributes):
+        """Builds the step from the attributes of its tag,
+        the locator is written as "id=...", "xpath=...",
+        "css=..." or "name=..." and the expected images as
+        tags separated by commas.
+
+        Args:
+            attributes (dict): attributes of the step tag
+
+        Returns:
+            Step: the step
+
+        Raises:
+            ValueError: The step is not valid
+        """
+        name = attributes.get("name")
+        action = attributes.get("action")
+        if not name or action not in ACTIONS:
+            raise ValueError(f"Step {name} has an unknown action: {action}")
+
+        locator = None
+        if attributes.get("locator"):
+            kind, _, value = attributes["locator"].partition("=")
+            if kind not in LOCATORS or not value:
+                raise ValueError(f"Step {name} has an invalid locator")
+            locator = (LOCATORS[kind], value)
+        if action not in ("get", "scroll") and locator is None:
+            raise ValueError(f"Step {name} needs a locator to {action}")
+        if attributes.get("wait") == "visible" and locator is None:
+            raise ValueError(f"Step {name} needs a locator to wait")
+
+        expected = attributes.get("expected", "")
+        return cls(
+            name,
+            action,
+            locator,
+            attributes.get("input"),
+            attributes.get("wait"),
+            tuple(tag.strip() for tag in expected.split(",") if tag.strip()),
+            float(attributes.get("threshold", 0.9)),
+            attributes.get("screenshot"),
+        )
+
+
+@functools.lru_cache(maxsize=64)
+def compile_plan(steps):
+    """Compile the steps of a workflow once, the plan is
+    reused while its definition in the param.xml is the
+    same, even though the settings are read at each run.
+
+    Args:
+        steps (tuple): attributes of each step as (key, value) pairs
+
+    Returns:
+        tuple: the Step objects in order
+
+    Raises:
+        ValueError: A step is not valid
+    """
+    return tuple(Step.from_attributes(dict(step)) for step in steps)
@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.artifacts import ArtifactPool
+
+
+def test_full_queue_makes_runs_wait():
+    """Test a run waits for a slot when the queue is full."""
+    pool = ArtifactPool(workers=1, queue=1)
+    release = threading.Event()
+    pool.submit("slow", release.wait)
+    submitted = threading.Event()
+
+    def submit():
+        pool.submit("next", lambda: None)
+        submitted.set()
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    assert not submitted.wait(0.2)
+    assert pool.waited == 1
+
+    release.set()
+    assert submitted.wait(2)
+    thread.join()
+    pool.shutdown()
+
+
+def test_failed_artifact_frees_its_slot():
+    """Test an artifact that raises is counted and its slot freed."""
+    pool = ArtifactPool(workers=1, queue=1)
+
+    def broken():
+        raise OSError("disk full")
+
+    pool.submit("broken", broken).result()
+    assert pool.submit("video", lambda: "saved").result() == "saved"
+    assert pool.failed == 1
+    assert pool.pending == 0
+    pool.shutdown()
+
+
+def test_shutdown_finishes_pending():
+    """Test the pending artifacts are finished by the shutdown."""
+    pool = ArtifactPool(workers=1, queue=4)
+    done = []
+    for index in range(3):
+        pool.submit(f"report {index}", done.append, index)
+    pool.shutdown()
+
+    assert done == [0, 1, 2]
+    pool.submit("late", done.append, 3)
+    assert done == [0, 1, 2, 3]
@@ -0,0 +1,31 @@
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.capture import Capture
+
+
+def encode_png(image):
+    """Helper to encode an array as PNG bytes."""
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def test_capture_decodes_once():
+    """Test the capture is decoded in grayscale a single time."""
+    driver = MagicMock()
+    driver.get_screenshot_as_png.return_value = encode_png(
+        np.zeros((30, 40, 3), np.uint8)
+    )
+    capture = Capture.from_driver(driver, "step.png")
+
+    with patch("reviseur.capture.cv2.imdecode", wraps=cv2.imdecode) as decode:
+        assert capture.gray.shape == (30, 40)
+        assert capture.gray is capture.gray
+
+    decode.assert_called_once()
+    driver.save_screenshot.assert_not_called()
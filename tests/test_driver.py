@@ -0,0 +1,157 @@
+import os
+import sys
+from unittest.mock import MagicMock, call, patch
+
+import pytest
+from selenium.common.exceptions import WebDriverException
+from urllib3.exceptions import MaxRetryError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.driver import DriverManager
+
+
+@pytest.fixture
+def settings():
+    """Fixture of the settings for a chrome browser."""
+    settings = MagicMock()
+    settings.default_browser = "chrome"
+    return settings
+
+
+@patch("reviseur.driver.webdriver.Chrome")
+def test_browser_reused_between_runs(mock_chrome, settings):
+    """Test the same browser is reused and cleaned."""
+    driver = mock_chrome.return_value
+    driver.execute_script.side_effect = lambda script: (
+        1 if script == "return 1" else ["https://a.fr", "null"]
+    )
+    manager = DriverManager(max_runs=3)
+
+    assert manager.acquire(settings) is driver
+    manager.release()
+    assert manager.acquire(settings) is driver
+
+    mock_chrome.assert_called_once()
+    driver.switch_to.new_window.assert_called_once_with("tab")
+    driver.close.assert_called_once()
+    driver.quit.assert_not_called()
+
+
+@patch("reviseur.driver.webdriver.Chrome")
+def test_release_clears_every_domain(mock_chrome, settings):
+    """Test the cookies and cache of the browser are cleared with
+    the storage of each origin of the page."""
+    driver = mock_chrome.return_value
+    driver.execute_script.side_effect = lambda script: (
+        1 if script == "return 1" else ["https://a.fr", "https://b.com"]
+    )
+    manager = DriverManager(max_runs=3)
+
+    manager.acquire(settings)
+    manager.release()
+
+    assert driver.execute_cdp_cmd.call_args_list == [
+        call("Network.clearBrowserCookies", {}),
+        call("Network.clearBrowserCache", {}),
+        call(
+            "Storage.clearDataForOrigin",
+            {"origin": "https://a.fr", "storageTypes": "all"},
+        ),
+        call(
+            "Storage.clearDataForOrigin",
+            {"origin": "https://b.com", "storageTypes": "all"},
+        ),
+    ]
+
+
+@patch("reviseur.driver.webdriver.Chrome")
+def test_browser_closed_when_not_cleared(mock_chrome, settings):
+    """Test a browser that can not be cleaned is not reused."""
+    driver = mock_chrome.return_value
+    driver.execute_script.return_value = []
+    driver.execute_cdp_cmd.side_effect = WebDriverException("closed")
+    manager = DriverManager(max_runs=3)
+
+    manager.acquire(settings)
+    manager.release()
+
+    driver.quit.assert_called_once()
+    assert manager.driver is None
+
+
+@patch("reviseur.driver.webdriver.Chrome")
+def test_browser_recycled_after_max_runs(mock_chrome, settings):
+    """Test the browser is closed once it reached its runs."""
+    manager = DriverManager(max_runs=1)
+
+    driver = manager.acquire(settings)
+    manager.release()
+
+    driver.quit.assert_called_once()
+    assert manager.driver is None
+
+
+@patch("reviseur.driver.webdriver.Chrome")
+def test_crashed_browser_replaced(mock_chrome, settings):
+    """Test a browser that does not answer is started again."""
+    crashed, fresh = MagicMock(), MagicMock()
+    crashed.execute_script.side_effect = WebDriverException("gone")
+    mock_chrome.side_effect = [crashed, fresh]
+    manager = DriverManager(max_runs=5)
+
+    manager.acquire(settings)
+    assert manager.acquire(settings) is fresh
+    crashed.quit.assert_called_once()
+    assert manager.runs == 1
+
+
+@patch("reviseur.driver.webdriver.Chrome")
+def test_dead_driver_process_replaced(mock_chrome, settings):
+    """Test a driver refusing connections is recycled."""
+    dead, fresh = MagicMock(), MagicMock()
+    refused = MaxRetryError(None, "/session", "Connection refused")
+    dead.execute_script.side_effect = refused
+    dead.quit.side_effect = refused
+    mock_chrome.side_effect = [dead, fresh]
+    manager = DriverManager(max_runs=5)
+
+    manager.acquire(settings)
+    assert manager.acquire(settings) is fresh
+    dead.quit.assert_called_once()
+
+
+@patch("reviseur.driver.webdriver.Chrome")
+def test_run_tab_replaced(mock_chrome, settings):
+    """Test the tab of the run, with its session storage, is closed."""
+    driver = mock_chrome.return_value
+    driver.execute_script.return_value = []
+    manager = DriverManager(max_runs=3)
+    manager.acquire(settings)
+
+    handles = iter(["run", "fresh"])
+    type(driver).current_window_handle = property(lambda _: next(handles))
+    manager.release()
+
+    assert driver.method_calls[-4:] == [
+        call.switch_to.new_window("tab"),
+        call.switch_to.window("run"),
+        call.close(),
+        call.switch_to.window("fresh"),
+    ]
+
+
+@patch("reviseur.driver.webdriver.Chrome")
+def test_browser_quit_in_background(mock_chrome, settings):
+    """Test the artifact pool is given the browser to quit."""
+    artifacts = MagicMock()
+    manager = DriverManager(max_runs=1)
+
+    driver = manager.acquire(settings)
+    manager.release(artifacts)
+
+    assert manager.driver is None
+    artifacts.submit.assert_called_once_with(
+        "browser quit", manager.close, driver
+    )
+    driver.quit.assert_not_called()
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.history import RunHistory, main, percentile
+from reviseur.metrics import RunMetrics
+
+
+def run(passed, started=None, geocoder=1.0):
+    """Helper building the metrics of a run."""
+    metrics = RunMetrics("banque_populaire")
+    if started is not None:
+        metrics.started = started.isoformat(timespec="seconds")
+    metrics.add(None, "driver_start", 2.0)
+    metrics.add("1_tout_acepter", "match", 0.5)
+    metrics.add("7_geocoder", "wait", geocoder)
+    metrics.add("7_geocoder", "match", 0.25)
+    metrics.add_scores("7_geocoder", {"images/5agences_banque.PNG": 0.97})
+    metrics.passed = passed
+    if not passed:
+        metrics.failed_step = "7_geocoder"
+        metrics.artifacts = {"report": "reports/report.pdf"}
+    return metrics
+
+
+def test_run_stored(tmp_path):
+    """Test a run is stored with its steps, phases and scores."""
+    history = RunHistory(str(tmp_path / "runs.sqlite"))
+    history.record(run(False))
+
+    connection = sqlite3.connect(history.path)
+    assert connection.execute(
+        "SELECT passed, failed_step, seconds, report, video FROM runs"
+    ).fetchall() == [(0, "7_geocoder", 3.75, "reports/report.pdf", None)]
+    assert connection.execute(
+        "SELECT step, passed, seconds FROM steps ORDER BY step"
+    ).fetchall() == [("1_tout_acepter", 1, 0.5), ("7_geocoder", 0, 1.25)]
+    assert connection.execute("SELECT COUNT(*) FROM phases").fetchone() == (4,)
+    assert connection.execute("SELECT step, score FROM scores").fetchall() == [
+        ("7_geocoder", 0.97)
+    ]
+    connection.close()
+
+
+def test_trend_by_day(tmp_path):
+    """Test the failures and percentiles of a step by day."""
+    history = RunHistory(str(tmp_path / "runs.sqlite"))
+    yesterday = datetime.now() - timedelta(days=1)
+    for index, passed in enumerate((True, False, True)):
+        history.record(run(passed, yesterday, geocoder=index))
+    history.record(run(True, datetime.now() - timedelta(days=30)))
+
+    ((day, runs, failures, p50, p95),) = history.trend("7_geocoder")
+    assert day == yesterday.date().isoformat()
+    assert (runs, failures, p50, p95) == (3, 1, 1.25, 2.25)
+
+
+def test_flaky_ranks_flips(tmp_path):
+    """Test a step flipping between results ranks first."""
+    history = RunHistory(str(tmp_path / "runs.sqlite"))
+    start = datetime.now() - timedelta(hours=5)
+    for hour, passed in enumerate((True, False, True, False)):
+        history.record(run(passed, start + timedelta(hours=hour)))
+
+    assert history.flaky() == [
+        ("7_geocoder", 4, 2, 3),
+        ("1_tout_acepter", 4, 0, 0),
+    ]
+
+
+def test_flaky_uses_started_index(tmp_path):
+    """Test the flaky steps are read in time order from an index."""
+    history = RunHistory(str(tmp_path / "runs.sqlite"))
+    history.record(run(True))
+
+    connection = sqlite3.connect(history.path)
+    plan = " ".join(
+        row[-1]
+        for row in connection.execute(
+            "EXPLAIN QUERY PLAN SELECT workflow, step, passed FROM steps"
+            + " WHERE started >= ? AND workflow = ? ORDER BY started",
+            ("2000-01-01", "banque_populaire"),
+        )
+    )
+    connection.close()
+    assert "INDEX steps_started" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_percentile():
+    """Test the nearest rank percentile."""
+    assert percentile([], 50) is None
+    assert percentile([3.0, 1.0, 2.0], 50) == 2.0
+    assert percentile([3.0, 1.0, 2.0], 95) == 3.0
+
+
+def test_cli_failures(tmp_path, capsys):
+    """Test the CLI lists the failed runs with their artifacts."""
+    path = str(tmp_path / "runs.sqlite")
+    RunHistory(path).record(run(False))
+    RunHistory(path).record(run(True))
+
+    main(["--db", path, "failures"])
+    (line,) = capsys.readouterr().out.splitlines()
+    assert "banque_populaire | 7_geocoder | reports/report.pdf" in line
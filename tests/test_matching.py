@@ -0,0 +1,159 @@
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import cv2
+import numpy as np
+import pytest
+from selenium.common.exceptions import NoSuchElementException
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.matching import MatchPolicy, MatchResult, Region, TemplateMatcher
+
+
+def test_parse_relative_region():
+    """Test fractions are read relative to the screenshot."""
+    region = Region.parse("0.5,0,0.5,0.25")
+    assert region.relative
+    assert region.box((1080, 1920), (10, 10)) == (0, 270, 960, 1920)
+
+
+def test_parse_absolute_region():
+    """Test pixels are used as they are."""
+    region = Region.parse("100,200,300,50")
+    assert not region.relative
+    assert region.box((1080, 1920), (10, 10)) == (200, 250, 100, 400)
+
+
+def test_parse_invalid_region():
+    """Test a region must have its four values."""
+    with pytest.raises(ValueError):
+        Region.parse("1,2,3")
+
+
+def test_box_fits_template_and_screenshot():
+    """Test the crop grows to the template and stays in the page."""
+    region = Region(1900, 1070, 10, 10)
+    top, bottom, left, right = region.box((1080, 1920), (40, 100))
+    assert (bottom - top, right - left) == (40, 100)
+    assert bottom == 1080 and right == 1920
+
+
+def test_crop_is_a_view():
+    """Test the crop does not copy the screenshot."""
+    image = np.zeros((100, 200), np.uint8)
+    crop = Region(10, 20, 30, 40).crop(image, (5, 5))
+    assert crop.shape == (40, 30)
+    assert np.shares_memory(crop, image)
+
+
+def test_region_from_element():
+    """Test the anchor uses the element rect and the margin."""
+    driver = MagicMock()
+    driver.execute_script.return_value = [100, 50, 200, 30]
+    region = Region.from_element(driver, "id=em-search-form", margin=10)
+
+    driver.find_element.assert_called_once_with("id", "em-search-form")
+    assert (region.x, region.y, region.width, region.height) == (
+        90,
+        40,
+        220,
+        50,
+    )
+
+
+def test_region_from_missing_element():
+    """Test a missing anchor means a full page search."""
+    driver = MagicMock()
+    driver.find_element.side_effect = NoSuchElementException()
+    assert Region.from_element(driver, "id=missing") is None
+
+
+@pytest.fixture
+def page():
+    """Fixture of a textured page and a part of it."""
+    rng = np.random.default_rng(2)
+    image = cv2.GaussianBlur(
+        rng.integers(0, 255, (540, 960), dtype=np.uint8), (5, 5), 0
+    )
+    return image, image[300:380, 500:660].copy()
+
+
+def test_coarse_to_fine_finds_template(page):
+    """Test the pyramid search finds the exact location."""
+    image, template = page
+    result = TemplateMatcher(levels=2).match(image, template)
+
+    assert result.location == (500, 300)
+    assert result.score == pytest.approx(1, abs=1e-3)
+    assert result.scale == 1.0
+    assert result.count(0.9) == 1
+    assert result.area == (500, 300, 160, 80)
+
+
+def test_coarse_search_is_cheaper(page):
+    """Test only small windows are matched at full resolution."""
+    image, template = page
+    with patch(
+        "reviseur.matching.cv2.matchTemplate", wraps=cv2.matchTemplate
+    ) as match:
+        TemplateMatcher(levels=2, candidates=2).match(image, template)
+
+    coarse, *refined = [call.args[0].shape for call in match.call_args_list]
+    assert coarse == (135, 240)
+    assert len(refined) == 2
+    assert all(shape[0] <= 80 + 8 for shape in refined)
+
+
+def test_template_scales(page):
+    """Test a reference captured at another zoom is found."""
+    image, template = page
+    bigger = cv2.resize(template, (0, 0), fx=1.25, fy=1.25)
+    result = TemplateMatcher(scales=(1.0, 0.8, 1.25)).match(image, bigger)
+
+    assert result.scale == 0.8
+    assert result.score > 0.9
+    assert result.location == pytest.approx((500, 300), abs=2)
+
+
+def test_small_template_uses_full_resolution():
+    """Test a template too small for the pyramid is matched directly."""
+    matcher = TemplateMatcher(levels=3, min_size=12)
+    assert matcher.coarse_levels(np.zeros((20, 200), np.uint8)) == 0
+    assert matcher.coarse_levels(np.zeros((50, 200), np.uint8)) == 2
+
+
+def test_repeated_template_peaks(page):
+    """Test every copy of the template is a separate peak."""
+    image, template = page
+    image = image.copy()
+    image[50:130, 100:260] = template
+    result = TemplateMatcher(levels=2, candidates=4).match(image, template)
+
+    assert result.count(0.9) == 2
+    assert sorted(peak[:2] for peak in result.peaks[:2]) == [
+        (100, 50),
+        (500, 300),
+    ]
+
+
+def test_policy_from_options():
+    """Test the attributes of the image override the defaults."""
+    options = {"minScore": "0.8", "maxCount": "1"}
+    policy = MatchPolicy.from_options(options, 0.9)
+    assert policy.min_score == 0.8
+    assert policy.expected_count is None
+    assert policy.max_count == 1
+    assert policy.candidates() == 2
+
+
+def test_policy_failures():
+    """Test the score and the number of peaks are checked."""
+    result = MatchResult([(0, 0, 0.95), (50, 0, 0.92)], 1.0, (10, 10))
+
+    assert MatchPolicy(0.9).failure(result) is None
+    assert "best score" in MatchPolicy(0.99).failure(result)
+    assert "expected 1" in MatchPolicy(0.9, expected_count=1).failure(result)
+    assert MatchPolicy(0.93, expected_count=1).failure(result) is None
+    assert "at most 1" in MatchPolicy(0.9, max_count=1).failure(result)
@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.metrics import MetricsExporter, RunMetrics
+
+
+def test_timer_records_failed_phase():
+    """Test a phase that raises is still timed."""
+    metrics = RunMetrics("banque_populaire")
+    with pytest.raises(RuntimeError):
+        with metrics.timer("7_geocoder", "wait"):
+            raise RuntimeError("timeout")
+
+    (step, phase, seconds), *_ = metrics.records
+    assert (step, phase) == ("7_geocoder", "wait")
+    assert seconds >= 0
+
+
+def test_totals_by_step_and_phase():
+    """Test a step run several times sums its phases."""
+    metrics = RunMetrics("banque_populaire")
+    metrics.add("3_trouver_une_agence", "action", 0.25)
+    metrics.add("3_trouver_une_agence", "action", 0.5)
+    metrics.add(None, "driver_start", 2.0)
+
+    assert metrics.totals() == {
+        ("3_trouver_une_agence", "action"): 0.75,
+        (None, "driver_start"): 2.0,
+    }
+
+
+def test_export_files(tmp_path):
+    """Test the JSON lines are appended and the Prometheus file replaced."""
+    exporter = MetricsExporter()
+    for passed in (True, False):
+        metrics = RunMetrics("banque_populaire")
+        metrics.add("1_tout_acepter", "match", 0.125)
+        metrics.passed = passed
+        exporter.export(metrics, tmp_path)
+
+    lines = (tmp_path / "metrics.jsonl").read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1])["passed"] is False
+    assert json.loads(lines[0])["seconds"] == 0.125
+
+    prometheus = (tmp_path / "reviseur.prom").read_text()
+    assert (
+        'reviseur_phase_seconds{workflow="banque_populaire",'
+        + 'step="1_tout_acepter",phase="match"} 0.125000'
+    ) in prometheus
+    assert (
+        'reviseur_runs_total{workflow="banque_populaire",status="failed"} 1'
+    ) in prometheus
+    assert not (tmp_path / "reviseur.prom.tmp").exists()
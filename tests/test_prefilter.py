@@ -0,0 +1,73 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.matching import MatchResult
+from reviseur.prefilter import Fingerprint, Prefilter, dhash, hamming
+
+
+@pytest.fixture
+def page():
+    """Fixture of a textured page."""
+    rng = np.random.default_rng(3)
+    return cv2.GaussianBlur(
+        rng.integers(0, 255, (540, 960), dtype=np.uint8), (15, 15), 0
+    )
+
+
+@pytest.fixture
+def expected(tmp_path):
+    """Fixture of an expected image file."""
+    path = tmp_path / "expected.png"
+    path.write_bytes(b"png")
+    return str(path)
+
+
+def test_dhash_close_for_similar_pages(page):
+    """Test noise barely changes the hash and another page does."""
+    noisy = cv2.add(page, np.ones_like(page))
+    assert hamming(dhash(page), dhash(noisy)) <= 2
+    assert hamming(dhash(page), dhash(cv2.flip(page, 1))) > 10
+
+
+def test_same_page_skips_matching(tmp_path, page, expected):
+    """Test a page that passed is accepted again, even after a restart."""
+    result = MatchResult([(10, 20, 0.97)], 1.0, (30, 40))
+    Prefilter(tmp_path / "cache.json").record(
+        "wf/1_step/expected.png", expected, Fingerprint(page), result
+    )
+
+    cached = Prefilter(tmp_path / "cache.json").lookup(
+        "wf/1_step/expected.png", expected, Fingerprint(page)
+    )
+    assert cached.peaks == [(10, 20, 0.97)]
+    assert cached.area == (10, 20, 30, 40)
+
+
+def test_changed_page_is_matched(tmp_path, page, expected):
+    """Test a different page or expected image falls through."""
+    prefilter = Prefilter(tmp_path / "cache.json")
+    key = "wf/1_step/expected.png"
+    prefilter.record(
+        key, expected, Fingerprint(page), MatchResult([], 1.0, (1, 1))
+    )
+
+    changed = page.copy()
+    changed[100:200, 100:300] = 255
+    assert prefilter.lookup(key, expected, Fingerprint(changed)) is None
+    assert prefilter.lookup("other", expected, Fingerprint(page)) is None
+
+    os.utime(expected, ns=(0, 0))
+    assert prefilter.lookup(key, expected, Fingerprint(page)) is None
+
+
+def test_broken_cache_file(tmp_path, page, expected):
+    """Test a corrupted file starts an empty cache."""
+    path = tmp_path / "cache.json"
+    path.write_text("{not json")
+    assert Prefilter(path).lookup("key", expected, Fingerprint(page)) is None
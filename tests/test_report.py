@@ -2,6 +2,8 @@ import os
 import sys
 from unittest.mock import ANY, MagicMock, patch
 
+import cv2
+import numpy as np
 import pytest
 from freezegun import freeze_time
 from reportlab.lib import colors
@@ -9,6 +11,7 @@ from reportlab.lib.pagesizes import A4
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from reviseur.capture import Capture
 from reviseur.report import Report
 
 
@@ -19,7 +22,7 @@ def mock_report():
 
 
 @freeze_time("2024-11-11 10:00:00")
-@patch("reviseur.report.canvas.Canvas")
+@patch("reportlab.pdfgen.canvas.Canvas")
 @patch("reviseur.report.pathlib.Path.mkdir")
 def test_report_initialization(mock_mkdir, mock_canvas):
     """
@@ -36,86 +39,42 @@ def test_report_initialization(mock_mkdir, mock_canvas):
     # Check that the directories are created
     mock_mkdir.assert_called_once_with(parents=True, exist_ok=True)
 
-    # Check that the canvas is initialized
+    # Check that the canvas is only initialized when first used
     # with the correct output path and A4 size
+    mock_canvas.assert_not_called()
+    assert report.canvas is mock_canvas.return_value
     mock_canvas.assert_called_once_with(
         f"reports/{report.output_pdf.split('/')[-1]}", pagesize=A4
     )
 
 
-@patch("reviseur.report.canvas.Canvas")
-def test_generate_report(mock_canvas, mock_report):
-    """Test the generation of the report (title page and image pages)."""
+def png_bytes(width=800, height=600):
+    """Encode a blank screenshot as PNG."""
+    _, png = cv2.imencode(".png", np.full((height, width, 3), 200, np.uint8))
+    return png.tobytes()
 
-    mock_report.create_title_page = MagicMock()
-    mock_report.add_image_pages = MagicMock()
-    # Mock canvas methods
-    mock_canvas_instance = MagicMock()
-    mock_canvas.return_value = mock_canvas_instance
-
-    # Define a dummy video path
-    video_path = "path/to/video.mp4"
-
-    # Run the generate_report method
-    mock_report.generate_report(video_path)
-
-    # Assert that the title page and image pages are generated
-    mock_report.create_title_page.assert_called_once_with(video_path)
-    mock_report.add_image_pages.assert_called_once()
-
-
-@patch("reviseur.report.canvas.Canvas")
-@patch("os.scandir")
-@patch("reviseur.report.Image.open")
-def test_add_image_pages(mock_image_open, mock_os_scandir, mock_canvas_class):
-    """Test the add_image_pages method."""
-
-    # Set up mock entries with path attributes
-    mock_entry1 = MagicMock()
-    mock_entry2 = MagicMock()
-    mock_entry1.path = "screenshots/step_1.png"
-    mock_entry2.path = "screenshots/step_2_FAILED.png"
-
-    # Mock stat for entries
-    mock_stat1 = MagicMock()
-    mock_stat1.st_mtime = 1000
-    mock_entry1.stat.return_value = mock_stat1
-    mock_stat2 = MagicMock()
-    mock_stat2.st_mtime = 2000
-    mock_entry2.stat.return_value = mock_stat2
-
-    # Mock the behavior of os.scandir to return the entries
-    mock_os_scandir.return_value = [mock_entry1, mock_entry2]
-
-    # Mock PIL Image open return value
-    mock_image = MagicMock()
-    mock_image.width = 800
-    mock_image.height = 600
-    mock_image_open.return_value = mock_image
 
+@patch("reportlab.pdfgen.canvas.Canvas")
+def test_failed_page_flagged(mock_canvas_class):
+    """Test only the failed step is flagged in the pages."""
     # Mock the canvas instance and ensure drawImage is mocked
     mock_canvas_instance = MagicMock()
     mock_canvas_class.return_value = mock_canvas_instance
 
-    # Initialize the Report with a mocked canvas
-    from reviseur.report import Report  # Adjust to actual module path
-
-    report = Report()  # This will use the mocked Canvas due to patching
-
-    # Run the add_image_pages method
-    report.add_image_pages()
-
-    # Assert Image.open is called with the correct paths
-    mock_image_open.assert_any_call("screenshots/step_1.png")
-    mock_image_open.assert_any_call("screenshots/step_2_FAILED.png")
-
-    # Assert drawImage is called with the mocked paths and dimensions
-    mock_canvas_instance.drawImage.assert_any_call(
-        "screenshots/step_1.png", 25, 250, width=400, height=300
-    )
-    mock_canvas_instance.drawImage.assert_any_call(
-        "screenshots/step_2_FAILED.png", 25, 250, width=400, height=300
-    )
+    report = Report()
+    report.add_image_page(Capture("step_1.png", png_bytes()))
+    report.add_image_page(Capture("step_2_FAILED.png", png_bytes()))
+
+    # Assert drawImage is called in order with the page dimensions
+    assert mock_canvas_instance.drawImage.call_count == 2
+    for call in mock_canvas_instance.drawImage.call_args_list:
+        assert call.args[1:] == (25, 250)
+        assert call.kwargs == {"width": 400, "height": 300}
+    texts = [
+        call.args[2] for call in mock_canvas_instance.drawString.call_args_list
+    ]
+    assert "FAILED" not in texts[0]
+    assert "FAILED" in texts[1]
 
 
 def test_sanitize_filename(mock_report):
@@ -137,58 +96,45 @@ def test_sanitize_filename(mock_report):
     mock_report.sanitize_filename.assert_called_once_with(filename)
 
 
-@patch("reviseur.report.os.scandir")
-@patch("reviseur.report.Image.open")
-def test_add_image_page(mock_image_open, mock_os_scandir, mock_report):
+def test_add_image_page(mock_report):
     """Test the add_image_page method."""
 
-    # Mock a single image file
-    mock_os_scandir.return_value = [
-        MagicMock(name="file1.png", path="screenshots/step_1.png")
-    ]
-
-    # Mock PIL Image open
-    mock_image = MagicMock()
-    mock_image.width = 800
-    mock_image.height = 600
-    mock_image_open.return_value = mock_image
-
     # Mock canvas methods
     mock_canvas_instance = MagicMock()
     mock_report.canvas = mock_canvas_instance
 
     # Run add_image_page method for one image
-    mock_report.add_image_page("screenshots/step_1.png")
+    mock_report.add_image_page(Capture("step_1.png", png_bytes()))
 
     # Check if the image is added to the canvas
-    mock_image_open.assert_called_once_with("screenshots/step_1.png")
     mock_canvas_instance.drawImage.assert_called_once_with(
-        "screenshots/step_1.png", 25, 250, width=400, height=300
+        ANY, 25, 250, width=400, height=300
     )
 
 
-@patch("reviseur.report.Image.open")
-@patch("reviseur.report.canvas.Canvas")
-def test_failed_image_handling(mock_canvas_class, mock_image_open):
-    """Test handling of images that contain 'FAILED' in their name."""
+def test_page_image_downscaled(mock_report):
+    """Test a full HD screenshot is embedded at the page resolution."""
+    capture = Capture("step_1.png", png_bytes(1920, 1080))
+    image, aspect_ratio = mock_report.page_image(capture)
+
+    assert image.getSize() == (833, 469)
+    assert aspect_ratio == 1920 / 1080
+    assert image.jpeg_fh() is not None
+    assert capture._gray is None
+
 
-    # Mock image properties
-    mock_image = MagicMock()
-    mock_image.width = 800
-    mock_image.height = 600
-    mock_image_open.return_value = mock_image
+@patch("reportlab.pdfgen.canvas.Canvas")
+def test_failed_image_handling(mock_canvas_class):
+    """Test handling of images that contain 'FAILED' in their name."""
 
     # Mock canvas instance and methods
     mock_canvas_instance = MagicMock()
     mock_canvas_class.return_value = mock_canvas_instance
 
-    # Create the report instance
-    from reviseur.report import Report  # Adjust path as needed
-
     report = Report()  # This uses the mocked Canvas
 
     # Run add_image_page method for a failed image
-    report.add_image_page("screenshots/step_1_FAILED.png")
+    report.add_image_page(Capture("step_1_FAILED.png", png_bytes()))
 
     # Check setFillColor and drawString were called with expected arguments
     mock_canvas_instance.setFillColor.assert_called_with(colors.red)
@@ -198,3 +144,57 @@ def test_failed_image_handling(mock_canvas_class, mock_image_open):
     called_text = mock_canvas_instance.drawString.call_args[0][2]
     assert "FAILED" in called_text
     assert "FOUND INCONSISTENT" in called_text
+
+
+def test_streamed_report_saved_on_failure(tmp_path, monkeypatch):
+    """Test the pages pushed during the run end up in the PDF."""
+    monkeypatch.chdir(tmp_path)
+    report = Report()
+    report.start("captures/video.avi")
+    report.add(Capture("1_home.png", png_bytes()), "1_home", 1.5, {"a.png": 1})
+    report.add(Capture("FAILED_2_go.png", png_bytes()), "2_go")
+
+    assert report.finish() == report.output_pdf
+    content = (tmp_path / report.output_pdf).read_bytes()
+    assert content.count(b"/Type /Page\n") == 3
+
+
+def test_streamed_report_discarded_on_success(tmp_path, monkeypatch):
+    """Test a run that passed writes no report."""
+    monkeypatch.chdir(tmp_path)
+    report = Report()
+    report.start("captures/video.avi")
+    report.add(Capture("1_home.png", png_bytes()), "1_home")
+    report.discard()
+
+    assert not (tmp_path / report.output_pdf).exists()
+    # Nothing was drawn, reportlab was not even needed
+    assert report._canvas is None
+    assert report.pages == []
+
+
+@patch("reportlab.pdfgen.canvas.Canvas")
+def test_page_details(mock_canvas_class):
+    """Test the step, timing and scores are written under the image."""
+    report = Report()
+    report.start("video.avi")
+    report.add(
+        Capture("1_home.png", png_bytes()),
+        "1_home",
+        0.5,
+        {"images/home.PNG": 0.97},
+    )
+    report.finish()
+
+    mock_canvas_class.return_value.drawString.assert_any_call(
+        30, 235, "1_home - 0.50s - home.PNG: 0.970"
+    )
+
+
+def test_title_names_workflow(tmp_path, monkeypatch):
+    """Test the title page names the workflow of the report."""
+    monkeypatch.chdir(tmp_path)
+    report = Report(name="banque_populaire")
+
+    assert report.title.endswith("\nReport for workflow banque_populaire")
+    assert "banquepopulaire.fr" not in Report().title
@@ -0,0 +1,106 @@
+import gzip
+import logging
+import os
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.retention import (
+    Janitor,
+    RetentionPolicy,
+    gzip_namer,
+    gzip_rotator,
+)
+
+DAY = 86400
+
+
+def make_file(folder, name, age, size=10):
+    """Helper writing a file modified some seconds ago."""
+    path = folder / name
+    path.write_bytes(b"x" * size)
+    moment = time.time() - age
+    os.utime(path, (moment, moment))
+    return path
+
+
+def test_age_cap():
+    """Test the files older than the age cap are removed."""
+    policy = RetentionPolicy("reports/", max_age_days=2)
+    files = [("old.pdf", 1000 - 3 * DAY, 1), ("new.pdf", 1000 - DAY, 1)]
+    assert policy.expired(files, 1000) == ["old.pdf"]
+
+
+def test_count_and_size_caps_remove_oldest():
+    """Test the oldest files go first when over the caps."""
+    files = [(f"{index}.avi", index, 100) for index in range(5)]
+    assert RetentionPolicy("captures/", max_files=3).expired(files, 10) == [
+        "0.avi",
+        "1.avi",
+    ]
+    policy = RetentionPolicy("captures/", max_megabytes=250 / 1024 / 1024)
+    assert policy.expired(files, 10) == ["0.avi", "1.avi", "2.avi"]
+
+
+def test_sweep_compresses_idle_logs(tmp_path):
+    """Test idle logs are gzipped and the open log is not touched."""
+    idle = make_file(tmp_path, "revisur_log_run_1.log", 2 * 3600)
+    recent = make_file(tmp_path, "revisur_log_run_2.log", 60)
+    expired = make_file(tmp_path, "revisur_log_run_0.log.gz", 40 * DAY)
+    current = make_file(tmp_path, "revisur_log_run_3.log", 5 * 3600)
+    handler = logging.FileHandler(current)
+    logging.getLogger().addHandler(handler)
+    try:
+        janitor = Janitor(
+            [RetentionPolicy(str(tmp_path), max_age_days=30, compress=True)]
+        )
+        janitor.sweep()
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "revisur_log_run_1.log.gz",
+        "revisur_log_run_2.log",
+        "revisur_log_run_3.log",
+    ]
+    assert gzip.open(f"{idle}.gz").read() == b"x" * 10
+    assert os.path.getmtime(f"{idle}.gz") < time.time() - 3600
+    assert recent.exists() and not expired.exists()
+    assert (janitor.compressed, janitor.removed) == (1, 1)
+
+
+def test_janitor_thread(tmp_path):
+    """Test the janitor sweeps at once in its thread and stops."""
+    make_file(tmp_path, "old.pdf", 10 * DAY)
+    janitor = Janitor([RetentionPolicy(str(tmp_path), max_age_days=1)], 60)
+    janitor.start()
+    janitor.stop()
+
+    assert not janitor.thread.is_alive()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rotated_logs_compressed(tmp_path):
+    """Test the rotated logs of a process are gzipped."""
+    handler = RotatingFileHandler(
+        tmp_path / "run.log", maxBytes=100, backupCount=2
+    )
+    handler.namer = gzip_namer
+    handler.rotator = gzip_rotator
+    logger = logging.getLogger("test_rotation")
+    logger.propagate = False
+    logger.addHandler(handler)
+    for index in range(10):
+        logger.warning("line %d %s", index, "x" * 40)
+    logger.removeHandler(handler)
+    handler.close()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "run.log",
+        "run.log.1.gz",
+        "run.log.2.gz",
+    ]
+    assert b"line 7" in gzip.open(tmp_path / "run.log.1.gz").read()
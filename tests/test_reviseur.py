@@ -1,16 +1,23 @@
 import os
+import subprocess
 import sys
 from unittest import mock
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 
+import cv2
 import numpy as np
 import pytest
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.common.by import By
 
+from reviseur.matching import TemplateMatcher
+from reviseur.prefilter import Prefilter
 from reviseur.reviewer import Reviseur
+from reviseur.utils import log_context, set_log_context
+from reviseur.workflow import Step
 
 
 @pytest.fixture
@@ -23,7 +30,9 @@ def mock_settings():
     settings.rechercher_click = "expected_rechercher_click.png"
     settings.cinq_agences_banque = "expected_cinq_agences_banque.png"
     settings.quatre_detail = "expected_quatre_detail.png"
+    settings.lyon_perrache = "expected_lyon_perrache.png"
     settings.default_browser = "chrome"
+    settings.image_options = {}
     return settings
 
 
@@ -45,8 +54,8 @@ def test_lackey_compare_successful_match(
     mock_imread, mock_resize, mock_matchTemplate, reviseur
 ):
     mock_imread.side_effect = [np.zeros((500, 500)), np.zeros((500, 500))]
-    match_result = np.array([[0.95]])
-    mock_matchTemplate.return_value = match_result
+    # Each call gives a new score map, the peaks are suppressed in place
+    mock_matchTemplate.side_effect = lambda *args: np.array([[0.95]])
     revis = reviseur
     revis.step = "3_trouver_une_agence"
 
@@ -65,7 +74,7 @@ def test_lackey_compare_mismatch_raises_exception(
     mock_imread, mock_resize, mock_matchTemplate, reviseur
 ):
     mock_imread.side_effect = [np.zeros((500, 500)), np.zeros((500, 500))]
-    match_result = np.array([[100] for _ in range(0, 101)])
+    match_result = np.full((101, 1), 0.5, np.float32)
     mock_matchTemplate.return_value = match_result
     revis = reviseur
     revis.step = "3_trouver_une_agence"
@@ -75,17 +84,46 @@ def test_lackey_compare_mismatch_raises_exception(
         )
 
 
+@pytest.fixture
+def png_screenshot():
+    _, png = cv2.imencode(".png", np.full((60, 80, 3), 255, np.uint8))
+    return png.tobytes()
+
+
+def test_capture_kept_in_memory(reviseur, png_screenshot):
+    driver = MagicMock()
+    driver.get_screenshot_as_png.return_value = png_screenshot
+
+    screenshot = reviseur.capture(driver, "step.png")
+
+    driver.save_screenshot.assert_not_called()
+    assert screenshot.name == "step.png"
+    assert screenshot.gray.shape == (60, 80)
+
+
 @mock.patch("reviseur.reviewer.Reviseur.lackey_compare")
-def test_step_tout_accepter(mock_lackey_compare, reviseur):
+def test_step_tout_accepter(mock_lackey_compare, reviseur, png_screenshot):
     driver = MagicMock()
-    reviseur.step_tout_acepter(driver)
-    driver.get.assert_called_once_with("https://www.banquepopulaire.fr")
-    driver.save_screenshot.assert_called_once_with(
-        "screenshots/tout_acepter_before_click.png"
+    driver.get_screenshot_as_png.return_value = png_screenshot
+    step = Step(
+        "1_tout_acepter",
+        "get",
+        text="https://www.banquepopulaire.fr",
+        expected=("toutAccepter",),
+        screenshot="tout_acepter_before_click.png",
     )
+    reviseur.report = MagicMock()
+    reviseur.run_step(driver, step)
+    driver.get.assert_called_once_with("https://www.banquepopulaire.fr")
+    reviseur.report.add.assert_called_once_with(ANY, "1_tout_acepter", ANY, {})
+    screenshot = reviseur.report.add.call_args.args[0]
+    driver.find_element.assert_not_called()
+    driver.save_screenshot.assert_not_called()
+    assert screenshot.name == "tout_acepter_before_click.png"
     mock_lackey_compare.assert_called_once_with(
         reviseur.settings.tout_accepter,
-        "screenshots/tout_acepter_before_click.png",
+        screenshot.gray,
+        0.9,
     )
 
 
@@ -94,33 +132,420 @@ def test_step_tout_accepter(mock_lackey_compare, reviseur):
 @patch("reviseur.reviewer.ActionChains")
 @patch("selenium.webdriver.Chrome")
 def test_step_trouver_une_agence(
-    mock_webdriver, mock_action_chains, mock_click_element, mock_lackey_compare
+    mock_webdriver,
+    mock_action_chains,
+    mock_click_element,
+    mock_lackey_compare,
+    png_screenshot,
 ):
     settings = MagicMock()
     reviseur = Reviseur(settings)
+    reviseur.report = MagicMock()
     driver = mock_webdriver()
 
     agence_element = MagicMock()
     driver.find_element.return_value = agence_element
     action_chain_instance = mock_action_chains.return_value
-    driver.save_screenshot = MagicMock()
-
-    reviseur.step_trouver_une_agence(driver)
-
-    driver.find_element.assert_called_once_with(
+    driver.get_screenshot_as_png.return_value = png_screenshot
+    locator = (
         By.XPATH,
         "//p[@class='font-text-body-bold']"
         + "[normalize-space()='Trouver une agence']",
     )
+
+    reviseur.run_step(
+        driver,
+        Step(
+            "3_trouver_une_agence",
+            "scroll",
+            locator,
+            text="1000",
+            wait="settle",
+            expected=("trouverUneAgence",),
+            screenshot="trouver_une_agence_click.png",
+        ),
+    )
+    reviseur.run_step(driver, Step("3_trouver_une_agence", "click", locator))
+
+    assert driver.find_element.call_args_list == [mock.call(*locator)] * 2
     action_chain_instance.move_to_element.assert_called_once_with(
         agence_element
     )
     driver.execute_script.assert_called_once_with("window.scrollBy(0, 1000);")
-    driver.save_screenshot.assert_called_once_with(
-        "screenshots/trouver_une_agence_click.png"
-    )
+    screenshots = [call.args[0] for call in reviseur.report.add.call_args_list]
+    assert [screenshot.name for screenshot in screenshots] == [
+        "trouver_une_agence_click.png"
+    ]
     mock_lackey_compare.assert_called_once_with(
         reviseur.settings.trouver_une_agence,
-        "screenshots/trouver_une_agence_click.png",
+        screenshots[0].gray,
+        0.9,
     )
     mock_click_element.assert_called_once_with(agence_element)
+    assert [phase for _, phase in reviseur.metrics.totals()] == [
+        "locate",
+        "action",
+        "wait",
+        "capture",
+        "decode",
+        "match",
+    ]
+
+
+@patch("reviseur.reviewer.Reviseur.compare_all")
+def test_step_type_and_compare_all(mock_compare_all, reviseur, png_screenshot):
+    driver = MagicMock()
+    driver.get_screenshot_as_png.return_value = png_screenshot
+    reviseur.waiter = MagicMock()
+    reviseur.report = MagicMock()
+    step = Step(
+        "6_submit_addr",
+        "type",
+        (By.ID, "em-search-form__searchcity"),
+        text="69000",
+        wait="lyonPerrache",
+        expected=("rechercherClick", "lyonPerrache"),
+        threshold=0.8,
+    )
+
+    reviseur.run_step(driver, step)
+
+    driver.find_element.return_value.send_keys.assert_called_once_with("69000")
+    reviseur.waiter.until_matches.assert_called_once_with(
+        "6_submit_addr", reviseur.settings.lyon_perrache, 0.8
+    )
+    screenshot = reviseur.report.add.call_args.args[0]
+    assert screenshot.name == "6_submit_addr.png"
+    mock_compare_all.assert_called_once_with(
+        [reviseur.settings.rechercher_click, reviseur.settings.lyon_perrache],
+        screenshot.gray,
+        0.8,
+    )
+
+
+def test_workflow_without_steps(reviseur):
+    reviseur.settings.workflow_steps = {}
+    with pytest.raises(ValueError, match="no steps"):
+        reviseur.run_workflow("banque_populaire")
+
+
+@pytest.fixture
+def page_with_button():
+    rng = np.random.default_rng(1)
+    page = rng.integers(0, 255, (300, 400), dtype=np.uint8)
+    button = page[200:240, 300:380].copy()
+    return page, button
+
+
+@patch("reviseur.reviewer.template_cache.fitted")
+def test_lackey_compare_searches_region_only(
+    mock_fitted, reviseur, page_with_button
+):
+    page, button = page_with_button
+    mock_fitted.return_value = button
+    reviseur.step = "6_submit_addr"
+    reviseur.matcher = TemplateMatcher(levels=0)
+    reviseur.settings.image_options = {
+        "button.png": {"region": "0.5,0.5,0.5,0.5"}
+    }
+
+    with patch(
+        "reviseur.reviewer.cv2.matchTemplate", wraps=cv2.matchTemplate
+    ) as match:
+        reviseur.lackey_compare("button.png", page)
+
+    match.assert_called_once()
+    assert match.call_args[0][0].shape == (150, 200)
+
+
+@patch("reviseur.reviewer.template_cache.fitted")
+def test_lackey_compare_falls_back_to_full_page(
+    mock_fitted, reviseur, page_with_button
+):
+    page, button = page_with_button
+    mock_fitted.return_value = button
+    reviseur.step = "6_submit_addr"
+    reviseur.matcher = TemplateMatcher(levels=0)
+    reviseur.settings.image_options = {"button.png": {"region": "0,0,0.5,0.5"}}
+
+    with patch(
+        "reviseur.reviewer.cv2.matchTemplate", wraps=cv2.matchTemplate
+    ) as match:
+        reviseur.lackey_compare("button.png", page)
+
+    assert match.call_count == 2
+    assert match.call_args[0][0].shape == (300, 400)
+
+
+@patch("reviseur.reviewer.template_cache.fitted")
+def test_lackey_compare_counts(mock_fitted, reviseur, page_with_button):
+    page, button = page_with_button
+    mock_fitted.return_value = button
+    reviseur.step = "6_submit_addr"
+    reviseur.matcher = TemplateMatcher(levels=0)
+    reviseur.settings.image_options = {
+        "button.png": {"minScore": "0.8", "expectedCount": "2"}
+    }
+
+    with pytest.raises(Exception, match="Inconsistency"):
+        reviseur.lackey_compare("button.png", page)
+
+
+@patch("reviseur.reviewer.template_cache.fitted")
+def test_compare_all_shared(mock_fitted, reviseur, page_with_button):
+    page, button = page_with_button
+    corner = page[0:40, 0:60].copy()
+    mock_fitted.side_effect = lambda path, shape: {
+        "button.png": button,
+        "corner.png": corner,
+    }[path]
+    reviseur.step = "7_geocoder"
+
+    with patch.object(
+        reviseur, "lackey_compare", wraps=reviseur.lackey_compare
+    ) as compare:
+        results = reviseur.compare_all(["button.png", "corner.png"], page)
+
+    assert all(call.args[1] is page for call in compare.call_args_list)
+    assert results["button.png"].location == (300, 200)
+    assert results["corner.png"].location == (0, 0)
+
+
+def test_compare_all_logs_with_the_step(reviseur):
+    contexts = []
+
+    def compare(image, actual, threshold):
+        fields = log_context.get()
+        contexts.append((fields["run_id"], fields["step"]))
+
+    set_log_context(run_id="abc123", step="7_geocoder")
+    try:
+        with patch.object(reviseur, "lackey_compare", side_effect=compare):
+            reviseur.compare_all(["button.png", "corner.png"], np.zeros(1))
+    finally:
+        set_log_context(run_id=None, step=None)
+
+    assert contexts == [("abc123", "7_geocoder")] * 2
+
+
+@patch("reviseur.reviewer.template_cache.fitted")
+def test_compare_all_raises_after_every_image(
+    mock_fitted, reviseur, page_with_button
+):
+    page, button = page_with_button
+    mock_fitted.side_effect = lambda path, shape: {
+        "missing.png": np.random.default_rng(5).integers(
+            0, 255, (40, 80), dtype=np.uint8
+        ),
+        "button.png": button,
+    }[path]
+    reviseur.step = "7_geocoder"
+
+    with patch.object(
+        reviseur, "lackey_compare", wraps=reviseur.lackey_compare
+    ) as compare:
+        with pytest.raises(Exception, match="Inconsistency"):
+            reviseur.compare_all(["missing.png", "button.png"], page)
+
+    assert compare.call_count == 2
+
+
+@patch("reviseur.reviewer.template_cache.fitted")
+def test_prefilter_skips_same_page(
+    mock_fitted, reviseur, page_with_button, tmp_path
+):
+    page, button = page_with_button
+    mock_fitted.return_value = button
+    reviseur.step = "6_submit_addr"
+    reviseur.prefilter = Prefilter(tmp_path / "prefilter.json")
+
+    with patch(
+        "reviseur.reviewer.cv2.matchTemplate", wraps=cv2.matchTemplate
+    ) as match:
+        first = reviseur.lackey_compare("button.png", page)
+        match.reset_mock()
+        second = reviseur.lackey_compare("button.png", page)
+
+    match.assert_not_called()
+    assert second.area == first.area
+
+
+@patch("reviseur.reviewer.template_cache.fitted")
+def test_prefilter_pass_needs_same_policy(
+    mock_fitted, reviseur, page_with_button, tmp_path
+):
+    page, button = page_with_button
+    mock_fitted.return_value = button
+    reviseur.step = "6_submit_addr"
+    reviseur.prefilter = Prefilter(tmp_path / "prefilter.json")
+    reviseur.lackey_compare("button.png", page)
+
+    # The param.xml now allows the button nowhere but in a corner
+    reviseur.settings.image_options = {"button.png": {"region": "0,0,90,50"}}
+    with patch(
+        "reviseur.reviewer.cv2.matchTemplate", wraps=cv2.matchTemplate
+    ) as match:
+        reviseur.lackey_compare("button.png", page)
+    match.assert_called()
+
+    # A stricter minScore than the cached score is not served either
+    reviseur.settings.image_options = {"button.png": {"minScore": "1.01"}}
+    with pytest.raises(Exception, match="Inconsistency"):
+        reviseur.lackey_compare("button.png", page)
+
+
+@patch("reviseur.reviewer.template_cache.fitted")
+def test_failed_step_pushed(mock_fitted, reviseur, page_with_button):
+    page, button = page_with_button
+    mock_fitted.return_value = np.random.default_rng(5).integers(
+        0, 255, (40, 80), dtype=np.uint8
+    )
+    reviseur.report = MagicMock()
+    reviseur.settings.rechercher_click = "button.png"
+    driver = MagicMock()
+    _, png = cv2.imencode(".png", page)
+    driver.get_screenshot_as_png.return_value = png.tobytes()
+    step = Step("6_submit_addr", "get", expected=("rechercherClick",))
+
+    with pytest.raises(Exception, match="Inconsistency"):
+        reviseur.run_step(driver, step)
+
+    _, step_name, _, scores = reviseur.report.add.call_args.args
+    assert step_name == "6_submit_addr"
+    assert scores["button.png"] < 0.9
+    assert reviseur.metrics.scores == [("6_submit_addr", *scores.popitem())]
+
+
+@patch("reviseur.reviewer.Report")
+@patch("reviseur.reviewer.Video")
+def test_failed_run_artifacts_in_background(mock_video, mock_report, reviseur):
+    reviseur.settings.workflow_steps = {
+        "banque_populaire": (
+            (("name", "1_tout_acepter"), ("action", "get"), ("input", "x")),
+        )
+    }
+    reviseur.settings.prefilter = {}
+    reviseur.settings.metrics = {}
+    reviseur.settings.matching = {}
+    reviseur.drivers = MagicMock()
+    reviseur.artifacts = MagicMock()
+    reviseur.drivers.acquire.return_value.get.side_effect = Exception("down")
+    reviseur.capture = MagicMock()
+
+    mock_video.return_value.output_filename = "captures/missing.avi"
+    reviseur.run_workflow("banque_populaire")
+
+    video = mock_video.return_value
+    video.stop_screen_record.assert_called_once()
+    video.end_screen_record.assert_not_called()
+    reviseur.drivers.release.assert_called_once_with(reviseur.artifacts)
+    name, finish = reviseur.artifacts.submit.call_args.args
+    assert name == "banque_populaire artifacts"
+
+    finish()
+    video.end_screen_record.assert_called_once_with(persist_video=True)
+    mock_report.return_value.finish.assert_called_once()
+    assert not reviseur.metrics.passed
+    assert reviseur.metrics.failed_step == "1_tout_acepter"
+    assert reviseur.metrics.artifacts == {
+        "report": mock_report.return_value.finish.return_value
+    }
+
+
+@patch("reviseur.reviewer.Report")
+@patch("reviseur.reviewer.Video")
+def test_killed_browser_keeps_artifacts(mock_video, mock_report, reviseur):
+    reviseur.settings.workflow_steps = {
+        "banque_populaire": (
+            (("name", "1_tout_acepter"), ("action", "get"), ("input", "x")),
+        )
+    }
+    reviseur.settings.prefilter = {}
+    reviseur.settings.metrics = {}
+    reviseur.settings.matching = {}
+    reviseur.drivers = MagicMock()
+    reviseur.artifacts = MagicMock()
+    driver = reviseur.drivers.acquire.return_value
+    driver.get.side_effect = WebDriverException("session deleted")
+    driver.get_screenshot_as_png.side_effect = WebDriverException(
+        "session deleted"
+    )
+
+    reviseur.run_workflow("banque_populaire")
+
+    mock_video.return_value.stop_screen_record.assert_called_once()
+    mock_report.return_value.add.assert_not_called()
+    name, _ = reviseur.artifacts.submit.call_args.args
+    assert name == "banque_populaire artifacts"
+    assert reviseur.metrics.failed_step == "1_tout_acepter"
+
+
+@patch("reviseur.reviewer.Report")
+@patch("reviseur.reviewer.Video")
+def test_failure_before_first_step(mock_video, mock_report, reviseur):
+    reviseur.settings.workflow_steps = {
+        "banque_populaire": (
+            (("name", "1_tout_acepter"), ("action", "get"), ("input", "x")),
+        )
+    }
+    reviseur.settings.prefilter = {}
+    reviseur.settings.metrics = {}
+    reviseur.settings.matching = {}
+    reviseur.drivers = MagicMock()
+    mock_video.return_value.start_screen_rec.side_effect = OSError("codec")
+    mock_video.return_value.output_filename = "captures/missing.avi"
+
+    reviseur.run_workflow("banque_populaire")
+
+    assert not reviseur.metrics.passed
+    assert reviseur.metrics.failed_step is None
+    mock_report.return_value.finish.assert_called_once()
+
+
+def test_run_stored_in_shared_history(reviseur):
+    reviseur.settings.metrics = {}
+    reviseur.history = MagicMock()
+
+    reviseur.export_metrics()
+
+    reviseur.history.record.assert_called_once_with(reviseur.metrics)
+
+
+def test_wait_uses_image_min_score(reviseur):
+    reviseur.waiter = MagicMock()
+    reviseur.settings.image_options = {"lyon.png": {"minScore": "0.97"}}
+
+    reviseur.wait_ready("lyon.png", 0.8)
+
+    reviseur.waiter.until_matches.assert_called_once_with(
+        None, "lyon.png", 0.97
+    )
+
+
+def test_run_exported_when_artifacts_fail(reviseur):
+    reviseur.settings.metrics = {}
+    reviseur.history = MagicMock()
+    video, report = MagicMock(), MagicMock()
+    video.end_screen_record.side_effect = OSError("disk full")
+    report.finish.side_effect = ValueError("bad image")
+
+    reviseur.finish_artifacts(video, report, reviseur.metrics)
+
+    reviseur.history.record.assert_called_once_with(reviseur.metrics)
+    assert reviseur.metrics.artifacts == {}
+
+
+def test_heavy_modules_imported_when_used():
+    code = (
+        "import sys, reviseur.reviewer; "
+        + "print(*(name for name in ('lackey', 'reportlab', 'mss') "
+        + "if name in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.strip() == ""
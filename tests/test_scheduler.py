@@ -0,0 +1,195 @@
+import os
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.scheduler import Job, Scheduler
+
+
+def run_scheduler(scheduler, seconds):
+    """Helper running the scheduler loop for a while."""
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(seconds)
+    scheduler.stop()
+    thread.join()
+
+
+def test_slow_job_does_not_delay_others():
+    """Test a fast job keeps running while a slow one is busy."""
+    runs = {"slow": 0, "fast": 0}
+
+    def run_job(job):
+        runs[job.name] += 1
+        time.sleep(1 if job.name == "slow" else 0.01)
+
+    scheduler = Scheduler(run_job, workers=2)
+    scheduler.add(Job("slow", interval=0.05))
+    scheduler.add(Job("fast", interval=0.05))
+    run_scheduler(scheduler, 0.5)
+
+    assert runs["slow"] == 1
+    assert runs["fast"] >= 4
+
+
+def test_job_never_runs_twice_at_once():
+    """Test a job is only scheduled again after it ends."""
+    active = []
+    overlaps = []
+
+    def run_job(job):
+        overlaps.append(len(active))
+        active.append(job)
+        time.sleep(0.05)
+        active.remove(job)
+
+    scheduler = Scheduler(run_job, workers=4)
+    scheduler.add(Job("only", interval=0))
+    run_scheduler(scheduler, 0.3)
+
+    assert len(overlaps) >= 2
+    assert max(overlaps) == 0
+
+
+def test_failed_job_is_rescheduled():
+    """Test an exception in a workflow does not stop its schedule."""
+    calls = []
+
+    def run_job(job):
+        calls.append(job.name)
+        raise RuntimeError("browser crashed")
+
+    scheduler = Scheduler(run_job)
+    scheduler.add(Job("broken", interval=0.02))
+    run_scheduler(scheduler, 0.2)
+
+    assert len(calls) >= 2
+
+
+def test_slots_do_not_drift_with_run_duration():
+    """Test the next run is on the grid, not after the run."""
+    job = Job("grid", interval=10)
+    job.slot = job.next_run = 100.0
+
+    job.start(100.5)
+    job.finish(104.0)
+
+    assert job.next_run == 110.0
+    assert job.last_latency == 3.5
+    assert job.last_lag == 0.5
+
+
+def test_overrun_skips_missed_slots():
+    """Test a run longer than the interval skips the missed slots."""
+    job = Job("skip", interval=10)
+    job.slot = job.next_run = 100.0
+
+    job.start(100.0)
+    job.finish(125.0)
+
+    assert job.next_run == 130.0
+    assert job.overruns == 1
+    assert job.skipped == 2
+
+
+def test_overrun_queue_runs_right_away():
+    """Test the queue policy runs once at the end of the overrun."""
+    job = Job("queue", interval=10, overrun="queue")
+    job.slot = job.next_run = 100.0
+
+    job.start(100.0)
+    job.finish(125.0)
+
+    assert job.next_run == 125.0
+    assert job.slot == 130.0
+    assert job.skipped == 1
+
+
+def test_hung_run_has_browser_killed():
+    """Test a run past its timeout gets its browser quit."""
+    released = threading.Event()
+
+    def run_job(job):
+        job.drivers.driver = driver
+        released.wait(2)
+
+    driver = MagicMock()
+    driver.quit.side_effect = lambda: released.set()
+    scheduler = Scheduler(run_job)
+    job = Job("hung", interval=60, timeout=0.1)
+    scheduler.add(job)
+    run_scheduler(scheduler, 0.5)
+
+    driver.quit.assert_called_once()
+    assert job.runs == 1
+    assert job.last_latency < 1
+
+
+def test_stop_kills_hung_run():
+    """Test stopping still kills a run past its timeout."""
+    released = threading.Event()
+
+    def run_job(job):
+        job.drivers.driver = driver
+        released.wait(5)
+
+    driver = MagicMock()
+    driver.quit.side_effect = lambda: released.set()
+    scheduler = Scheduler(run_job)
+    job = Job("hung", interval=60, timeout=0.3)
+    scheduler.add(job)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    scheduler.stop()
+    thread.join()
+
+    assert time.monotonic() - start < 2
+    assert job.killed
+    assert job.runs == 1
+
+
+def test_stop_gives_up_on_run_surviving_kill():
+    """Test stopping returns when a killed run never ends."""
+    released = threading.Event()
+    scheduler = Scheduler(lambda job: released.wait(5))
+    job = Job("stuck", interval=60, timeout=0.1)
+    scheduler.add(job)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    scheduler.stop(grace=0.2)
+    thread.join()
+
+    assert time.monotonic() - start < 2
+    assert job.killed
+    released.set()
+
+
+def test_job_without_interval_not_killed():
+    """Test a job run again at once has no default timeout."""
+    done = threading.Event()
+
+    def run_job(job):
+        time.sleep(0.1)
+        done.set()
+
+    job = Job("loop", interval=0)
+    assert job.timeout is None
+    scheduler = Scheduler(run_job)
+    scheduler.add(job)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    done.wait(2)
+    scheduler.stop()
+    thread.join()
+
+    assert not job.killed
+    assert job.runs >= 1
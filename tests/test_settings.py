@@ -0,0 +1,300 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.settings import Settings, SettingsWatcher
+
+
+@pytest.fixture
+def xml_file(tmp_path):
+    """Fixture writing a small param.xml."""
+    path = tmp_path / "param.xml"
+    path.write_text("""<?xml version="1.0" encoding="UTF-8"?>
+<parameters>
+    <defaultBrowser>chrome</defaultBrowser>
+    <setAutoWaitTimeout>3</setAutoWaitTimeout>
+    <stepTimeouts>
+        <timeout step="7_geocoder">12</timeout>
+        <timeout step="8_quatre_detail">8.5</timeout>
+    </stepTimeouts>
+    <images>
+        <toutAccepter>images/tout_accepter.PNG</toutAccepter>
+    </images>
+</parameters>""")
+    return str(path)
+
+
+def test_simple_values(xml_file):
+    """Test the tags are converted to the attributes."""
+    settings = Settings(xml_file)
+    assert settings.default_browser == "chrome"
+    assert settings.set_auto_wait_timeout == 3
+    assert settings.tout_accepter == "images/tout_accepter.PNG"
+
+
+def test_step_timeouts(xml_file):
+    """Test the timeouts by step are read apart."""
+    settings = Settings(xml_file)
+    assert settings.step_timeouts == {
+        "7_geocoder": 12.0,
+        "8_quatre_detail": 8.5,
+    }
+    assert not hasattr(settings, "timeout")
+
+
+def test_scalars_typed(tmp_path):
+    """Test the known scalars are converted to their type."""
+    path = tmp_path / "param.xml"
+    path.write_text(
+        "<parameters><videoFps>7.5</videoFps><driverMaxRuns>24</driverMaxRuns>"
+        + "<videoScreencast>true</videoScreencast></parameters>"
+    )
+    settings = Settings(str(path))
+    assert settings.video_fps == 7.5
+    assert settings.driver_max_runs == 24
+    assert settings.video_screencast is True
+
+    for tag, text in (
+        ("driverMaxRuns", "lots"),
+        ("setAutoWaitTimeout", ""),
+        ("videoScreencast", "yes"),
+    ):
+        path.write_text(f"<parameters><{tag}>{text}</{tag}></parameters>")
+        with pytest.raises(ValueError, match=f"Bad <{tag}>"):
+            Settings(str(path))
+
+
+def test_empty_step_timeout(tmp_path):
+    """Test an empty timeout is an error naming its step."""
+    path = tmp_path / "param.xml"
+    path.write_text(
+        '<parameters><stepTimeouts><timeout step="7_geocoder"/>'
+        + "</stepTimeouts></parameters>"
+    )
+    with pytest.raises(ValueError, match="7_geocoder"):
+        Settings(str(path))
+
+
+def test_prefilter(tmp_path, xml_file):
+    """Test the prefilter is only enabled by its section."""
+    path = tmp_path / "prefilter.xml"
+    path.write_text('<parameters><prefilter distance="2"/></parameters>')
+    assert Settings(str(path)).prefilter == {
+        "distance": 2,
+        "tolerance": 8,
+        "directory": "cache/",
+    }
+    assert Settings(xml_file).prefilter == {}
+
+
+def test_workflow_steps(tmp_path):
+    """Test the steps are kept apart from the workflow."""
+    path = tmp_path / "steps.xml"
+    path.write_text("""<parameters>
+    <workflows>
+        <workflow name="home" interval="60">
+            <step name="1_home" action="get" input="https://a.b"/>
+            <step name="2_go" action="click" locator="css=.go"/>
+        </workflow>
+    </workflows>
+</parameters>""")
+    settings = Settings(str(path))
+
+    assert settings.workflows[0]["name"] == "home"
+    assert "steps" not in settings.workflows[0]
+    assert settings.workflow_steps["home"] == (
+        (("name", "1_home"), ("action", "get"), ("input", "https://a.b")),
+        (("name", "2_go"), ("action", "click"), ("locator", "css=.go")),
+    )
+
+
+def test_retention(tmp_path):
+    """Test the caps of each folder are read."""
+    path = tmp_path / "retention.xml"
+    path.write_text(
+        '<parameters><retention interval="60">'
+        + '<folder path="logs/" maxAgeDays="30" compress="true"/>'
+        + '<folder path="captures/" maxFiles="10" maxMegabytes="500"/>'
+        + "</retention></parameters>"
+    )
+    assert Settings(str(path)).retention == {
+        "interval": 60.0,
+        "folders": (
+            {"path": "logs/", "max_age_days": 30.0, "compress": True},
+            {
+                "path": "captures/",
+                "max_files": 10,
+                "max_megabytes": 500.0,
+                "compress": False,
+            },
+        ),
+    }
+
+
+def write_config(path, image, expected="toutAccepter"):
+    """Helper writing a param.xml with a workflow using an image."""
+    path.write_text(f"""<parameters>
+    <defaultBrowser>chrome</defaultBrowser>
+    <workflows>
+        <workflow name="home">
+            <step name="1_home" action="get" input="https://a.b"
+                expected="{expected}"/>
+        </workflow>
+    </workflows>
+    <images>
+        <toutAccepter>{image}</toutAccepter>
+        <newButton>{image}</newButton>
+    </images>
+</parameters>""")
+    return str(path)
+
+
+@pytest.fixture
+def image(tmp_path):
+    """Fixture writing an expected image."""
+    path = tmp_path / "button.png"
+    cv2.imwrite(str(path), np.full((20, 40), 128, np.uint8))
+    return str(path)
+
+
+def test_settings_are_read_only(xml_file):
+    """Test the settings can not be changed once loaded."""
+    settings = Settings(xml_file)
+    with pytest.raises(AttributeError, match="read-only"):
+        settings.default_browser = "edge"
+    with pytest.raises(AttributeError):
+        settings.unknown = 1
+    with pytest.raises(TypeError):
+        settings.images["tout_accepter"] = "other.png"
+    with pytest.raises(TypeError):
+        settings.step_timeouts["7_geocoder"] = 60
+
+
+def test_empty_images_group(tmp_path):
+    """Test an empty images tag is a validation error, not a crash."""
+    path = tmp_path / "param.xml"
+    path.write_text("""<parameters>
+    <workflows>
+        <workflow name="home">
+            <step name="1_home" action="get" input="https://a.b"
+                expected="toutAccepter"/>
+        </workflow>
+    </workflows>
+    <images/>
+</parameters>""")
+    settings = Settings(str(path))
+
+    assert settings.images == {}
+    with pytest.raises(ValueError, match="1_home uses unknown toutAccepter"):
+        settings.validate()
+
+
+def test_images_without_slot(tmp_path, image):
+    """Test an image tag without its own slot is still readable."""
+    settings = Settings(write_config(tmp_path / "param.xml", image))
+    assert settings.new_button == image
+    assert settings.images["tout_accepter"] == image
+    with pytest.raises(AttributeError):
+        settings.old_button
+
+
+def test_bad_xml_fails(tmp_path):
+    """Test a broken or unknown setting is an error, not a print."""
+    path = tmp_path / "broken.xml"
+    path.write_text("<parameters><videoFps>5</parameters>")
+    with pytest.raises(ValueError, match="Error parsing"):
+        Settings(str(path))
+    path.write_text("<parameters><videoFsp>5</videoFsp></parameters>")
+    with pytest.raises(ValueError, match="Unknown setting <videoFsp>"):
+        Settings(str(path))
+
+
+def test_validate_images(tmp_path, image):
+    """Test the images used by the steps must be declared and load."""
+    Settings(write_config(tmp_path / "good.xml", image)).validate()
+
+    settings = Settings(write_config(tmp_path / "bad.xml", "missing.png"))
+    with pytest.raises(ValueError, match="not found: missing.png"):
+        settings.validate()
+    path = write_config(tmp_path / "typo.xml", image, "toutAcepter")
+    with pytest.raises(ValueError, match="1_home uses unknown toutAcepter"):
+        Settings(path).validate()
+
+
+def test_validate_image_options(tmp_path, image):
+    """Test the attributes of the images are checked."""
+    path = tmp_path / "param.xml"
+    write_config(path, image)
+    path.write_text(
+        path.read_text().replace(
+            "<newButton>",
+            '<newButton region="0,0,0,10" minScore="1.5" maxCount="0">',
+        )
+    )
+    with pytest.raises(ValueError) as err:
+        Settings(str(path)).validate()
+    assert "empty region" in str(err.value)
+    assert "minScore 1.5" in str(err.value)
+    assert "maxCount 0" in str(err.value)
+
+    text = path.read_text()
+    path.write_text(text.replace('maxCount="0"', 'maxCount="lots"'))
+    with pytest.raises(ValueError, match="bad minScore or count"):
+        Settings(str(path)).validate()
+
+
+def test_shipped_config_is_valid(monkeypatch):
+    """Test the param.xml of the repository loads and validates."""
+    monkeypatch.chdir(os.path.join(os.path.dirname(__file__), ".."))
+    Settings("param.xml").validate()
+
+
+def test_watcher_reloads_only_on_change(tmp_path, image):
+    """Test the file is parsed again only once changed."""
+    path = write_config(tmp_path / "param.xml", image)
+    watcher = SettingsWatcher(path)
+    first = watcher.current()
+    assert watcher.current() is first
+
+    write_config(tmp_path / "param.xml", image)
+    os.utime(path, ns=(0, watcher.mtime + 10**9))
+    assert watcher.current() is not first
+
+
+def test_watcher_keeps_last_good(tmp_path, image, caplog):
+    """Test a bad version of the file keeps the last good settings."""
+    path = write_config(tmp_path / "param.xml", image)
+    watcher = SettingsWatcher(path)
+    good = watcher.current()
+
+    write_config(tmp_path / "param.xml", "missing.png")
+    os.utime(path, ns=(0, watcher.mtime + 10**9))
+    assert watcher.current() is good
+    assert "Keeping the last good settings" in caplog.text
+
+    with pytest.raises(ValueError):
+        SettingsWatcher(path).current()
+
+
+def test_watcher_tries_a_bad_version_once(tmp_path, image, monkeypatch):
+    """Test any error keeps the last good settings, once per version."""
+    path = write_config(tmp_path / "param.xml", image)
+    watcher = SettingsWatcher(path)
+    good = watcher.current()
+
+    calls = []
+
+    def broken(settings):
+        calls.append(settings)
+        raise TypeError("broken")
+
+    monkeypatch.setattr(Settings, "validate", broken)
+    os.utime(path, ns=(0, watcher.mtime + 10**9))
+    assert watcher.current() is good
+    assert watcher.current() is good
+    assert len(calls) == 1
@@ -0,0 +1,74 @@
+import os
+import sys
+from unittest.mock import patch
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.templates import TemplateCache
+
+
+@pytest.fixture
+def template_path(tmp_path):
+    """Fixture writing a small expected image to disk."""
+    path = tmp_path / "expected.png"
+    cv2.imwrite(str(path), np.full((40, 60, 3), 128, np.uint8))
+    return str(path)
+
+
+def test_template_decoded_once(template_path):
+    """Test that the same file is only decoded one time."""
+    cache = TemplateCache()
+    with patch("reviseur.templates.cv2.imread", wraps=cv2.imread) as imread:
+        first = cache.get(template_path)
+        second = cache.get(template_path)
+
+    imread.assert_called_once_with(template_path, 0)
+    assert first is second
+    assert first.shape == (40, 60)
+
+
+def test_template_reloaded_when_file_changes(template_path):
+    """Test that a new modification time decodes the image again."""
+    cache = TemplateCache()
+    first = cache.get(template_path)
+
+    cv2.imwrite(template_path, np.zeros((20, 30, 3), np.uint8))
+    stat = os.stat(template_path)
+    os.utime(template_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    second = cache.get(template_path)
+    assert second is not first
+    assert second.shape == (20, 30)
+
+
+def test_fitted_template_is_scaled_and_cached(template_path):
+    """Test the template bigger than the screenshot is scaled down."""
+    cache = TemplateCache()
+    with patch("reviseur.templates.cv2.resize", wraps=cv2.resize) as resize:
+        fitted = cache.fitted(template_path, (20, 100))
+        again = cache.fitted(template_path, (20, 100))
+
+    resize.assert_called_once()
+    assert fitted is again
+    assert fitted.shape[0] <= 20 and fitted.shape[1] <= 100
+
+
+def test_watch_config_clears_on_change(template_path, tmp_path):
+    """Test that a change in the param.xml drops the templates."""
+    xml_file = tmp_path / "param.xml"
+    xml_file.write_text("<parameters/>")
+    cache = TemplateCache()
+    cache.watch_config(str(xml_file))
+    first = cache.get(template_path)
+
+    cache.watch_config(str(xml_file))
+    assert cache.get(template_path) is first
+
+    stat = os.stat(xml_file)
+    os.utime(xml_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    cache.watch_config(str(xml_file))
+    assert cache.get(template_path) is not first
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueListener
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.artifacts import ArtifactPool
+from reviseur.retention import Janitor
+from reviseur.utils import (
+    ContextFilter,
+    DroppingQueueHandler,
+    JsonFormatter,
+    log_context,
+    set_log_context,
+)
+
+
+def record(message):
+    """Helper building a record of the reviseur logger."""
+    return logging.makeLogRecord(
+        {"name": "reviseur", "levelno": logging.INFO, "msg": message}
+    )
+
+
+def test_full_queue_drops_and_counts():
+    """Test the records are dropped without waiting and reported later."""
+    handler = DroppingQueueHandler(queue.Queue(2))
+    for index in range(5):
+        handler.handle(record(f"frame {index}"))
+
+    assert handler.dropped == 3
+    assert handler.queue.get_nowait().msg == "frame 0"
+    assert handler.queue.get_nowait().msg == "frame 1"
+
+    handler.handle(record("next step"))
+    summary = handler.queue.get_nowait()
+    assert summary.levelno == logging.WARNING
+    assert summary.msg == "3 log records dropped, 3 so far"
+    assert handler.queue.get_nowait().msg == "next step"
+
+
+def test_json_lines_with_run_and_step():
+    """Test the record carries the run and step of its thread."""
+    handler = DroppingQueueHandler(queue.Queue())
+    handler.addFilter(ContextFilter())
+
+    def log():
+        set_log_context(run_id="abc123", step="7_geocoder")
+        handler.handle(record("Match found"))
+
+    thread = threading.Thread(target=log, name="banque_populaire")
+    thread.start()
+    thread.join()
+    handler.handle(record("Scheduler started"))
+
+    first = json.loads(JsonFormatter().format(handler.queue.get_nowait()))
+    second = json.loads(JsonFormatter().format(handler.queue.get_nowait()))
+    assert first["run_id"] == "abc123"
+    assert first["step"] == "7_geocoder"
+    assert first["thread"] == "banque_populaire"
+    assert first["message"] == "Match found"
+    assert second["run_id"] is None
+
+
+def test_context_follows_the_artifacts():
+    """Test the artifacts of a run log with its run_id."""
+    pool = ArtifactPool(workers=2)
+    futures = {}
+
+    def run(run_id):
+        set_log_context(run_id=run_id, step=None)
+        futures[run_id] = pool.submit("report", log_context.get)
+        set_log_context(run_id=None)
+
+    threads = [
+        threading.Thread(target=run, args=(run_id,))
+        for run_id in ("abc123", "def456")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.shutdown()
+
+    for run_id, future in futures.items():
+        assert future.result()["run_id"] == run_id
+    assert log_context.get().get("run_id") is None
+
+
+def test_janitor_protects_listener_files(tmp_path):
+    """Test the files written by the listener are not touched."""
+    file_handler = logging.FileHandler(tmp_path / "run.log")
+    handler = DroppingQueueHandler(queue.Queue())
+    handler.listener = QueueListener(handler.queue, file_handler)
+    logging.getLogger().addHandler(handler)
+    try:
+        protected = Janitor.protected()
+    finally:
+        logging.getLogger().removeHandler(handler)
+        file_handler.close()
+
+    assert str(tmp_path / "run.log") in protected
@@ -1,12 +1,19 @@
+import base64
 import os
 import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+import cv2
+import numpy as np
 import pytest
 
-sys.modules["shutil"] = MagicMock()
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+from reviseur.utils import log_context, set_log_context
 from reviseur.video import Video
 
 
@@ -29,34 +36,22 @@ def video(mock_driver):
 def test_video_initialization(mock_remove, mock_video_writer, video):
     """Test that the Video class initializes and sets up paths correctly."""
     assert video.path.exists()
-    assert video.screenshot_path.exists()
     mock_video_writer.assert_not_called()
 
 
 @patch("reviseur.video.cv2.VideoWriter")
-@patch("reviseur.video.mss.mss")
 @patch("reviseur.video.os.remove")
-@patch("reviseur.video.shutil.rmtree")
 @patch("reviseur.video.signal.signal")
 @patch("reviseur.video.cv2.resize")  # Patch cv2.resize here
 def test_recording_start(
     mock_resize,
     mock_signal,
-    mock_rmtree,
     mock_remove,
-    mock_mss,
     mock_video_writer,
     video,
 ):
     """Test the start of video recording."""
 
-    # Mock the mss instance and its monitors
-    mock_mss_instance = MagicMock()
-    mock_mss_instance.monitors = [
-        {"width": 1920, "height": 1080, "left": 0, "top": 0}  # Mock monitor
-    ]
-    mock_mss.side_effect = mock_mss_instance
-
     # Mock the VideoWriter return value
     mock_video_writer.return_value = MagicMock()
 
@@ -79,22 +74,12 @@ def test_recording_start(
 
 
 @patch("reviseur.video.cv2.VideoWriter")
-@patch("reviseur.video.cv2.resize")
-@patch("reviseur.video.shutil.rmtree")
-@patch("reviseur.video.mss.mss")
-def test_end_screen_record(mock_mss, mock_rmtree, mock_video_writer, video):
+@patch("reviseur.video.signal.signal")
+def test_end_screen_record(mock_signal, mock_video_writer, video):
     """
-    Test the stopping of video recording and mock mss to return a monitor.
+    Test the stopping of video recording.
     """
 
-    mock_mss_instance = MagicMock()
-    mock_mss.side_effect = mock_mss_instance
-
-    # Set up monitors to return the correct value (list of dicts)
-    mock_mss_instance.monitors = MagicMock(
-        return_value=[{"width": 1920, "height": 1080, "left": 0, "top": 0}]
-    )
-
     # Mock VideoWriter instance and the writing process
     mock_writer = MagicMock()
     mock_video_writer.return_value = mock_writer
@@ -104,24 +89,231 @@ def test_end_screen_record(mock_mss, mock_rmtree, mock_video_writer, video):
 
     # Stop the video recording and check that the recording was processed
     video.end_screen_record(persist_video=True)
-    video.record_thread.is_alive.return_value = False
     assert not video.record_thread.is_alive()
 
     # Now test with persist_video=False
     video.end_screen_record(persist_video=False)
 
 
+def encode_frame(value):
+    """Helper returning a PNG of a plain color frame."""
+    frame = np.full((36, 64, 3), value, np.uint8)
+    return cv2.imencode(".png", frame)[1].tobytes()
+
+
 @patch("reviseur.video.cv2.VideoWriter")
-@patch("reviseur.video.cv2.resize")
-@patch("reviseur.video.os.remove")
-@patch("reviseur.video.shutil.rmtree")
-def test_cleanup(
-    mock_rmtree, mock_remove, mock_video_resize, mock_video_writer, video
-):
-    """Test that cleanup happens correctly."""
-    video.clean_up()
-    # Ensure the screenshot path is cleaned and recreated
-    mock_rmtree.assert_called_once_with(str(video.screenshot_path))
-    assert video.screenshot_path.exists()
-    # Ensure the VideoWriter is not called yet
+def test_unchanged_page_is_not_decoded(mock_video_writer, video):
+    """Test only the screenshots of a changed page are fully decoded."""
+    first = encode_frame(10)
+    with patch("reviseur.video.cv2.imdecode", wraps=cv2.imdecode) as decode:
+        assert video.changed_frame(first) is not None
+        assert video.changed_frame(first) is None
+        assert video.changed_frame(encode_frame(11)) is None
+        assert video.changed_frame(encode_frame(200)).shape == (36, 64, 3)
+
+    flags = [flag for (_, flag), _ in decode.call_args_list]
+    reduced, full = cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_COLOR
+    assert flags == [reduced, full, reduced, reduced, full]
+    assert video.frame_size == (64, 36)
+
+
+@patch("reviseur.video.cv2.VideoWriter")
+def test_recording_keeps_real_timing(mock_video_writer, video):
+    """Test the video has the frames of the elapsed time at its fps."""
+    frames = iter([encode_frame(value) for value in range(0, 250, 50)])
+    video.driver.get_screenshot_as_png.side_effect = lambda: next(
+        frames, encode_frame(250)
+    )
+    video.fps = 20
+    writer = mock_video_writer.return_value
+
+    thread = threading.Thread(
+        target=video.record_screen, args=(video.stop_recording_event,)
+    )
+    thread.start()
+    time.sleep(0.5)
+    video.stop_recording_event.set()
+    thread.join()
+
+    mock_video_writer.assert_called_once()
+    assert mock_video_writer.call_args[0][2] == 20
+    assert 8 <= writer.write.call_count <= 12
+    assert video.driver.get_screenshot_as_png.call_count <= 12
+    writer.release.assert_called_once()
+
+
+@patch("reviseur.video.cv2.VideoWriter")
+def test_buffer_keeps_last_seconds(mock_video_writer, mock_driver):
+    """Test the ring buffer drops the frames out of its window."""
+    video = Video(mock_driver, buffer_seconds=10)
+    for second in range(30):
+        video.buffer_frame(encode_frame(second * 8), float(second))
+
+    assert [tick for tick, _ in video.buffer][0] == 19.0
+    assert len(video.buffer) == 11
     mock_video_writer.assert_not_called()
+
+
+def test_buffer_memory_cap(mock_driver):
+    """Test the ring buffer never exceeds its memory cap."""
+    video = Video(mock_driver, buffer_seconds=0, buffer_megabytes=1)
+    frame = encode_frame(0)
+    video.buffer_bytes = len(frame) * 3
+    for second in range(10):
+        video.buffer_frame(encode_frame(second * 8), float(second))
+
+    assert video.buffer_size <= video.buffer_bytes
+    assert video.buffer[-1][0] == 9.0
+
+
+@patch("reviseur.video.cv2.VideoWriter")
+def test_buffer_only_encoded_when_persisted(mock_video_writer, mock_driver):
+    """Test the buffered frames are encoded on persist only."""
+    for persist_video, encoded in ((False, False), (True, True)):
+        video = Video(mock_driver, fps=2, buffer_seconds=0)
+        video.record_thread = MagicMock()
+        for second in range(3):
+            video.buffer_frame(encode_frame(second * 80), 100.0 + second)
+        video.stopped_at = 104.0
+
+        video.end_screen_record(persist_video=persist_video)
+
+        assert mock_video_writer.called == encoded
+        assert not video.buffer
+
+    writer = mock_video_writer.return_value
+    assert writer.write.call_count == 9
+    writer.release.assert_called_once()
+
+
+def test_screencast_falls_back_to_polling(mock_driver):
+    """Test the screenshots are used when there is no screencast."""
+    mock_driver.bidi_connection.side_effect = RuntimeError(
+        "CDP support for Firefox has been removed."
+    )
+    video = Video(mock_driver, fps=50, buffer_seconds=0, screencast=True)
+    thread = threading.Thread(
+        target=video.record_screen, args=(video.stop_recording_event,)
+    )
+    thread.start()
+    wait_for(lambda: video.buffer)
+    video.stop_recording_event.set()
+    thread.join()
+
+    mock_driver.get_screenshot_as_png.assert_called()
+    assert video.buffer[0][1] == b"fake_png_data"
+
+
+def wait_for(condition, timeout=5):
+    """Helper polling a condition until it is true."""
+    limit = time.monotonic() + timeout
+    while not condition() and time.monotonic() < limit:
+        time.sleep(0.01)
+
+
+def record_fake_screencast(mock_driver, events, ack_delay=0):
+    """Helper recording frames already sent by a fake browser.
+
+    Returns the commands completed by the browser.
+    """
+    import trio
+    from selenium.webdriver.common.devtools.latest import page
+
+    commands = []
+
+    class FakeSession:
+        """Session of a browser that already sent its frames."""
+
+        def listen(self, event_type):
+            """Returns a channel with the frames."""
+            sender, receiver = trio.open_memory_channel(10)
+            for event in events:
+                sender.send_nowait(event)
+            return receiver
+
+        async def execute(self, command):
+            """Keep the commands once the browser answered."""
+            if commands:
+                await trio.sleep(ack_delay)
+            commands.append(command)
+
+    @asynccontextmanager
+    async def bidi_connection():
+        """Fake DevTools connection of the driver."""
+        yield SimpleNamespace(
+            session=FakeSession(), devtools=SimpleNamespace(page=page)
+        )
+
+    mock_driver.bidi_connection = bidi_connection
+    video = Video(mock_driver, fps=5, buffer_seconds=0, screencast=True)
+    thread = threading.Thread(
+        target=video.record_screen, args=(video.stop_recording_event,)
+    )
+    thread.start()
+    wait_for(lambda: len(commands) > len(events))
+    time.sleep(0.3)
+    video.stop_recording_event.set()
+    thread.join()
+    return video, commands
+
+
+def screencast_frames(count):
+    """Helper building JPEG frames sent a second apart."""
+    from selenium.webdriver.common.devtools.latest import page
+
+    now = time.time()
+    jpegs = [
+        cv2.imencode(".jpg", np.full((36, 64, 3), value, np.uint8))[1]
+        for value in range(0, 240, 240 // count)[:count]
+    ]
+    return [jpeg.tobytes() for jpeg in jpegs], [
+        page.ScreencastFrame(
+            data=base64.b64encode(jpeg.tobytes()).decode(),
+            metadata=page.ScreencastFrameMetadata(
+                0, 1, 64, 36, 0, 0, timestamp=now + index
+            ),
+            session_id=index,
+        )
+        for index, jpeg in enumerate(jpegs)
+    ]
+
+
+def test_screencast_frames_are_pushed(mock_driver):
+    """Test the frames pushed by the screencast are acked and kept."""
+    jpegs, events = screencast_frames(3)
+    video, commands = record_fake_screencast(mock_driver, events)
+
+    mock_driver.get_screenshot_as_png.assert_not_called()
+    assert [image for _, image in video.buffer] == jpegs
+    ticks = [tick for tick, _ in video.buffer]
+    assert ticks[2] - ticks[0] == pytest.approx(2)
+    assert len(commands) == 5
+
+
+def test_slow_ack_is_not_cancelled(mock_driver):
+    """Test a frame is acked even when the browser answers slower
+    than a frame interval, else it would stop sending frames."""
+    jpegs, events = screencast_frames(2)
+    video, commands = record_fake_screencast(mock_driver, events, 0.3)
+
+    assert [image for _, image in video.buffer] == jpegs
+    assert len(commands) == 4
+
+
+def test_record_thread_logs_with_the_run(mock_driver):
+    """Test the recording thread logs with the run_id of its run."""
+    contexts = []
+    set_log_context(run_id="abc123")
+    try:
+        with patch.object(
+            Video,
+            "record_screen",
+            lambda self, event: contexts.append(log_context.get()["run_id"]),
+        ):
+            video = Video(mock_driver)
+    finally:
+        set_log_context(run_id=None)
+
+    video.record_thread.start()
+    video.record_thread.join()
+    assert contexts == ["abc123"]
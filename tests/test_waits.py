@@ -0,0 +1,107 @@
+import logging
+import os
+import sys
+import time
+from unittest.mock import MagicMock
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reviseur.waits import Waiter
+
+
+@pytest.fixture
+def page():
+    """Fixture of a page with a dark square on a noisy background."""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (400, 600), dtype=np.uint8)
+    image[100:200, 200:320] = 0
+    image[130:170, 230:290] = 255
+    return image
+
+
+def test_settle_returns_when_page_is_idle(caplog):
+    """Test the waiter does not wait for the whole timeout."""
+    caplog.set_level(logging.INFO)
+    driver = MagicMock()
+    driver.execute_script.side_effect = lambda script: (
+        "complete" if "readyState" in script else 42
+    )
+    waiter = Waiter(driver, default_timeout=5, poll_frequency=0.01)
+    waiter.idle_time = 0.05
+
+    start = time.perf_counter()
+    assert waiter.settle("2_step")
+    assert time.perf_counter() - start < 1
+    assert "2_step waited" in caplog.text
+    assert "for document ready" in caplog.text
+    assert "for network idle" in caplog.text
+
+
+def test_step_timeout_is_logged(caplog):
+    """Test a page that never loads respects the step timeout."""
+    driver = MagicMock()
+    driver.execute_script.return_value = "loading"
+    waiter = Waiter(driver, timeouts={"7_geocoder": 0.1}, poll_frequency=0.01)
+
+    start = time.perf_counter()
+    assert not waiter.settle("7_geocoder")
+    assert 0.1 <= time.perf_counter() - start < 1
+    assert "7_geocoder timed out after" in caplog.text
+    assert "on document ready" in caplog.text
+
+
+def test_until_matches_polls_screenshots(page, tmp_path):
+    """Test the wait returns once the expected image shows."""
+    expected = str(tmp_path / "expected.png")
+    cv2.imwrite(expected, page[100:200, 200:320])
+    blank = cv2.imencode(".png", np.zeros_like(page))[1].tobytes()
+    loaded = cv2.imencode(".png", page)[1].tobytes()
+
+    driver = MagicMock()
+    driver.get_screenshot_as_png.side_effect = [blank, blank, loaded]
+    waiter = Waiter(driver, default_timeout=5, poll_frequency=0.01)
+
+    assert waiter.until_matches("7_geocoder", expected)
+    assert driver.get_screenshot_as_png.call_count == 3
+
+
+@pytest.mark.parametrize("offset", [(0, 0), (1, 1), (2, 3), (3, 2)])
+def test_until_matches_any_offset(offset):
+    """Test the image is found whatever its offset to the reduction."""
+    expected = os.path.join(
+        os.path.dirname(__file__), "..", "images", "lyon_perrache.PNG"
+    )
+    template = cv2.imread(expected, cv2.IMREAD_GRAYSCALE)
+    page = np.full((720, 1280), 245, np.uint8)
+    x, y = 400 + offset[0], 300 + offset[1]
+    bottom, right = y + template.shape[0], x + template.shape[1]
+    page[y:bottom, x:right] = template
+
+    driver = MagicMock()
+    driver.get_screenshot_as_png.return_value = cv2.imencode(".png", page)[
+        1
+    ].tobytes()
+    waiter = Waiter(driver, default_timeout=0.2, poll_frequency=0.01)
+
+    assert waiter.until_matches("6_submit_addr", expected)
+    assert driver.get_screenshot_as_png.call_count == 1
+
+
+def test_until_matches_rejects_other_page(page, tmp_path):
+    """Test a page without the image times out."""
+    expected = str(tmp_path / "expected.png")
+    cv2.imwrite(expected, page[100:200, 200:320])
+    other = np.roll(page, 7, axis=1)
+    other[100:200, 200:320] = 90
+
+    driver = MagicMock()
+    driver.get_screenshot_as_png.return_value = cv2.imencode(".png", other)[
+        1
+    ].tobytes()
+    waiter = Waiter(driver, default_timeout=0.1, poll_frequency=0.01)
+
+    assert not waiter.until_matches("7_geocoder", expected)
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from selenium.webdriver.common.by import By
+
+from reviseur.workflow import Step, compile_plan
+
+
+def test_step_from_attributes():
+    """Test the attributes of the tag are parsed."""
+    step = Step.from_attributes(
+        {
+            "name": "7_geocoder",
+            "action": "click",
+            "locator": 'xpath=//*[@id="cgeocoder29_street_1"]',
+            "wait": "cinqAgencesBanque",
+            "expected": "cinqAgencesBanque, quatreQuatre",
+            "threshold": "0.85",
+        }
+    )
+    assert step.locator == (By.XPATH, '//*[@id="cgeocoder29_street_1"]')
+    assert step.expected == ("cinqAgencesBanque", "quatreQuatre")
+    assert step.threshold == 0.85
+    assert step.screenshot == "7_geocoder.png"
+
+
+@pytest.mark.parametrize(
+    "attributes",
+    [
+        {"name": "1", "action": "drag", "locator": "id=x"},
+        {"name": "1", "action": "click"},
+        {"name": "1", "action": "click", "locator": "tag=a"},
+        {"name": "1", "action": "get", "wait": "visible"},
+    ],
+)
+def test_invalid_steps(attributes):
+    """Test a step that can not run is refused."""
+    with pytest.raises(ValueError):
+        Step.from_attributes(attributes)
+
+
+def test_plan_compiled_once():
+    """Test the same definition reuses the compiled plan."""
+    steps = (
+        (("name", "1_home"), ("action", "get"), ("input", "https://a.b")),
+        (("name", "2_go"), ("action", "click"), ("locator", "css=.go")),
+    )
+    plan = compile_plan(steps)
+
+    assert [step.name for step in plan] == ["1_home", "2_go"]
+    assert plan[1].locator == (By.CSS_SELECTOR, ".go")
+    assert compile_plan(tuple(steps)) is plan